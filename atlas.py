@@ -1,3 +1,5 @@
+import drag
+import engine
 import rocket
 import stage
 import math
@@ -7,23 +9,45 @@ import unittest
 # Details from:
 # https://en.wikipedia.org/wiki/Atlas_V
 
+# RD-180, two nozzles of 1.43 m.
+# https://en.wikipedia.org/wiki/RD-180
+RD180 = engine.Engine(4152e3, 338.4, 2 * ( 1.43 / 2.0 ) ** 2 * math.pi, 36.87, name="RD-180")
+
+# RL10A-4-2, the fixed 1.17 m nozzle. The RL10B-2 has a 2.21 m extension.
+# https://en.wikipedia.org/wiki/RL10
+RL10A42 = engine.Engine(99.2e3, 450.5, ( 1.17 / 2.0 ) ** 2 * math.pi, 84.0, name="RL10A-4-2")
+
+# No published curves, the generic one. Strapped on solids make the stack
+# blunter and the transonic drag rise steeper.
+ATLAS_V_DRAG = drag.launch_vehicle(name="Atlas V")
+CENTAUR_DRAG = drag.launch_vehicle(name="Centaur and payload")
+SOLIDS_DRAG = drag.launch_vehicle(1.3, name="Atlas V with solids")
+
+
+# The published burn times (253 s, 842 s) are flown partly throttled, at
+# full throttle the engines empty the tanks sooner, their mass flow sets
+# the burn.
 class AtlasVFirstStage401(stage.Stage):
 
     def __init__(self):
-        super().__init__(21054, 284089, 253, 3827.0e3, 3.81, True, "Atlas V 401 First Stage")
-        # RD-180
-        # https://en.wikipedia.org/wiki/RD-180
-        #self._ispVac = 337.8
-        #self._exit_area = ( 1.445 / 2.0 ) ** 2 * math.pi
+        super().__init__(21054, 284089, 253, 3827.0e3, 3.81, True, "Atlas V 401 First Stage", RD180, drag=ATLAS_V_DRAG)
 
 class AtlasVCentaur(stage.Stage):
 
     def __init__(self):
-        super().__init__(2316, 20830, 842, 99.2e3, 3.05, True, "Atlas V Centaur Upper Stage")
-        # RL10A-4-2
-        # https://en.wikipedia.org/wiki/RL10
-        #self._ispVac = 450.5
-        #self._exit_area = ( 2.21 / 2.0 ) ** 2 * math.pi
+        super().__init__(2316, 20830, 842, 99.2e3, 3.05, True, "Atlas V Centaur Upper Stage", RL10A42, drag=CENTAUR_DRAG)
+
+
+# AJ-60A, strapped to the first stage of the 5xx and 4x1 versions.
+# https://en.wikipedia.org/wiki/AJ-60A
+# No published thrust curve, flat over the 94 second burn. A solid can not
+# be throttled, the curve keeps the auto pilot's throttle off it.
+AJ60A_CURVE = engine.ThrustCurve([0.0, 94.0], [1.0, 1.0], 94.0)
+
+class AtlasVSolidRocketBooster(stage.Stage):
+
+    def __init__(self):
+        super().__init__(4067, 42630, 94, 1688.4e3, 1.58, True, "AJ-60A Solid Rocket Booster", thrust_curve=AJ60A_CURVE, drag=SOLIDS_DRAG)
 
 
 class AtlasVPayload42(stage.Stage):
@@ -56,6 +80,29 @@ class AtlasV401(rocket.Rocket):
         super().__init__(stages, 10.0e6, position, orientation)
 
 
+# Atlas V 5x1, the 5.4 meter fairing with 0 to 5 solid rocket boosters
+# burning together with the first stage.
+# 551 can do 18.8e3kg to LEO @ 200km 28.5 deg
+
+class AtlasV5xx(rocket.Rocket):
+
+    def __init__(self, solids, payload_mass, position, orientation=None):
+
+        if solids < 0 or solids > 5:
+            raise ValueError("Atlas V 5xx flies with 0 to 5 solid rocket boosters.")
+
+        stages = [
+            AtlasVFirstStage401(),
+            AtlasVCentaur(),
+            AtlasVPayload54(payload_mass)
+        ] + [ AtlasVSolidRocketBooster() for i in range(solids) ]
+        parents = [None, None, None] + [0] * solids
+
+        # max force is 25 Mega Newton. Guestimate.
+        # five solids add 8.4MN to the 3.8MN of the first stage at SL.
+        super().__init__(stages, 25.0e6, position, orientation, parents)
+
+
 
 
 class AtlastUnitTest(unittest.TestCase):
@@ -67,4 +114,41 @@ class AtlastUnitTest(unittest.TestCase):
         rd180.throttle = 1.0
         F = rd180.thrust(1e5)
         print(F)
-        self.assertTrue( F >= 3830  and F < 4150 )
\ No newline at end of file
+        # Between sea level and vacuum thrust, in N.
+        self.assertTrue( F >= 3830e3  and F < 4150e3 )
+
+    def test_solids_burn_with_first_stage(self):
+
+        from vect import Vec3
+        atlas = AtlasV5xx(2, 5e3, Vec3([0.0, 6371e3, 0.0]))
+        atlas.throttle = 1.0
+        self.assertIs( atlas.drag_table, SOLIDS_DRAG )
+        self.assertEqual( atlas.mass(), sum( s.mass for s in atlas.stages ) )
+        self.assertAlmostEqual( atlas.thrust(0.0).magnitude, RD180.thrust_vac + 2 * 1688.4e3 )
+        # Throttling down only reaches the RD-180, the solids burn on.
+        atlas.throttle = 0.5
+        self.assertAlmostEqual( atlas.thrust(0.0).magnitude, RD180.thrust(0.0, 0.5) + 2 * 1688.4e3 )
+        atlas.throttle = 1.0
+        self.assertAlmostEqual( atlas.time_to_burnout(), 94.0 )
+
+        for i in range(950):
+            atlas.time_step(0.1, i * 0.1)
+
+        # The solids ran dry and dropped off, the first stage burns on.
+        self.assertEqual( atlas.current_stage, 0 )
+        self.assertTrue( all( s.jettisoned for s in atlas.stages[3:] ) )
+        self.assertAlmostEqual( atlas.thrust(0.0).magnitude, RD180.thrust_vac )
+        self.assertAlmostEqual( atlas.mass(), sum( s.mass for s in atlas.stages if not s.jettisoned ) )
+        self.assertEqual( atlas.drag_surface(), atlas.stages[2].drag_surface )
+        # Without the solids the stack is back to its own drag.
+        self.assertIs( atlas.drag_table, ATLAS_V_DRAG )
+
+    def test_transonic_drag(self):
+
+        from vect import Vec3
+        atlas = AtlasV401(8e3, Vec3([0.0, 6371e3, 0.0]))
+        atlas.velocity = Vec3([0.0, 350.0, 0.0])
+        # Without the speed of sound it is the drag at rest.
+        self.assertAlmostEqual( atlas.drag(1.0).magnitude, 0.5 * 350.0 ** 2 * 0.30 * atlas.drag_surface() )
+        self.assertAlmostEqual( atlas.drag(1.0, 340.0).magnitude / atlas.drag(1.0).magnitude, ATLAS_V_DRAG.coefficient(350.0 / 340.0) / 0.30 )
+        self.assertGreater( atlas.drag_coefficient(1.1), 1.5 * atlas.drag_coefficient(0.3) )
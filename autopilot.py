@@ -0,0 +1,135 @@
+# Closed loop auto pilot
+#
+# run_simulation and BatchSimulation point the thrust where the pitch
+# program says and run at full throttle until cut off. An Autopilot
+# closes two loops on top of that, each a pid.PIDBank with a controller
+# per rocket:
+#
+#   pitch     the delta of the pitch program becomes the flight path angle
+#             to fly, relative to the rotating surface and as fraction of
+#             90 degrees. The controller tilts the thrust around it.
+#   throttle  keeps the loads, thrust + drag + weight as in the R.U.D.
+#             check, under load_limit times the max_forces of the rocket
+#             by throttling down, through max-Q for example.
+#
+# Both take arrays, run_simulation flies an Autopilot of one.
+import math
+import unittest
+import numpy as np
+from pid import PIDBank
+
+
+class Autopilot:
+
+    """
+    Autopilot constructor
+
+    count = number of rockets.
+    pitch_gains = optional [P, I, D] of the pitch controller, None keeps
+      pointing the thrust at the pitch program's delta.
+    load_limit = optional fraction of max_forces to keep the loads under.
+    load_gains = [P, I, D] of the throttle controller, on the loads as
+      fraction of max_forces. The thrust is part of the loads, a P much
+      above 1 overshoots from step to step once the drag rises with the
+      Mach number.
+    min_throttle = lowest throttle the controller goes down to, the
+      RD-180 throttles down to 47%.
+    """
+    def __init__(self, count = 1, pitch_gains = None, load_limit = None, load_gains = (1.0, 1.0, 0.0), min_throttle = 0.47):
+
+        self.pitch_control = None
+        if pitch_gains is not None:
+            self.pitch_control = PIDBank(count, *pitch_gains, windup_guard=0.5, output_limits=[-1.0, 1.0])
+
+        self.throttle_control = None
+        if load_limit is not None:
+            # Output is the throttle below full, the integrator only takes
+            # off a little before the loads reach the limit.
+            self.throttle_control = PIDBank(count, *load_gains, windup_guard=0.05, output_limits=[min_throttle - 1.0, 0.0])
+            self.throttle_control.SetPoint[:] = load_limit
+
+    """
+    Thrust delta for the pitch program's delta and the flight path angle
+    (see flight_path_array) of rockets idx, dt seconds after the last call.
+    """
+    def pitch(self, delta, flight_path, dt, idx = None):
+        if self.pitch_control is None:
+            return delta
+        u = self.pitch_control.update(flight_path, dt, setpoint=delta, idx=idx)
+        return np.clip(delta + u, -1.0, 1.0)
+
+    """
+    Throttle for rockets idx at throttle with the given loads (fraction
+    of max_forces), dt seconds after the last call. Engines that are off
+    stay off.
+    """
+    def throttle(self, load, dt, throttle, idx = None):
+        if self.throttle_control is None:
+            return throttle
+        u = self.throttle_control.update(load, dt, idx=idx)
+        return np.where(np.asarray(throttle) > 0.0, 1.0 + u, 0.0)
+
+    """
+    Running state of the controllers, see PIDBank.snapshot.
+    """
+    def snapshot(self):
+        return {
+            name: None if bank is None else bank.snapshot()
+            for name, bank in [['pitch', self.pitch_control], ['throttle', self.throttle_control]]
+        }
+
+    def restore(self, snapshot):
+        for name, bank in [['pitch', self.pitch_control], ['throttle', self.throttle_control]]:
+            if bank is not None and snapshot.get(name) is not None:
+                bank.restore(snapshot[name])
+
+    """
+    Flight path angle relative to the surface of body as fraction of 90
+    degrees, 1 straight up. positions and velocities are (N, 3) arrays.
+    """
+    @staticmethod
+    def flight_path_array(body, positions, velocities):
+        v = velocities - body.surface_speed_array(positions)
+        speed = np.sqrt(np.einsum('ij,ij->i', v, v))
+        r = np.sqrt(np.einsum('ij,ij->i', positions, positions))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sine = np.einsum('ij,ij->i', positions, v) / (r * speed)
+        # Standing still counts as going up.
+        return np.where(speed > 0.0, np.arcsin(np.clip(sine, -1.0, 1.0)) / (math.pi / 2.0), 1.0)
+
+
+
+class AutopilotUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        from body import Earth
+        self.earth = Earth()
+
+    def test_flight_path(self):
+        r = self.earth.radius
+        positions = np.array([[0.0, r, 0.0], [0.0, r, 0.0], [0.0, r, 0.0]])
+        surface = self.earth.surface_speed_array(positions)
+        velocities = surface + np.array([[0.0, 0.0, 0.0], [0.0, 100.0, 0.0], [100.0, 100.0, 0.0]])
+        self.assertTrue( np.allclose(Autopilot.flight_path_array(self.earth, positions, velocities), [1.0, 1.0, 0.5]) )
+
+    def test_throttle_holds_loads(self):
+        autopilot = Autopilot(3, load_limit=0.9)
+        for i in range(100):
+            throttle = autopilot.throttle(np.array([0.5, 0.95, 2.0]), 0.1, np.array([1.0, 1.0, 0.0]))
+        self.assertEqual( throttle[0], 1.0 )
+        # 0.05 from the error, 0.05 from the integrator.
+        self.assertAlmostEqual( throttle[1], 0.9 )
+        self.assertEqual( throttle[2], 0.0 )
+        self.assertAlmostEqual( autopilot.throttle(np.array([2.0]), 0.1, 1.0, idx=[2])[0], 0.47 )
+        # Without a limit the throttle is left alone.
+        self.assertEqual( Autopilot().throttle(2.0, 0.1, 0.7), 0.7 )
+
+    def test_pitch(self):
+        autopilot = Autopilot(2, pitch_gains=[1.0, 0.0, 0.0])
+        delta = autopilot.pitch(np.array([0.5, 0.5]), np.array([0.5, 0.8]), 0.1)
+        self.assertTrue( np.allclose(delta, [0.5, 0.2]) )
+        self.assertEqual( Autopilot().pitch(0.5, 0.8, 0.1), 0.5 )
+
+
+if __name__ == '__main__':
+    unittest.main()
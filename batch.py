@@ -0,0 +1,691 @@
+# Batch simulation
+#
+# Runs many rockets side by side. Instead of stepping one Rocket object
+# at a time the state of every rocket (position, velocity, propellant,
+# throttle, ...) is kept in NumPy arrays and all of them are advanced
+# together. Physics and the auto pilot follow run_simulation in main.py.
+#
+# Rockets that are done (broke up, landed, reached orbit) are masked out
+# and simply stop being integrated.
+import contextlib
+import io
+import math
+import numpy as np
+import constants
+import unittest
+from rocket import Rocket
+from stage import Stage
+from engine import Engine, ThrustCurve
+from drag import DragTable
+from atlas import AtlasV401, AtlasV5xx
+from vect import Vec3
+from pitch import PitchProgram
+from autopilot import Autopilot
+
+# Per rocket status codes.
+RUNNING = 0
+RUD_FORCES = 1
+RUD_LANDING = 2
+LANDED = 3
+ORBIT = 4
+
+STATUS_NAMES = {
+    RUNNING: "running",
+    RUD_FORCES: "R.U.D. too much forces",
+    RUD_LANDING: "R.U.D. landing",
+    LANDED: "landed",
+    ORBIT: "orbit",
+}
+
+
+def _norm(v):
+    return np.sqrt(np.einsum('ij,ij->i', v, v))
+
+# Row wise cross product of two (N, 3) arrays. np.cross spends most of
+# its time on axis juggling for arrays this small.
+def _cross(a, b):
+    ax, ay, az = a[:, 0], a[:, 1], a[:, 2]
+    bx, by, bz = b[:, 0], b[:, 1], b[:, 2]
+    return np.stack([ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx], axis=1)
+
+
+class BatchSimulation:
+
+    """
+    BatchSimulation constructor
+
+    body = the Body all rockets launch from.
+    rockets = list of Rocket objects, all must have the same number of stages.
+      Initial position and velocity are taken from the rockets.
+    thrust_scale = optional multiplier per rocket on the engine thrust.
+    drag_scale = optional multiplier per rocket on the drag coefficient.
+    dt = step size in seconds.
+    cutoff_velocity = engines are shut down above this velocity.
+    orbit_altitude = when set, a coasting rocket with its periapsis above
+      this altitude (in meters) is flagged as ORBIT and no longer simulated.
+    exospheric_temperature = optional exospheric temperature per rocket in K,
+      body has to take it in air_pressure_and_density_array and
+      speed_of_sound_array, like Earth.
+    pitch_programs = optional pitch.PitchProgram per rocket, their cut off
+      conditions replace cutoff_velocity.
+    autopilot = optional autopilot.Autopilot for all rockets, closing the
+      loop on the pitch and capping the loads with the throttle.
+    sites = optional launch.LaunchSites, one per rocket. The rockets start
+      on their pads instead of at their own position and velocity, and
+      pitch over towards the azimuths.
+    rotating = the atmosphere turns with the body, drag, the Mach number
+      and the dynamic pressure follow the velocity relative to the air.
+    """
+    def __init__(self, body, rockets, thrust_scale = None, drag_scale = None, dt = 0.1, cutoff_velocity = 8672.0, orbit_altitude = None, exospheric_temperature = None,
+                 pitch_programs = None, autopilot = None, sites = None, rotating = False):
+
+        n = len(rockets)
+        stage_count = len(rockets[0].stages)
+        for rocket in rockets:
+            if len(rocket.stages) != stage_count:
+                raise ValueError("All rockets in a batch need the same number of stages.")
+
+        self.__body = body
+        self.__dt = dt
+        self.__cutoff_velocity = cutoff_velocity
+        self.__orbit_altitude = orbit_altitude
+        self.__mu = constants.G * body.mass
+
+        self.t = 0.0
+        self.steps = 0
+
+        self.position = np.array([ [r.position[0], r.position[1], r.position[2]] for r in rockets ], dtype=float)
+        self.velocity = np.array([ [r.velocity[0], r.velocity[1], r.velocity[2]] for r in rockets ], dtype=float)
+        # Pitch plane normals of the sites, None pitches along the equator.
+        self.__normal = None
+        if sites is not None:
+            if len(sites) != n:
+                raise ValueError("Need one launch site per rocket.")
+            self.position = sites.positions(body)
+            self.velocity = sites.velocities(body)
+            self.__normal = sites.normal.copy()
+        self.__rotating = rotating
+        self.throttle = np.array([ r.throttle for r in rockets ], dtype=float)
+        self.stage = np.array([ r.current_stage for r in rockets ], dtype=int)
+
+        # The stage tables of all rockets stacked, one row per rocket.
+        def stage_table(name):
+            return np.array([ getattr(r.stage_table, name) for r in rockets ])
+
+        self.propellant = stage_table('propellant').astype(float)
+        self.jettisoned = stage_table('jettisoned').copy()
+        self.__dry_mass = stage_table('dry_mass')
+        self.__burn_rate = stage_table('burn_rate')
+        self.__static_thrust = stage_table('static_thrust')
+        self.__drag_surface = stage_table('area')
+        self.__jettison_after_use = stage_table('jettison_after_use')
+        self.__parent = stage_table('parent')
+        self.burning_time = stage_table('burning_time').astype(float)
+
+        # Engines and thrust curves of all rockets, stacked for lookups.
+        # None when no stage has one.
+        def stacked(items, column):
+            known = []
+            index = np.full((n, stage_count), -1, dtype=int)
+            for k, r in enumerate(rockets):
+                for j, item in enumerate(getattr(r.stage_table, items)):
+                    for m, other in enumerate(known):
+                        if other is item:
+                            break
+                    else:
+                        known.append(item)
+                        m = len(known) - 1
+                    index[k, getattr(r.stage_table, column) == j] = m
+            return known, index
+
+        engines, self.__engine = stacked('engines', 'engine')
+        self.__engines = Engine.stack(engines) if engines else None
+        curves, self.__curve = stacked('curves', 'curve')
+        self.__curves = ThrustCurve.stack(curves) if curves else None
+        # Burn time of the curve per stage, index -1 picks the inf.
+        self.__burnout = np.array([ c.burn_time for c in curves ] + [math.inf])[self.__curve]
+        # Drag tables, index -1 picks the drag.DEFAULT_CD row.
+        drags, self.__drag = stacked('drags', 'drag')
+        self.__drags = DragTable.stack(drags)
+        # Main stack stage that follows each stage, -1 for none.
+        self.__next = np.full(self.__parent.shape, -1, dtype=int)
+        for k, r in enumerate(rockets):
+            stack = r.stage_table.stack
+            self.__next[k, stack[:-1]] = stack[1:]
+        self.__columns = np.arange(stage_count)
+
+        self.__thrust_scale = None
+        if thrust_scale is not None:
+            self.__thrust_scale = np.asarray(thrust_scale, dtype=float)
+
+        self.__drag_scale = None
+        if drag_scale is not None:
+            self.__drag_scale = np.asarray(drag_scale, dtype=float)
+
+        self.__max_force = np.array([ r.max_forces for r in rockets ], dtype=float)
+
+        self.__exospheric_temperature = None
+        if exospheric_temperature is not None:
+            self.__exospheric_temperature = np.asarray(exospheric_temperature, dtype=float)
+
+        self.__pitch = None
+        if pitch_programs is not None:
+            if len(pitch_programs) != n:
+                raise ValueError("Need one pitch program per rocket.")
+            self.__pitch = PitchProgram.stack(pitch_programs)
+
+        self.status = np.full(n, RUNNING, dtype=int)
+        self.t_end = np.full(n, np.nan)
+        self.max_force = np.zeros(n)
+        self.max_dynamic_pressure = np.zeros(n)
+        self.__lit = self.lit()
+        self.__configuration = self.configuration()
+
+        self.__autopilot = autopilot
+        # Loads of the last step as fraction of max_forces.
+        self.__load = np.zeros(n)
+
+    @property
+    def count(self):
+        return len(self.status)
+
+    @property
+    def active(self):
+        return self.status == RUNNING
+
+    def mass(self):
+        return np.sum(np.where(self.jettisoned, 0.0, self.__dry_mass + self.propellant), axis=1)
+
+    def drag_surface(self):
+        return np.max(np.where(self.jettisoned, 0.0, self.__drag_surface), axis=1)
+
+    """
+    Mask of the rockets still running with their engines burning.
+    """
+    @property
+    def powered(self):
+        burning = self.lit() & (self.propellant > 0.0)
+        throttled = np.any(burning & (self.__curve < 0), axis=1) & (self.throttle > 0.0)
+        return (self.status == RUNNING) & (throttled | np.any(burning & (self.__curve >= 0), axis=1))
+
+    """
+    Mask of the lit stages, (rockets, stages): the current stage of the
+    main stack and the side boosters strapped to it that are still on.
+    idx = optional rockets to limit the mask to. step keeps a copy that
+    only changes when staging.
+    """
+    def lit(self, idx = None):
+        if idx is None:
+            idx = np.arange(self.count)
+        stage = self.stage[idx][:, None]
+        return ((self.__columns == stage) | (self.__parent[idx] == stage)) & ~self.jettisoned[idx]
+
+    """
+    Drag table of the configuration per rocket, like
+    StageTable.configuration: the first side booster still strapped to the
+    current stage that has one, else the current stage's. -1 for none.
+    step keeps a copy that only changes when staging.
+    """
+    def configuration(self, idx = None):
+        if idx is None:
+            idx = np.arange(self.count)
+        stage = self.stage[idx]
+        drag = self.__drag[idx]
+        strapped = (self.__parent[idx] == stage[:, None]) & ~self.jettisoned[idx] & (drag >= 0)
+        rows = np.arange(len(idx))
+        return np.where(np.any(strapped, axis=1), drag[rows, np.argmax(strapped, axis=1)], drag[rows, stage])
+
+    """
+    Crude pitch control from run_simulation, vectorized: delta, how far
+    up from the surface to point the thrust as fraction of 90 degrees.
+    idx = the rockets position belongs to, for their pitch programs.
+    """
+    def pitch(self, position, idx = None):
+
+        r = _norm(position)
+        radius = self.__body.radius
+        if self.__pitch is None:
+            return np.where(r > radius + 200e3, 0.1, np.where(r > radius + 1e3, 0.5, 1.0))
+        if idx is None:
+            idx = np.arange(len(position))
+        return PitchProgram.delta_array(r - radius, { name: values[idx] for name, values in self.__pitch.items() })
+
+    """
+    Thrust along the surface of the body, rotated 'upwards' by
+    delta * 90 degrees around the axis orthogonal to position and surface.
+    The surface direction is normal x position of the launch sites, or
+    (-y, x, 0) without them. delta defaults to pitch(position, idx).
+    """
+    def orientation(self, position, idx = None, delta = None):
+
+        if delta is None:
+            delta = self.pitch(position, idx)
+
+        if self.__normal is None:
+            surface = np.zeros_like(position)
+            surface[:, 0] = -position[:, 1]
+            surface[:, 1] = position[:, 0]
+        else:
+            if idx is None:
+                idx = np.arange(len(position))
+            surface = _cross(self.__normal[idx], position)
+        axis = _cross(position, surface)
+        axis /= _norm(axis)[:, None]
+
+        # Rodrigues rotation, the axis is orthogonal to surface so the
+        # (axis . surface) term drops out.
+        angle = -delta * math.pi / 2.0
+        rotated = surface * np.cos(angle)[:, None] + _cross(axis, surface) * np.sin(angle)[:, None]
+        return rotated / _norm(rotated)[:, None]
+
+    def periapsis(self, position, velocity):
+
+        r = _norm(position)
+        h = _norm(_cross(position, velocity))
+        energy = 0.5 * np.einsum('ij,ij->i', velocity, velocity) - self.__mu / r
+        e = np.sqrt(np.maximum(0.0, 1.0 + 2.0 * energy * h * h / (self.__mu * self.__mu)))
+        # periapsis = h^2 / mu / (1 + e) works for all conic sections.
+        return h * h / self.__mu / (1.0 + e)
+
+    # inf for orbits that are not closed.
+    def apoapsis(self, position, velocity):
+
+        r = _norm(position)
+        h = _norm(_cross(position, velocity))
+        energy = 0.5 * np.einsum('ij,ij->i', velocity, velocity) - self.__mu / r
+        e = np.sqrt(np.maximum(0.0, 1.0 + 2.0 * energy * h * h / (self.__mu * self.__mu)))
+        with np.errstate(divide='ignore'):
+            return np.where(e < 1.0, h * h / self.__mu / (1.0 - e), math.inf)
+
+    """
+    Inclination of the orbits in degrees, an array.
+    """
+    def inclination(self):
+        h = _cross(self.position, self.velocity)
+        return np.degrees(np.arccos(np.clip(h[:, 2] / _norm(h), -1.0, 1.0)))
+
+    """
+    Advance all running rockets by one time step.
+    """
+    def step(self):
+
+        idx = np.flatnonzero(self.status == RUNNING)
+        if len(idx) == 0:
+            return 0
+
+        dt = self.__dt
+        body = self.__body
+
+        position = self.position[idx]
+        velocity = self.velocity[idx]
+        stage = self.stage[idx]
+
+        # gravity depends on altitude!
+        A_gravity = body.accelleration_array(position)
+        if self.__exospheric_temperature is None:
+            P0, density = body.air_pressure_and_density_array(position)
+            speed_of_sound = body.speed_of_sound_array(position)
+        else:
+            P0, density = body.air_pressure_and_density_array(position, self.__exospheric_temperature[idx])
+            speed_of_sound = body.speed_of_sound_array(position, self.__exospheric_temperature[idx])
+
+        # engine cut off once fast enough.
+        speed = _norm(velocity)
+        if self.__pitch is None:
+            cutoff = speed > self.__cutoff_velocity
+        else:
+            cutoff = (speed > self.__pitch['cutoff_velocity'][idx]) | (self.apoapsis(position, velocity) >= body.radius + self.__pitch['cutoff_apoapsis'][idx])
+        self.throttle[idx[cutoff]] = 0.0
+
+        delta = self.pitch(position, idx)
+        if self.__autopilot is not None:
+            # Time since the last step, what run_simulation passes.
+            since = dt if self.steps > 0 else 0.0
+            delta = self.__autopilot.pitch(delta, self.__autopilot.flight_path_array(body, position, velocity), since, idx)
+            self.throttle[idx] = self.__autopilot.throttle(self.__load[idx], since, self.throttle[idx], idx)
+        throttle = self.throttle[idx]
+
+        orientation = self.orientation(position, idx, delta)
+
+        # The current stage and its boosters burn together, solids follow
+        # their thrust curves.
+        lit = self.__lit[idx]
+        propellant = self.propellant[idx]
+        stage_throttle = np.broadcast_to(throttle[:, None], propellant.shape)
+        if self.__curves is not None:
+            curve = self.__curve[idx]
+            fraction = ThrustCurve.fraction_array(self.__curves, np.maximum(curve, 0), self.burning_time[idx])
+            stage_throttle = np.where(curve >= 0, fraction, stage_throttle)
+        F_stage = self.__static_thrust[idx] * stage_throttle
+        if self.__engines is not None:
+            engine = self.__engine[idx]
+            F_engine = Engine.thrust_array(self.__engines, np.maximum(engine, 0), P0[:, None], stage_throttle)
+            F_stage = np.where(engine >= 0, F_engine, F_stage)
+        F_thrust = np.sum(np.where(lit & (propellant > 0.0), F_stage, 0.0), axis=1)
+        if self.__thrust_scale is not None:
+            F_thrust *= self.__thrust_scale[idx]
+        F_rocket = orientation * F_thrust[:, None]
+
+        jettisoned = self.jettisoned[idx]
+        mass = np.sum(np.where(jettisoned, 0.0, self.__dry_mass[idx] + self.propellant[idx]), axis=1)
+        drag_surface = np.max(np.where(jettisoned, 0.0, self.__drag_surface[idx]), axis=1)
+
+        air_velocity = velocity - body.surface_speed_array(position) if self.__rotating else velocity
+        air_speed = _norm(air_velocity) if self.__rotating else speed
+        drag_coefficient = DragTable.coefficient_array(self.__drags, self.__configuration[idx], air_speed / speed_of_sound)
+        if self.__drag_scale is not None:
+            drag_coefficient *= self.__drag_scale[idx]
+        F_drag = Rocket.drag_array(air_velocity, density, drag_coefficient, drag_surface)
+        F_gravity = A_gravity * mass[:, None]
+
+        F_total = np.abs(F_thrust) + _norm(F_drag) + _norm(F_gravity)
+        self.__load[idx] = F_total / self.__max_force[idx]
+        self.max_force[idx] = np.maximum(self.max_force[idx], F_total)
+        self.max_dynamic_pressure[idx] = np.maximum(self.max_dynamic_pressure[idx], 0.5 * density * air_speed * air_speed)
+
+        # if the forces become too big, the airframe will break.
+        rud = F_total > self.__max_force[idx]
+        self.status[idx[rud]] = RUD_FORCES
+        self.t_end[idx[rud]] = self.t
+
+        # Time step!
+        ok = ~rud
+        velocity = velocity + (F_rocket + F_drag + F_gravity) * (dt / mass)[:, None]
+        position = position + velocity * dt
+        self.velocity[idx[ok]] = velocity[ok]
+        self.position[idx[ok]] = position[ok]
+
+        # did we make it back to terra firma?
+        landed = ok & (_norm(position) < body.radius - 1)
+        fast = _norm(velocity) > 5
+        self.status[idx[landed & fast]] = RUD_LANDING
+        self.status[idx[landed & ~fast]] = LANDED
+        self.t_end[idx[landed]] = self.t
+
+        # Burn the fuel of the lit stages, drop empty boosters and stage
+        # when the current stage is empty.
+        burning = ok & ~landed
+        lit &= burning[:, None]
+        mass_flow = np.where(lit, stage_throttle * self.__burn_rate[idx], 0.0)
+        propellant = np.maximum(propellant - mass_flow * dt, 0.0)
+        if self.__curves is not None:
+            burning_time = self.burning_time[idx] + np.where(lit, dt, 0.0)
+            self.burning_time[idx] = burning_time
+            # Burnt out by the curve, whatever the steps left over.
+            propellant = np.where(burning_time >= self.__burnout[idx], 0.0, propellant)
+        self.propellant[idx] = propellant
+
+        empty = lit & (propellant <= 0.0) & self.__jettison_after_use[idx]
+        if np.any(empty):
+            following = self.__next[idx, stage]
+            staging = empty[np.arange(len(idx)), stage] & (following >= 0)
+            # Boosters that ran dry drop off, still strapped on ones go
+            # with their stage.
+            boosters = self.__parent[idx] == stage[:, None]
+            self.jettisoned[idx] |= (empty & boosters) | (lit & staging[:, None])
+            self.stage[idx[staging]] = following[staging]
+            self.__lit[idx] = self.lit(idx)
+            self.__configuration[idx] = self.configuration(idx)
+
+        if self.__orbit_altitude is not None:
+            coasting = burning & (throttle == 0.0)
+            if np.any(coasting):
+                c = idx[coasting]
+                rp = self.periapsis(self.position[c], self.velocity[c])
+                in_orbit = c[rp > body.radius + self.__orbit_altitude]
+                self.status[in_orbit] = ORBIT
+                self.t_end[in_orbit] = self.t
+
+        self.t += dt
+        self.steps += 1
+        return len(idx)
+
+    """
+    Run until all rockets are done or the step limit is reached.
+    Returns the status array.
+    """
+    def run(self, steps = 75000):
+
+        for i in range(steps):
+            if self.step() == 0:
+                break
+
+        return self.status
+
+    """
+    Count of rockets per status, keyed by human readable name.
+    """
+    def summary(self):
+        return { STATUS_NAMES[code]: int(np.sum(self.status == code)) for code in STATUS_NAMES }
+
+
+"""
+Build a Monte Carlo batch of AtlasV401 launches with normally distributed
+payload mass, thrust and drag coefficient dispersions, and optionally
+exospheric temperature.
+
+sigma values for thrust and drag are relative (0.01 is 1%), the
+temperature sigma is in K.
+"""
+def atlas_v401_dispersion(body, n, payload_mass, payload_sigma = 0.0, thrust_sigma = 0.0, drag_sigma = 0.0, seed = None,
+                          temperature = None, temperature_sigma = 0.0, **kwargs):
+
+    rng = np.random.default_rng(seed)
+    payloads = payload_mass + payload_sigma * rng.standard_normal(n)
+    thrust_scale = 1.0 + thrust_sigma * rng.standard_normal(n)
+    drag_scale = 1.0 + drag_sigma * rng.standard_normal(n)
+    if temperature is not None:
+        kwargs['exospheric_temperature'] = temperature + temperature_sigma * rng.standard_normal(n)
+
+    rockets = []
+    for payload in payloads:
+        rocket = AtlasV401(max(payload, 0.0), Vec3([0.0, body.radius, 0.0]))
+        rocket.velocity = body.surface_speed(rocket.position)
+        rocket.throttle = 1.0
+        rockets.append(rocket)
+
+    return BatchSimulation(body, rockets, thrust_scale, drag_scale, **kwargs)
+
+
+"""
+Build a batch of AtlasV401 launches, one from each of sites, a
+launch.LaunchSites. kwargs go to BatchSimulation.
+"""
+def atlas_v401_sites(body, sites, payload_mass, **kwargs):
+
+    rockets = []
+    for k in range(len(sites)):
+        rocket = AtlasV401(payload_mass, Vec3([0.0, body.radius, 0.0]))
+        rocket.throttle = 1.0
+        rockets.append(rocket)
+
+    return BatchSimulation(body, rockets, sites=sites, **kwargs)
+
+
+
+class BatchUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        from body import Earth
+        self.earth = Earth()
+
+    def atlas(self, payload_mass):
+        rocket = AtlasV401(payload_mass, Vec3([0.0, self.earth.radius, 0.0]))
+        rocket.velocity = self.earth.surface_speed(rocket.position)
+        rocket.throttle = 1.0
+        return rocket
+
+    # Replicate the run_simulation loop for one rocket next to sim.
+    def fly_scalar(self, rocket, sim, steps):
+        dt = 0.1
+        for i in range(steps):
+            A_gravity = self.earth.accelleration(rocket.position)
+            P0, density = self.earth.air_pressure_and_density(rocket.position)
+            orientation = Vec3([-rocket.position[1], rocket.position[0], 0])
+            rotation_axis = rocket.position.cross( orientation ).normalize()
+            delta = 1.0
+            if rocket.position.magnitude > self.earth.radius + 1e3:
+                delta = 0.5
+            orientation.rotate( - delta * math.pi/2.0, rotation_axis )
+            rocket.set_orientation(orientation.normalize())
+            Fs = rocket.thrust(P0) + rocket.drag(density, self.earth.speed_of_sound(rocket.position)) + A_gravity * rocket.mass()
+            rocket.velocity += Fs * (dt / rocket.mass())
+            rocket.position += rocket.velocity * dt
+            rocket.time_step(dt, i * dt)
+            sim.step()
+
+    def test_matches_scalar(self):
+        rocket = self.atlas(8.0e3)
+        sim = BatchSimulation(self.earth, [self.atlas(8.0e3)])
+        self.fly_scalar(rocket, sim, 300)
+
+        self.assertTrue( np.allclose(sim.position[0], rocket.position[:], rtol=1e-9) )
+        self.assertTrue( np.allclose(sim.velocity[0], rocket.velocity[:], rtol=1e-9) )
+        self.assertAlmostEqual( sim.mass()[0], rocket.mass() )
+
+    def test_side_boosters(self):
+        def atlas():
+            rocket = AtlasV5xx(3, 8.0e3, Vec3([0.0, self.earth.radius, 0.0]))
+            rocket.velocity = self.earth.surface_speed(rocket.position)
+            rocket.throttle = 1.0
+            return rocket
+
+        rocket = atlas()
+        sim = BatchSimulation(self.earth, [atlas()])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.fly_scalar(rocket, sim, 1000)
+
+        # The solids burned out after 94 seconds and dropped off.
+        self.assertTrue( np.all(sim.jettisoned[0, 3:]) )
+        self.assertEqual( sim.stage[0], 0 )
+        self.assertTrue( np.allclose(sim.position[0], rocket.position[:], rtol=1e-9) )
+        self.assertTrue( np.allclose(sim.velocity[0], rocket.velocity[:], rtol=1e-9) )
+        self.assertAlmostEqual( sim.mass()[0], rocket.mass() )
+
+    def test_thrust_curves(self):
+        # A core with two solids on a regressive thrust curve.
+        def rocket():
+            curve = ThrustCurve([0.0, 60.0], [2.0, 1.0], 60.0)
+            stages = [ Stage(20e3, 200e3, 200, 3e6, 3.0, True, "core", self.atlas(0.0).stages[0].engine),
+                       Stage(1e3, 5e3, 1e9, 0.0, 3.0, False, "payload") ]
+            stages += [ Stage(3e3, 30e3, 60, 1.2e6, 1.5, True, "solid", thrust_curve=curve) for i in range(2) ]
+            r = Rocket(stages, 1e9, Vec3([0.0, self.earth.radius, 0.0]), parents=[None, None, 0, 0])
+            r.velocity = self.earth.surface_speed(r.position)
+            r.throttle = 1.0
+            return r
+
+        scalar = rocket()
+        sim = BatchSimulation(self.earth, [rocket()])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.fly_scalar(scalar, sim, 550)
+            self.assertFalse( np.any(sim.jettisoned[0]) )
+            # The solids burn out with their curve, not with the steps.
+            self.fly_scalar(scalar, sim, 100)
+        self.assertTrue( np.all(sim.jettisoned[0, 2:]) )
+        self.assertTrue( all( s.jettisoned for s in scalar.stages[2:] ) )
+        self.assertTrue( np.allclose(sim.position[0], scalar.position[:], rtol=1e-9) )
+        self.assertTrue( np.allclose(sim.velocity[0], scalar.velocity[:], rtol=1e-9) )
+        self.assertAlmostEqual( sim.mass()[0], scalar.mass() )
+
+    def test_autopilot_caps_loads(self):
+        # A draggy rocket breaks up around max-Q at full throttle, the
+        # autopilot throttles it through.
+        def rocket():
+            atlas = self.atlas(8.0e3)
+            r = Rocket(atlas.stages, 8.0e6, atlas.position.deepcopy())
+            r.throttle = 1.0
+            return r
+
+        sim = BatchSimulation(self.earth, [ rocket(), rocket() ], drag_scale=[5.0, 1.0])
+        throttled = BatchSimulation(self.earth, [ rocket(), rocket() ], drag_scale=[5.0, 1.0], autopilot=Autopilot(2, load_limit=0.95))
+        sim.run(2000)
+        throttled.run(2000)
+        self.assertEqual( sim.status.tolist(), [RUD_FORCES, RUNNING] )
+        self.assertEqual( throttled.status.tolist(), [RUNNING, RUNNING] )
+        self.assertLess( throttled.max_force[0], 8.0e6 )
+        # The other one never came near the limit.
+        self.assertEqual( throttled.max_force[1], sim.max_force[1] )
+
+    def test_identical_rockets(self):
+        sim = BatchSimulation(self.earth, [ self.atlas(8.0e3) for i in range(4) ])
+        sim.run(1000)
+        self.assertTrue( np.all(sim.position == sim.position[0]) )
+
+    def test_staging(self):
+        # The RD-180 burns its 284 t in 227 s.
+        sim = BatchSimulation(self.earth, [ self.atlas(8.0e3) ])
+        sim.run(2260)
+        self.assertEqual( sim.stage[0], 0 )
+        sim.run(20)
+        self.assertEqual( sim.stage[0], 1 )
+        self.assertTrue( sim.jettisoned[0, 0] )
+
+    def test_payload_dispersion(self):
+        sim = BatchSimulation(self.earth, [ self.atlas(2.0e3), self.atlas(12.0e3) ])
+        sim.run(2000)
+        speed = _norm(sim.velocity)
+        self.assertTrue( speed[0] > speed[1] )
+
+    def test_temperature_dispersion(self):
+        sim = atlas_v401_dispersion(self.earth, 2, 8.0e3, seed=1, temperature=1000.0, temperature_sigma=300.0)
+        sim.run(3000)
+        # Same rockets, only the upper atmosphere differs.
+        self.assertFalse( np.all(sim.position[0] == sim.position[1]) )
+        self.assertTrue( np.allclose(sim.position[0], sim.position[1], rtol=1e-6) )
+
+    def test_pitch_programs(self):
+        # The default program is the one BatchSimulation always flew.
+        sim = BatchSimulation(self.earth, [ self.atlas(8.0e3) ])
+        programmed = BatchSimulation(self.earth, [ self.atlas(8.0e3), self.atlas(8.0e3) ],
+                                     pitch_programs=[ PitchProgram(), PitchProgram(cutoff_apoapsis=150e3) ])
+        sim.run(3000)
+        programmed.run(3000)
+        self.assertTrue( np.array_equal(sim.position[0], programmed.position[0]) )
+        self.assertTrue( np.array_equal(programmed.powered, [True, False]) )
+        apoapsis = programmed.apoapsis(programmed.position, programmed.velocity)
+        self.assertAlmostEqual( (apoapsis[1] - self.earth.radius) / 150e3, 1.0, places=2 )
+
+    def test_rud_mask(self):
+        atlas = self.atlas(8.0e3)
+        fragile = Rocket(atlas.stages, 1.0, atlas.position.deepcopy())
+        fragile.velocity = atlas.velocity.deepcopy()
+        fragile.throttle = 1.0
+        sim = BatchSimulation(self.earth, [ self.atlas(8.0e3), fragile ])
+        sim.run(10)
+        self.assertEqual( sim.status[0], RUNNING )
+        self.assertEqual( sim.status[1], RUD_FORCES )
+        self.assertEqual( sim.t_end[1], 0.0 )
+
+    def test_launch_sites(self):
+        from launch import LaunchSites
+        # Due east from [0, R, 0] is the launch BatchSimulation always flew.
+        sim = BatchSimulation(self.earth, [ self.atlas(8.0e3) ])
+        sites = LaunchSites([0.0, 28.5, 28.5], 90.0, [90.0, 90.0, 45.0])
+        swept = atlas_v401_sites(self.earth, sites, 8.0e3)
+        sim.run(2000)
+        swept.run(2000)
+        self.assertTrue( np.allclose(swept.position[0], sim.position[0], rtol=1e-9) )
+        self.assertTrue( np.allclose(swept.velocity[0], sim.velocity[0], rtol=1e-9) )
+        # Due east stays in the plane of the latitude, the surface speed
+        # pulls north east launches towards the equator.
+        inclination = swept.inclination()
+        self.assertAlmostEqual( inclination[1], 28.5, places=6 )
+        self.assertTrue( 28.5 < inclination[2] < sites.inclination()[2] )
+
+        with self.assertRaises(ValueError):
+            BatchSimulation(self.earth, [ self.atlas(8.0e3) ], sites=sites)
+
+    def test_rotating_atmosphere(self):
+        from launch import LaunchSites
+        sites = LaunchSites([0.0, 0.0], 90.0, [90.0, 270.0])
+        still = atlas_v401_sites(self.earth, sites, 8.0e3)
+        rotating = atlas_v401_sites(self.earth, sites, 8.0e3, rotating=True)
+        still.run(1000)
+        rotating.run(1000)
+        # The air moves along east, less dynamic pressure, more going west.
+        self.assertLess( rotating.max_dynamic_pressure[0], still.max_dynamic_pressure[0] )
+        self.assertGreater( rotating.max_dynamic_pressure[1], still.max_dynamic_pressure[1] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,461 @@
+# Benchmarks
+#
+# Times the hot spots of the simulation, from single Vector operations up
+# to a full AtlasV401 launch and batch throughput.
+#
+# python benchmark.py                          run all benchmarks
+# python benchmark.py jacchia body             run only the named benchmarks
+# python benchmark.py --output results.json    also save results and machine info
+# python benchmark.py compare baseline.json results.json
+#
+# compare exits with status 1 when a benchmark got slower than the
+# baseline by more than the threshold, so it can gate changes.
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import math
+import timeit
+import unittest
+import numpy as np
+
+# Timings of the current run, name -> result, see _report.
+_results = {}
+
+# Seconds per call, best out of a few repeats.
+def _time(fn, number, repeat=5):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+# rate = optional steps per second to report along the time.
+def _report(name, seconds, baseline=None, rate=None):
+    line = "{:45s} {:12.3f} us".format(name, seconds * 1e6)
+    if baseline is not None:
+        line += "  ({:.1f}x)".format(baseline / seconds)
+    if rate is not None:
+        line += "  {:.0f} steps/s".format(rate)
+    print(line)
+    result = { 'seconds': seconds }
+    if rate is not None:
+        result['steps_per_second'] = rate
+    _results[name] = result
+
+
+# Against the row scan the compiled scalar lookup is 6-10x faster, the
+# array lookup 40-70x per altitude.
+def bench_jacchia():
+    import jacchia
+
+    rng = np.random.default_rng(0)
+    ranges = [
+        ("ascent", 0.0, 200e3),
+        ("full table", 0.0, 2500e3),
+    ]
+
+    for label, low, high in ranges:
+        altitudes = rng.uniform(low, high, 1000).tolist()
+
+        def scan():
+            for altitude in altitudes:
+                jacchia._air_pressure_and_density_scan(altitude)
+
+        def compiled():
+            for altitude in altitudes:
+                jacchia.air_pressure_and_density(altitude)
+
+        array = np.array(altitudes)
+        def vectorized():
+            jacchia.air_pressure_and_density_array(array)
+
+        t_scan = _time(scan, 10) / len(altitudes)
+        _report("jacchia scan, {}".format(label), t_scan)
+        _report("jacchia compiled, {}".format(label), _time(compiled, 10) / len(altitudes), t_scan)
+        _report("jacchia array, {} (per altitude)".format(label), _time(vectorized, 100) / len(altitudes), t_scan)
+
+
+# The vector work of one run_simulation step: auto pilot orientation,
+# gravity, thrust, drag and the Euler update.
+def _vector_step(cls, position, velocity, mu):
+    orientation = cls([-position[1], position[0], 0.0])
+    axis = position.cross(orientation).normalize()
+    orientation.rotate(-0.1 * math.pi / 2.0, axis)
+    orientation.normalize()
+
+    r = position.magnitude
+    gravity = cls(position).mult(-mu / (r * r * r))
+    thrust = cls(orientation).mult(99.2e3)
+    drag = cls(velocity).mult(-1e-3 * velocity.magnitude)
+
+    force = thrust + drag + gravity * 20e3
+    velocity += force * (0.1 / 20e3)
+    position += velocity * 0.1
+
+# Same step with the fused in-place operations of Vec3.
+def _vec3_step_fused(position, velocity, mu, orientation, scratch):
+    orientation.assign((-position.y, position.x, 0.0))
+    axis = position.cross(orientation).normalize()
+    orientation.rotate(-0.1 * math.pi / 2.0, axis)
+    orientation.normalize()
+
+    r = position.magnitude
+    scratch.assign(orientation).mult(99.2e3)
+    scratch.add_scaled(velocity, -1e-3 * velocity.magnitude)
+    scratch.add_scaled(position, -mu / (r * r * r) * 20e3)
+    velocity.add_scaled(scratch, 0.1 / 20e3)
+    position.add_scaled(velocity, 0.1)
+
+def bench_vector():
+    import constants
+    from vect import Vector, Vec3
+
+    mu = constants.G * constants.earth_mass
+    start = [0.0, constants.earth_radius + 200e3, 0.0]
+    speed = [7800.0, 0.0, 0.0]
+
+    for cls in [Vector, Vec3]:
+        a = cls([1.0, 2.0, 3.0])
+        b = cls([4.0, 5.0, 6.0])
+        axis = cls([0.0, 0.0, 1.0])
+        name = cls.__name__
+        _report("{} a + b".format(name), _time(lambda: a + b, 10000))
+        _report("{} a * 2.0".format(name), _time(lambda: a * 2.0, 10000))
+        _report("{} magnitude".format(name), _time(lambda: a.magnitude, 10000))
+        _report("{} cross".format(name), _time(lambda: a.cross(b), 10000))
+        _report("{} rotate".format(name), _time(lambda: a.rotate(0.1, axis), 10000))
+
+    position, velocity = Vector(start), Vector(speed)
+    t_vector = _time(lambda: _vector_step(Vector, position, velocity, mu), 2000)
+    _report("Vector per step", t_vector)
+
+    position, velocity = Vec3(start), Vec3(speed)
+    _report("Vec3 per step", _time(lambda: _vector_step(Vec3, position, velocity, mu), 2000), t_vector)
+
+    position, velocity = Vec3(start), Vec3(speed)
+    orientation, scratch = Vec3(), Vec3()
+    _report("Vec3 per step, fused", _time(lambda: _vec3_step_fused(position, velocity, mu, orientation, scratch), 2000), t_vector)
+
+
+def bench_telemetry():
+    import os
+    import tempfile
+    from telemetry import ChunkedBuffer, NpyFileSink
+    from trajectory import TrajectoryWriter, Trajectory
+
+    # rows of a full 75000 step run_simulation.
+    steps = 75000
+    rows = np.random.default_rng(0).uniform(0.0, 1e4, (steps, 7)).tolist()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'launch')
+
+    # What run_simulation used to do: seven lists, np.c_ and savetxt.
+    def savetxt():
+        lists = [ [] for i in range(7) ]
+        for row in rows:
+            for i in range(7):
+                lists[i].append(row[i])
+        np.savetxt(path + '.txt', np.c_[tuple(lists)], delimiter=',')
+
+    def chunked():
+        sink = ChunkedBuffer()
+        for row in rows:
+            sink.record(*row)
+        sink.columns()
+
+    def npy():
+        sink = NpyFileSink(path + '.npy')
+        for row in rows:
+            sink.record(*row)
+        sink.close()
+
+    def trajectory():
+        sink = TrajectoryWriter(path + '.traj')
+        for row in rows:
+            sink.record(*row)
+        sink.close()
+
+    t_savetxt = _time(savetxt, 1, 3)
+    _report("telemetry lists + savetxt, 75k rows", t_savetxt)
+    _report("telemetry ChunkedBuffer, 75k rows", _time(chunked, 1, 3), t_savetxt)
+    _report("telemetry NpyFileSink, 75k rows", _time(npy, 1, 3), t_savetxt)
+    _report("telemetry TrajectoryWriter, 75k rows", _time(trajectory, 1, 3), t_savetxt)
+
+    # Reloading: loadtxt against memory mapping the trajectory file.
+    t_loadtxt = _time(lambda: np.loadtxt(path + '.txt', delimiter=','), 1, 3)
+    _report("telemetry np.loadtxt, 75k rows", t_loadtxt)
+    _report("telemetry Trajectory open + column, 75k rows", _time(lambda: np.sum(Trajectory(path + '.traj')['mass']), 1, 3), t_loadtxt)
+
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+def bench_body():
+    from body import Earth
+    from vect import Vector, Vec3
+
+    earth = Earth()
+    for cls in [Vector, Vec3]:
+        position = cls([1e5, earth.radius + 150e3, 0.0])
+        _report("Body.accelleration, {}".format(cls.__name__), _time(lambda: earth.accelleration(position), 10000))
+
+    oblate = Earth(harmonics=True)
+    _report("Body.accelleration, J2-J4", _time(lambda: oblate.accelleration(position), 10000))
+    _report("Earth.air_pressure_and_density", _time(lambda: earth.air_pressure_and_density(position), 10000))
+
+    positions = np.random.default_rng(0).uniform(-1.0, 1.0, (10000, 3)) * (earth.radius + 150e3)
+    _report("Body.accelleration_array, per position", _time(lambda: earth.accelleration_array(positions), 10) / len(positions))
+    _report("Body.accelleration_array J2-J4, per position", _time(lambda: oblate.accelleration_array(positions), 10) / len(positions))
+
+
+# Per step cost of a Rocket, thrust, mass and time_step. It grows with
+# the number of lit stages, not with the number of stages.
+def bench_rocket():
+    from rocket import Rocket
+    from stage import Stage
+    from vect import Vec3
+
+    def stage(name):
+        return Stage(4e3, 42e3, 1e9, 1.7e6, 1.6, True, name)
+
+    for label, stacked, boosters in [["2 stages", 2, 0], ["32 stages", 32, 0], ["32 stages, 31 lit", 2, 30]]:
+        stages = [ stage("stage {}".format(i)) for i in range(stacked + boosters) ]
+        rocket = Rocket(stages, 1e9, Vec3([0.0, 6.4e6, 0.0]), parents=[None] * stacked + [0] * boosters)
+        rocket.throttle = 1.0
+
+        def step():
+            rocket.thrust(0.0)
+            rocket.mass()
+            rocket.drag_surface()
+            rocket.time_step(1e-6, 0.0)
+
+        _report("Rocket step, {}".format(label), _time(step, 10000))
+
+    from atlas import RD180
+    from engine import Engine
+    _report("Engine.thrust", _time(lambda: RD180.thrust(50e3, 0.8), 10000))
+    tables = Engine.stack([RD180])
+    rng = np.random.default_rng(0)
+    engine, p, throttle = np.zeros(10000, dtype=int), rng.uniform(0.0, 101325.0, 10000), rng.uniform(0.0, 1.0, 10000)
+    _report("Engine.thrust_array, per stage", _time(lambda: Engine.thrust_array(tables, engine, p, throttle), 10) / len(p))
+
+
+# A full launch as main.py runs it, without plotting.
+def _launch(integrator, coast = False, rates = None, duration = 7500.0):
+    import contextlib
+    import io
+    from main import run_simulation
+    from body import Earth
+    from atlas import AtlasV401
+    from vect import Vec3
+
+    earth = Earth()
+    rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+    rocket.velocity = earth.surface_speed(rocket.position)
+    with contextlib.redirect_stdout(io.StringIO()):
+        time_list = run_simulation(earth, rocket, 150e3, integrator, duration, coast = coast, rates = rates)[0]
+    return len(time_list)
+
+def bench_launch():
+    from integrator import SymplecticEuler, RK45
+
+    for label, make, coast in [
+            ("Euler 0.1s", lambda: SymplecticEuler(0.1), False),
+            ("Euler 0.1s, coast", lambda: SymplecticEuler(0.1), True),
+            ("RK45", RK45, False),
+            ("RK45, coast", RK45, True)]:
+        steps = _launch(make(), coast)
+        seconds = _time(lambda: _launch(make(), coast), 1, 3)
+        _report("launch AtlasV401 7500s, {}".format(label), seconds, rate=steps / seconds)
+
+
+# Physics at 100 Hz, with guidance, atmosphere and telemetry at their own
+# rates, see scheduler.py.
+def bench_multirate():
+    from integrator import SymplecticEuler
+    from scheduler import multirate
+
+    baseline = None
+    for label, rates in [("every step", lambda: None), ("multirate", lambda: multirate(physics=0.01))]:
+        # Telemetry has a row a second, count the steps instead.
+        steps = 600.0 / 0.01
+        seconds = _time(lambda: _launch(SymplecticEuler(0.01), rates=rates(), duration=600.0), 1, 2)
+        _report("launch AtlasV401 600s at 100 Hz, {}".format(label), seconds, baseline, rate=steps / seconds)
+        baseline = baseline or seconds
+
+
+def bench_batch():
+    from body import Earth
+    from batch import atlas_v401_dispersion
+
+    earth = Earth()
+    steps = 100
+    for n in [100, 1000, 10000]:
+        batch = atlas_v401_dispersion(earth, n, 8.0e3, 500.0, 0.01, 0.05, seed=0)
+        seconds = _time(lambda: batch.run(steps), 1, 3) / steps
+        _report("batch {} rockets, per step".format(n), seconds, rate=n / seconds)
+
+    batch = atlas_v401_dispersion(Earth(harmonics=True), n, 8.0e3, 500.0, 0.01, 0.05, seed=0)
+    seconds = _time(lambda: batch.run(steps), 1, 3) / steps
+    _report("batch {} rockets, J2-J4, per step".format(n), seconds, rate=n / seconds)
+
+    from autopilot import Autopilot
+    n = 10000
+    batch = atlas_v401_dispersion(earth, n, 8.0e3, 500.0, 0.01, 0.05, seed=0,
+                                  autopilot=Autopilot(n, pitch_gains=[1.0, 0.1, 0.0], load_limit=0.9))
+    seconds = _time(lambda: batch.run(steps), 1, 3) / steps
+    _report("batch {} rockets, autopilot, per step".format(n), seconds, rate=n / seconds)
+
+
+def bench_sites():
+    from body import Earth
+    from batch import atlas_v401_sites
+    from launch import LaunchSites
+
+    earth = Earth()
+    latitudes = np.linspace(-60.0, 60.0, 100)
+    azimuths = np.linspace(0.0, 180.0, 100)
+    def geometry():
+        sites = LaunchSites.grid(latitudes, azimuths)
+        return sites.positions(earth), sites.velocities(earth)
+    _report("LaunchSites 10000 sites, per site", _time(geometry, 10) / 10000)
+
+    sites = LaunchSites.grid(latitudes[::10], azimuths)
+    _report("atlas_v401_sites setup, per rocket", _time(lambda: atlas_v401_sites(earth, sites, 8.0e3), 1, 3) / len(sites))
+    steps = 100
+    batch = atlas_v401_sites(earth, sites, 8.0e3, rotating=True)
+    seconds = _time(lambda: batch.run(steps), 1, 3) / steps
+    _report("batch {} sites, rotating air, per step".format(len(sites)), seconds, rate=len(sites) / seconds)
+
+
+BENCHMARKS = {
+    'jacchia': bench_jacchia,
+    'vector': bench_vector,
+    'body': bench_body,
+    'telemetry': bench_telemetry,
+    'rocket': bench_rocket,
+    'launch': bench_launch,
+    'multirate': bench_multirate,
+    'batch': bench_batch,
+    'sites': bench_sites,
+}
+
+
+# What the results were measured on.
+def machine_info():
+    info = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if commit.returncode == 0:
+            info['commit'] = commit.stdout.strip()
+    except OSError:
+        pass
+    return info
+
+
+def run(names):
+    _results.clear()
+    for name in names:
+        BENCHMARKS[name]()
+    return { 'machine': machine_info(), 'names': list(names), 'benchmarks': dict(_results) }
+
+
+"""
+Compare two results files. Returns a list of [name, baseline seconds,
+current seconds, current / baseline, regressed], regressed when the
+current run is more than threshold (0.1 = 10%) slower.
+"""
+def compare(baseline, current, threshold = 0.1):
+    rows = []
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['seconds']
+        ratio = result['seconds'] / before
+        rows.append([name, before, result['seconds'], ratio, ratio > 1.0 + threshold])
+    return rows
+
+def _load(path):
+    with open(path, 'rt') as f:
+        return json.load(f)
+
+def _compare_command(args):
+    parser = argparse.ArgumentParser(prog='benchmark.py compare', description="Flag benchmarks that got slower than a baseline.")
+    parser.add_argument('baseline', help="results JSON of the baseline")
+    parser.add_argument('current', nargs='?', help="results JSON to check, runs the benchmarks when not given")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed slow down, 0.1 = 10%%")
+    args = parser.parse_args(args)
+
+    baseline = _load(args.baseline)
+    if args.current is None:
+        current = run(baseline.get('names', list(BENCHMARKS)))
+    else:
+        current = _load(args.current)
+
+    for key in ['machine', 'processor', 'python', 'numpy']:
+        if baseline['machine'].get(key) != current['machine'].get(key):
+            print("warning: {} differs, {} vs {}".format(key, baseline['machine'].get(key), current['machine'].get(key)))
+
+    rows = compare(baseline, current, args.threshold)
+    regressions = 0
+    for name, before, after, ratio, regressed in rows:
+        print("{:45s} {:12.3f} us {:12.3f} us {:6.2f}x {}".format(name, before * 1e6, after * 1e6, ratio, "REGRESSION" if regressed else ""))
+        regressions += regressed
+    print("{} of {} benchmarks regressed more than {:.0f}%".format(regressions, len(rows), 100.0 * args.threshold))
+    return 1 if regressions else 0
+
+
+
+class BenchmarkUnitTest(unittest.TestCase):
+
+    def results(self, seconds):
+        return { 'machine': {}, 'benchmarks': { name: { 'seconds': s } for name, s in seconds.items() } }
+
+    def test_compare(self):
+        baseline = self.results({ 'a': 1.0, 'b': 1.0, 'c': 1.0 })
+        current = self.results({ 'a': 1.05, 'b': 1.5, 'c': 0.5, 'new': 1.0 })
+        rows = { row[0]: row for row in compare(baseline, current, 0.1) }
+        self.assertEqual( sorted(rows), ['a', 'b', 'c'] )
+        self.assertFalse( rows['a'][4] )
+        self.assertTrue( rows['b'][4] )
+        self.assertFalse( rows['c'][4] )
+        self.assertAlmostEqual( rows['b'][3], 1.5 )
+
+    def test_run(self):
+        import contextlib
+        import io
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run(['body'])
+        self.assertIn( 'Body.accelleration, Vec3', results['benchmarks'] )
+        self.assertIn( 'python', results['machine'] )
+        json.dumps(results)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        sys.exit(_compare_command(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument('names', nargs='*', help="benchmarks to run, all when none given: {}".format(", ".join(BENCHMARKS)))
+    parser.add_argument('--output', default=None, help="save the results with machine info as JSON")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {}".format(name))
+
+    results = run(args.names or list(BENCHMARKS))
+    if args.output is not None:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2)
@@ -3,22 +3,58 @@ import numpy as np
 import constants
 import math
 import jacchia
-from vect import Vector
+from vect import Vec3
 import unittest
 
 
 # Base class for Bodies in space. Like planets, or moons.
+#
+# Gravity is a point mass, or with zonal = [J2, J3, J4] the zonal
+# harmonics of an oblate body added, the z axis being its axis of
+# rotation. From the potential
+#
+#   U = -mu / r * (1 - sum Jn (R / r)^n Pn(z / r))
+#
+# the acceleration works out to
+#
+#   a = mu / r^2 * ((-1 + sum Jn (R / r)^n Pn+1'(u)) r_hat - sum Jn (R / r)^n Pn'(u) z_hat)
+#
+# with u = z / r and Pn' the derivatives of the Legendre polynomials. The
+# Jn R^n times the polynomial coefficients are precomputed. Written in
+# 1 / r^2 and u^2 = z^2 / r^2 the odd powers of u and r pair up, evaluating
+# it takes one square root and one division like the point mass.
+#
+# https://en.wikipedia.org/wiki/Geopotential_model
 class Body:
 
     # Constructor
     # Radius = radius of body in meters
     # Mass = Mass of body in Kg
     # Name = human readable description of body.
-    def __init__(self, radius, mass, rotation_period, name=""):
+    # zonal = optional [J2, J3, J4] zonal harmonic coefficients, referenced
+    #   to radius, missing ones are 0.
+    def __init__(self, radius, mass, rotation_period, name="", zonal = None):
         self.__name = name
         self.__radius = radius
         self.__mass = mass
         self.__rotation_period = rotation_period * 1.0
+        self.__angular_velocity = math.pi * 2 / self.__rotation_period
+        self.__mu = mass * constants.G
+
+        self.__zonal = None
+        self.__harmonics = None
+        if zonal is not None:
+            j2, j3, j4 = (list(zonal) + [0.0, 0.0, 0.0])[:3]
+            self.__zonal = [j2, j3, j4]
+            k2 = j2 * radius ** 2
+            k3 = j3 * radius ** 3
+            k4 = j4 * radius ** 4
+            # Jn R^n times the coefficients of Pn+1'(u) and Pn'(u), the
+            # radial and the polar terms, lowest power of u first.
+            self.__harmonics = [
+                [ -1.5 * k2, 7.5 * k2 ], [ -7.5 * k3, 17.5 * k3 ], [ 1.875 * k4, -26.25 * k4, 39.375 * k4 ],
+                [ 3.0 * k2 ], [ -1.5 * k3, 7.5 * k3 ], [ -7.5 * k4, 17.5 * k4 ],
+            ]
 
     @property
     def name(self):
@@ -32,6 +68,11 @@ class Body:
     def radius(self):
         return self.__radius
 
+    # [J2, J3, J4], None for a point mass.
+    @property
+    def zonal(self):
+        return self.__zonal
+
     # Must be overriden in child class.
     # returns [air pressure in Pascal, air density in kg/m3]
     # altitude is height above surface of body in meters.
@@ -43,28 +84,199 @@ class Body:
     # https://en.wikipedia.org/wiki/Newton%27s_law_of_universal_gravitation
     # returns gravity in m/s^2
     def accelleration(self, position):
-        
-        radius = position.magnitude
-        v = Vector( position )
-        a = -( self.__mass * constants.G) / (radius*radius)
-        v.mult( a / position.magnitude )
-        
+
+        x = position[0]
+        y = position[1]
+        z = position[2]
+        radius = math.sqrt(x * x + y * y + z * z)
+        v = Vec3()
+        if self.__harmonics is None:
+            a = -self.__mu / (radius * radius) / radius
+            v.x = x * a
+            v.y = y * a
+            v.z = z * a
+            return v
+
+        k2, k3, k4, l2, l3, l4 = self.__harmonics
+        q = 1.0 / (radius * radius)
+        u2 = z * z * q
+        radial = -1.0 + q * (k2[0] + k2[1] * u2 + q * (z * (k3[0] + k3[1] * u2) + k4[0] + u2 * (k4[1] + k4[2] * u2)))
+        polar = q * (l2[0] * z + l3[0] + l3[1] * u2 + q * z * (l4[0] + l4[1] * u2))
+        m = self.__mu * q / radius
+        radial *= m
+        v.x = x * radial
+        v.y = y * radial
+        v.z = z * radial - polar * m
         return v
 
+    # Vectorized counterpart of accelleration.
+    # positions is an (N, 3) array, returns an (N, 3) array in m/s^2
+    def accelleration_array(self, positions):
+
+        if self.__harmonics is None:
+            r2 = np.einsum('ij,ij->i', positions, positions)
+            a = -self.__mu / (r2 * np.sqrt(r2))
+            return positions * a[:, None]
+
+        # Same terms as accelleration, in place on the columns. einsum and
+        # positions * a[:, None] would cost more than the harmonics.
+        multiply = np.multiply
+        x = positions[:, 0]
+        y = positions[:, 1]
+        z = positions[:, 2]
+        k2, k3, k4, l2, l3, l4 = self.__harmonics
+
+        q = x * x
+        t = y * y
+        q += t
+        multiply(z, z, out=t)
+        q += t
+        np.divide(1.0, q, out=q)
+        u2 = t
+        u2 *= q
+
+        radial = k4[2] * u2
+        radial += k4[1]
+        radial *= u2
+        radial += k4[0]
+        w = k3[1] * u2
+        w += k3[0]
+        w *= z
+        radial += w
+        radial *= q
+        multiply(k2[1], u2, out=w)
+        w += k2[0]
+        radial += w
+        radial *= q
+        radial -= 1.0
+
+        polar = l4[1] * u2
+        polar += l4[0]
+        polar *= z
+        polar *= q
+        multiply(l3[1], u2, out=w)
+        w += l3[0]
+        polar += w
+        multiply(l2[0], z, out=w)
+        polar += w
+        polar *= q
+
+        # mu / r^3
+        m = np.sqrt(q, out=w)
+        m *= q
+        m *= self.__mu
+        radial *= m
+        polar *= m
+        a = np.empty(positions.shape)
+        multiply(x, radial, out=a[:, 0])
+        multiply(y, radial, out=a[:, 1])
+        multiply(z, radial, out=q)
+        q -= polar
+        a[:, 2] = q
+        return a
+
+    # Vectorized counterpart of air_pressure_and_density, must be
+    # overriden in child class.
+    # positions is an (N, 3) array, returns [pressure array, density array]
+    def air_pressure_and_density_array(self, positions):
+        print("Body::air_pressure_and_density_array not defined.")
+        exit(-1)
+
+    # Must be overriden in child class.
+    # returns the speed of sound in m/s at position.
+    def speed_of_sound(self, position):
+        print("Body::speed_of_sound not defined.")
+        exit(-1)
+
+    # Vectorized counterpart of speed_of_sound, must be overriden in child
+    # class. positions is an (N, 3) array, returns an array in m/s
+    def speed_of_sound_array(self, positions):
+        print("Body::speed_of_sound_array not defined.")
+        exit(-1)
+
+    # Angular velocity of the body in rad/s, around the z axis.
+    @property
+    def angular_velocity(self):
+        return self.__angular_velocity
+
+    # Velocity of anything turning with the body at position, the ground
+    # or the air: omega x position. Zero at the poles.
     def surface_speed( self, position ):
-        # just returning equator right now.
-        # todo fix for inclination.
-        speed = math.pi * 2 * self.__radius / self.__rotation_period
-        return Vector( [ -position[1], position[0], 0.0 ] ).normalize().mult(speed)         
+        w = self.__angular_velocity
+        return Vec3( [ -w * position[1], w * position[0], 0.0 ] )
+
+    # Vectorized counterpart of surface_speed.
+    # positions is an (N, 3) array, returns an (N, 3) array in m/s
+    def surface_speed_array(self, positions):
+        v = np.zeros_like(positions, dtype=float)
+        v[:, 0] = -self.__angular_velocity * positions[:, 1]
+        v[:, 1] = self.__angular_velocity * positions[:, 0]
+        return v
+
+    # Inertial positions, an (N, 3) array, rotated into the body fixed
+    # frame t seconds after the two frames lined up.
+    def body_fixed_array(self, positions, t = 0.0):
+        angle = -self.__angular_velocity * t
+        c = math.cos(angle)
+        s = math.sin(angle)
+        fixed = np.array(positions, dtype=float)
+        fixed[:, 0] = c * positions[:, 0] - s * positions[:, 1]
+        fixed[:, 1] = s * positions[:, 0] + c * positions[:, 1]
+        return fixed
+
+    # Geocentric latitude and longitude in degrees and altitude in meters
+    # of inertial positions, an (N, 3) array, at time t. Returns arrays.
+    def geographic_array(self, positions, t = 0.0):
+        fixed = self.body_fixed_array(positions, t)
+        r = np.sqrt(np.einsum('ij,ij->i', fixed, fixed))
+        latitude = np.degrees(np.arcsin(fixed[:, 2] / r))
+        longitude = np.degrees(np.arctan2(fixed[:, 1], fixed[:, 0]))
+        return latitude, longitude, r - self.__radius
 
 class Earth(Body):
-    
-    def __init__(self):
-        super().__init__(constants.earth_radius, constants.earth_mass, 24 * 60 * 60, "Earth")
+
+    # exospheric_temperature = in K, None for the static 1000 K table.
+    #   Other temperatures are generated by the Jacchia 1977 model.
+    # interpolate = interpolate the temperature from jacchia.grid() instead
+    #   of generating a profile for it, for Monte Carlo runs.
+    # harmonics = add the J2, J3 and J4 zonal harmonics to the gravity.
+    def __init__(self, exospheric_temperature = None, interpolate = False, harmonics = False):
+        super().__init__(constants.earth_radius, constants.earth_mass, 24 * 60 * 60, "Earth",
+                         [constants.earth_j2, constants.earth_j3, constants.earth_j4] if harmonics else None)
+        self.exospheric_temperature = exospheric_temperature
+        if exospheric_temperature is None:
+            atmosphere = jacchia
+        elif interpolate:
+            atmosphere = jacchia.grid().at(exospheric_temperature)
+        else:
+            atmosphere = jacchia.profile(exospheric_temperature)
+        self.__air_pressure_and_density = atmosphere.air_pressure_and_density
+        self.__air_pressure_and_density_array = atmosphere.air_pressure_and_density_array
+        self.__speed_of_sound = atmosphere.speed_of_sound
+        self.__speed_of_sound_array = atmosphere.speed_of_sound_array
 
     def air_pressure_and_density(self, position):
         altitude = position.magnitude - self.radius
-        return jacchia.air_pressure_and_density(altitude)
+        return self.__air_pressure_and_density(altitude)
+
+    # exospheric_temperature = optional temperature per position in K,
+    #   interpolated from jacchia.grid().
+    def air_pressure_and_density_array(self, positions, exospheric_temperature = None):
+        altitude = np.sqrt(np.einsum('ij,ij->i', positions, positions)) - self.radius
+        if exospheric_temperature is not None:
+            return jacchia.grid().air_pressure_and_density_array(altitude, exospheric_temperature)
+        return self.__air_pressure_and_density_array(altitude)
+
+    def speed_of_sound(self, position):
+        return self.__speed_of_sound(position.magnitude - self.radius)
+
+    # exospheric_temperature = optional temperature per position in K,
+    #   interpolated from jacchia.grid().
+    def speed_of_sound_array(self, positions, exospheric_temperature = None):
+        altitude = np.sqrt(np.einsum('ij,ij->i', positions, positions)) - self.radius
+        if exospheric_temperature is not None:
+            return jacchia.grid().speed_of_sound_array(altitude, exospheric_temperature)
+        return self.__speed_of_sound_array(altitude)
 
 
 
@@ -73,19 +285,83 @@ class EarthUnitTest(unittest.TestCase):
     def test_pressure(self):
         
         earth = Earth()  
-        pos = Vector([0.0, earth.radius, 0.0])
+        pos = Vec3([0.0, earth.radius, 0.0])
         p, d = earth.air_pressure_and_density(pos)
         print(p,d)
         self.assertTrue( p >= 101e3 and p < 102e3 )
 
+    def test_exospheric_temperature(self):
+        pos = Vec3([0.0, constants.earth_radius + 400e3, 0.0])
+        p, d = Earth().air_pressure_and_density(pos)
+        p_1000, d_1000 = Earth(1000.0).air_pressure_and_density(pos)
+        self.assertAlmostEqual( d_1000 / d, 1.0, places=3 )
+
+        cold = Earth(700.0).air_pressure_and_density(pos)[1]
+        hot = Earth(1500.0).air_pressure_and_density(pos)[1]
+        self.assertLess( cold, d )
+        self.assertGreater( hot, d )
+        self.assertAlmostEqual( Earth(1500.0, interpolate=True).air_pressure_and_density(pos)[1] / hot, 1.0, places=6 )
+
+        positions = np.array([[0.0, constants.earth_radius + 400e3, 0.0]] * 2)
+        p, d = Earth().air_pressure_and_density_array(positions, [700.0, 1500.0])
+        self.assertAlmostEqual( d[0] / cold, 1.0, places=6 )
+        self.assertAlmostEqual( d[1] / hot, 1.0, places=6 )
+
+    def test_zonal_harmonics(self):
+        from numpy.polynomial import legendre
+        earth = Earth(harmonics=True)
+        mu = constants.G * earth.mass
+        J = [0.0, 0.0] + earth.zonal
+
+        def potential(p):
+            r = np.linalg.norm(p)
+            return -mu / r * (1.0 - sum( J[n] * (earth.radius / r) ** n * legendre.legval(p[2] / r, [0.0] * n + [1.0]) for n in [2, 3, 4] ))
+
+        rng = np.random.default_rng(0)
+        positions = rng.normal(size=(20, 3))
+        positions *= ((earth.radius + rng.uniform(0.0, 2000e3, 20)) / np.linalg.norm(positions, axis=1))[:, None]
+        a = earth.accelleration_array(positions)
+        for k, p in enumerate(positions):
+            h = 1.0
+            gradient = np.array([ (potential(p + h * e) - potential(p - h * e)) / (2.0 * h) for e in np.eye(3) ])
+            self.assertLess( np.linalg.norm(a[k] + gradient), 1e-6 )
+            self.assertLess( np.linalg.norm(earth.accelleration(Vec3(p))[:] - a[k]), 1e-12 )
+
+        # J2 pulls harder at the equator, less at the poles.
+        r = earth.radius
+        point_mass = Earth()
+        self.assertAlmostEqual( earth.accelleration(Vec3([r, 0.0, 0.0]))[0] / point_mass.accelleration(Vec3([r, 0.0, 0.0]))[0],
+                                1.0 + 1.5 * constants.earth_j2 - 1.875 * constants.earth_j4, places=12 )
+        self.assertLess( earth.accelleration(Vec3([0.0, 0.0, r])).magnitude, point_mass.accelleration(Vec3([0.0, 0.0, r])).magnitude )
+        self.assertIsNone( point_mass.zonal )
+
     def test_velocity(self):
         
         earth = Earth()  
-        pos = Vector([0.0, earth.radius, 0.0])
+        pos = Vec3([0.0, earth.radius, 0.0])
         velocity = earth.surface_speed(pos)
         #print(velocity)
         v = velocity.magnitude
         self.assertTrue( v >=  460 and v <= 465 )
+        # Slower towards the poles, still due east.
+        latitude = math.radians(60.0)
+        pos = Vec3([0.0, earth.radius * math.cos(latitude), earth.radius * math.sin(latitude)])
+        velocity = earth.surface_speed(pos)
+        self.assertAlmostEqual( velocity.magnitude, v * 0.5, places=9 )
+        self.assertAlmostEqual( velocity[0], -velocity.magnitude )
+        self.assertEqual( earth.surface_speed(Vec3([0.0, 0.0, earth.radius])).magnitude, 0.0 )
+        positions = np.array([[0.0, earth.radius, 0.0], [pos[0], pos[1], pos[2]]])
+        self.assertTrue( np.allclose(earth.surface_speed_array(positions), [[-v, 0.0, 0.0], [velocity[0], velocity[1], velocity[2]]]) )
+
+    def test_geographic(self):
+        earth = Earth()
+        positions = np.array([[earth.radius, 0.0, 0.0], [0.0, 0.0, earth.radius + 1e3]])
+        latitude, longitude, altitude = earth.geographic_array(positions)
+        self.assertTrue( np.allclose(latitude, [0.0, 90.0]) )
+        self.assertTrue( np.allclose(altitude, [0.0, 1e3]) )
+        # A quarter day later the ground moved 90 degrees east under x.
+        latitude, longitude, altitude = earth.geographic_array(positions, 6 * 60 * 60)
+        self.assertAlmostEqual( longitude[0], -90.0 )
 
 
 if __name__ == '__main__':
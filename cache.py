@@ -0,0 +1,385 @@
+# Run cache
+#
+# Sweeps and optimizer loops fly the same configuration over and over.
+# RunCache memoizes run_simulation on disk: a run is keyed by a hash of
+# everything that goes into it, the body, the rocket with all its stages
+# and engines, the pitch program, autopilot, integrator and the other
+# arguments, plus the source of the simulation code. A hit restores the
+# rocket to where the run left it (see Rocket.restore) and fills stats,
+# without simulating.
+#
+# Entries are files in directory/<first 2 hex digits of the key>/:
+#   <key>.npz   stats and the rocket's final state, see checkpoint.Snapshot.
+#   <key>.traj  optional telemetry, see trajectory.py.
+# The summary is written last, an entry counts once it is there.
+#
+# Files are written to a temporary file and renamed, hits touch them, and
+# the least recently used entries go once the directory grows beyond
+# max_bytes. Every process sharing the directory does the same, a file
+# evicted by one process while another reads it is simply a miss.
+#
+#   cache = RunCache('.runs')
+#   columns = cache.run(earth, rocket, None, trajectory=True, duration=600.0)
+import contextlib
+import hashlib
+import io
+import math
+import os
+import time
+import types
+import unittest
+import numpy as np
+from checkpoint import Snapshot
+
+# Bump when the entry layout changes.
+VERSION = 1
+
+# Modules whose source changes what a run does.
+SOURCES = [
+    'atlas', 'autopilot', 'body', 'checkpoint', 'constants', 'drag', 'engine', 'events', 'integrator', 'j77',
+    'jacchia', 'launch', 'main', 'orbit', 'pid', 'pitch', 'rocket', 'scheduler', 'stage', 'telemetry', 'vect',
+]
+
+# Attributes that count how an object was used, not what it does.
+_COUNTERS = {'evaluations', 'rejected'}
+
+# run_simulation arguments that watch a run, a cache hit would skip them.
+_UNCACHED = ['telemetry', 'profiler', 'checkpoints']
+
+default_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'runs')
+
+
+_code_version = None
+
+"""
+Hash of the source of SOURCES and the Jacchia table.
+"""
+def code_version():
+    global _code_version
+    if _code_version is None:
+        import jacchia
+        here = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256(str(VERSION).encode())
+        for path in [ os.path.join(here, name + '.py') for name in SOURCES ] + [jacchia.table_path]:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+"""
+Stable hash of values, walking objects through their attributes. Objects
+that carry run state beside what configures them, like a Scheduler, have
+a _fingerprint method returning only the latter.
+"""
+def fingerprint(*values):
+    h = hashlib.sha256()
+    seen = {}
+    for value in values:
+        _feed(h, value, seen)
+    return h.hexdigest()
+
+def _feed(h, value, seen):
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        h.update("{}:{!r};".format(type(value).__name__, value).encode())
+    elif isinstance(value, np.generic):
+        _feed(h, value.item(), seen)
+    elif isinstance(value, np.ndarray):
+        h.update("ndarray:{}:{};".format(value.dtype.str, value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update("{}:{};".format(type(value).__name__, len(value)).encode())
+        for item in value:
+            _feed(h, item, seen)
+    elif isinstance(value, (set, frozenset)):
+        _feed(h, sorted( repr(item) for item in value ), seen)
+    elif isinstance(value, dict):
+        h.update("dict:{};".format(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _feed(h, key, seen)
+            _feed(h, value[key], seen)
+    elif isinstance(value, types.ModuleType):
+        h.update("module:{};".format(value.__name__).encode())
+    elif isinstance(value, (types.FunctionType, types.BuiltinFunctionType, type)):
+        h.update("function:{}.{};".format(value.__module__, value.__qualname__).encode())
+    elif isinstance(value, types.MethodType):
+        h.update("method:{};".format(value.__func__.__qualname__).encode())
+        _feed(h, value.__self__, seen)
+    elif hasattr(value, '_fingerprint') and not isinstance(value, type):
+        cls = type(value)
+        h.update("object:{}.{};".format(cls.__module__, cls.__qualname__).encode())
+        _feed(h, value._fingerprint(), seen)
+    elif id(value) in seen:
+        # Shared or cyclic, like the engines of a StageTable.
+        h.update("ref:{};".format(seen[id(value)]).encode())
+    else:
+        seen[id(value)] = len(seen)
+        cls = type(value)
+        h.update("object:{}.{};".format(cls.__module__, cls.__qualname__).encode())
+        attributes = dict(getattr(value, '__dict__', {}))
+        for klass in cls.__mro__:
+            for name in getattr(klass, '__slots__', ()):
+                if hasattr(value, name):
+                    attributes[name] = getattr(value, name)
+        for name in sorted(attributes):
+            if name not in _COUNTERS:
+                _feed(h, name, seen)
+                _feed(h, attributes[name], seen)
+
+
+class RunCache:
+
+    """
+    RunCache constructor
+
+    directory = where the entries go, shared by all processes using it.
+    max_bytes = size of the directory above which the least recently used
+      entries are evicted.
+    """
+    def __init__(self, directory = default_directory, max_bytes = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Key of run_simulation(body, rocket, target_orbit, **kwargs).
+    """
+    def key(self, body, rocket, target_orbit, **kwargs):
+        kwargs = { name: value for name, value in kwargs.items() if name not in _UNCACHED and name != 'stats' }
+        return fingerprint(code_version(), body, rocket, target_orbit, kwargs)
+
+    def __path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    """
+    run_simulation through the cache, same arguments. trajectory = also
+    cache the telemetry. Runs with a telemetry sink, profiler or
+    checkpoints are not cached.
+
+    Returns the telemetry columns with trajectory, None without, hit or
+    miss.
+    """
+    def run(self, body, rocket, target_orbit, trajectory = False, **kwargs):
+        from main import run_simulation
+        from trajectory import Trajectory, TrajectoryWriter
+
+        if any( kwargs.get(name) is not None for name in _UNCACHED ):
+            return run_simulation(body, rocket, target_orbit, **kwargs)
+
+        key = self.key(body, rocket, target_orbit, **kwargs)
+        stats = kwargs.get('stats')
+        if stats is None:
+            stats = kwargs['stats'] = {}
+
+        snapshot, columns = self.__get(key, trajectory)
+        if snapshot is not None:
+            self.hits += 1
+            snapshot.restore(rocket, None, stats)
+            return columns
+
+        self.misses += 1
+        if not trajectory:
+            run_simulation(body, rocket, target_orbit, **kwargs)
+            self.__put(key, Snapshot(stats['t_end'], None, None, None, None, stats, rocket.snapshot()))
+            return None
+
+        path = self.__path(key, '.traj')
+        temporary = self.__temporary(path)
+        writer = TrajectoryWriter(temporary)
+        try:
+            run_simulation(body, rocket, target_orbit, telemetry=writer, **kwargs)
+            writer.close()
+            os.replace(temporary, path)
+        finally:
+            writer.close()
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        trajectory = Trajectory(path)
+        self.__put(key, Snapshot(stats['t_end'], None, None, None, None, stats, rocket.snapshot()))
+        return tuple( trajectory[name] for name in trajectory.columns )
+
+    # [Snapshot, telemetry columns with trajectory or None] of key, [None,
+    # None] on a miss.
+    def __get(self, key, trajectory):
+        from trajectory import Trajectory
+        summary = self.__path(key, '.npz')
+        try:
+            snapshot = Snapshot.load(summary)
+            columns = None
+            if trajectory:
+                t = Trajectory(self.__path(key, '.traj'))
+                columns = tuple( t[name] for name in t.columns )
+            # Recently used.
+            now = time.time()
+            os.utime(summary, (now, now))
+        except (OSError, ValueError, KeyError):
+            return [None, None]
+        return [snapshot, columns]
+
+    def __temporary(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return "{}.{}.tmp".format(path, os.getpid())
+
+    def __put(self, key, snapshot):
+        path = self.__path(key, '.npz')
+        temporary = self.__temporary(path)
+        try:
+            snapshot.save(temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.evict()
+
+    """
+    Remove the least recently used entries until the directory is at most
+    max_bytes. Returns the number of entries removed.
+    """
+    def evict(self):
+        entries = {}
+        total = 0
+        for root, directories, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    info = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                total += info.st_size
+                key, extension = os.path.splitext(name)
+                if extension == '.tmp':
+                    continue
+                entry = entries.setdefault(key, [math.inf, 0])
+                # The summary is touched on every hit.
+                if extension == '.npz' or entry[0] == math.inf:
+                    entry[0] = info.st_mtime
+                entry[1] += info.st_size
+
+        removed = 0
+        for key, [mtime, size] in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            for extension in ['.npz', '.traj']:
+                try:
+                    os.remove(self.__path(key, extension))
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+
+
+def _atlas(payload_mass = 8.0e3):
+    from atlas import AtlasV401
+    from body import Earth
+    from vect import Vec3
+    earth = Earth()
+    rocket = AtlasV401(payload_mass, Vec3([0.0, earth.radius, 0.0]))
+    rocket.velocity = earth.surface_speed(rocket.position)
+    return rocket
+
+# Fly through a cache in a worker process, for the shared directory test.
+def _cached_run(directory, payload_mass):
+    from body import Earth
+    cache = RunCache(directory, max_bytes=1 << 20)
+    rocket = _atlas(payload_mass)
+    stats = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        cache.run(Earth(), rocket, None, duration=20.0, stats=stats)
+    return [stats['t_end'], rocket.position[:]]
+
+
+class RunCacheUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from body import Earth
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = RunCache(self.directory.name)
+        self.earth = Earth()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_cached(self, rocket, **kwargs):
+        stats = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            columns = self.cache.run(self.earth, rocket, None, stats=stats, **kwargs)
+        return stats, columns
+
+    def test_keys(self):
+        from body import Earth
+        from integrator import RK45
+        key = self.cache.key(self.earth, _atlas(), None, duration=60.0)
+        self.assertEqual( key, self.cache.key(Earth(), _atlas(), None, duration=60.0, stats={'max_q': 1.0}) )
+        self.assertNotEqual( key, self.cache.key(self.earth, _atlas(9e3), None, duration=60.0) )
+        self.assertNotEqual( key, self.cache.key(self.earth, _atlas(), None, duration=61.0) )
+        self.assertNotEqual( key, self.cache.key(Earth(900.0), _atlas(), None, duration=60.0) )
+        integrator = RK45()
+        key = self.cache.key(self.earth, _atlas(), None, integrator=integrator)
+        integrator.evaluations += 7
+        self.assertEqual( key, self.cache.key(self.earth, _atlas(), None, integrator=integrator) )
+        self.assertNotEqual( key, self.cache.key(self.earth, _atlas(), None, integrator=RK45(rtol=1e-8)) )
+        # A scheduler keys on its rates, not on where a run left it.
+        from scheduler import multirate
+        rates = multirate()
+        key = self.cache.key(self.earth, _atlas(), None, rates=rates)
+        rates.due('guidance', 5.0)
+        self.assertEqual( key, self.cache.key(self.earth, _atlas(), None, rates=rates) )
+        self.assertNotEqual( key, self.cache.key(self.earth, _atlas(), None, rates=multirate(guidance=1.0)) )
+
+    def test_hit(self):
+        rocket = _atlas()
+        stats, columns = self.run_cached(rocket, duration=60.0)
+        self.assertEqual( [self.cache.hits, self.cache.misses], [0, 1] )
+        # Without trajectory there are no columns, hit or miss.
+        self.assertIsNone( columns )
+
+        again = _atlas()
+        start = time.time()
+        hit, none = self.run_cached(again, duration=60.0)
+        self.assertLess( time.time() - start, 0.5 )
+        self.assertEqual( self.cache.hits, 1 )
+        self.assertIsNone( none )
+        self.assertEqual( hit, stats )
+        self.assertEqual( again.position[:], rocket.position[:] )
+        self.assertEqual( again.mass(), rocket.mass() )
+
+    def test_trajectory(self):
+        stats, columns = self.run_cached(_atlas(), duration=30.0, trajectory=True)
+        hit, cached = self.run_cached(_atlas(), duration=30.0, trajectory=True)
+        self.assertEqual( self.cache.hits, 1 )
+        self.assertEqual( len(cached), 7 )
+        self.assertTrue( np.array_equal(cached[1], columns[1]) )
+        # Cached without telemetry, asking for it is a miss.
+        self.run_cached(_atlas(), duration=20.0)
+        self.run_cached(_atlas(), duration=20.0, trajectory=True)
+        self.assertEqual( self.cache.misses, 3 )
+
+    def test_eviction(self):
+        for payload_mass in [5e3, 6e3, 7e3]:
+            self.run_cached(_atlas(payload_mass), duration=5.0)
+        size = sum( os.path.getsize(os.path.join(root, name)) for root, directories, files in os.walk(self.directory.name) for name in files )
+        # Room for about two entries, the first one has to go.
+        self.cache.max_bytes = size * 2 // 3 + 1
+        # Used recently, kept.
+        self.run_cached(_atlas(5e3), duration=5.0)
+        self.assertEqual( self.cache.evict(), 1 )
+        self.run_cached(_atlas(5e3), duration=5.0)
+        self.run_cached(_atlas(6e3), duration=5.0)
+        self.assertEqual( [self.cache.hits, self.cache.misses], [2, 4] )
+
+    def test_shared_by_workers(self):
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(2) as pool:
+            results = list(pool.map(_cached_run, [self.directory.name] * 4, [5e3, 5e3, 6e3, 6e3]))
+        self.assertEqual( results[0], results[1] )
+        self.assertEqual( results[2], results[3] )
+        names = [ name for root, directories, files in os.walk(self.directory.name) for name in files ]
+        self.assertEqual( len(names), 2 )
+        self.assertFalse( any( name.endswith('.tmp') for name in names ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+# Checkpoints
+#
+# Variants of a flight, another cutoff or upper stage throttle, mostly
+# share the ascent up to some point. A Snapshot holds everything
+# run_simulation needs to carry on from a step: time, step size, the
+# last loads, stats, the rocket's flight state (see Rocket.snapshot), the
+# running state of the autopilot controllers and what run_simulation
+# holds between steps, the scheduler's last updates among it. Resuming
+# from one continues exactly like the original flight would have.
+#
+# Checkpoints takes snapshots during run_simulation, at events and/or
+# every so many seconds, in memory or to .npz files. fork flies many
+# continuations of one snapshot, optionally on a process pool.
+#
+#   checkpoints = Checkpoints(events=['staging'])
+#   run_simulation(earth, rocket, None, checkpoints=checkpoints)
+#   results = fork(earth, build, checkpoints[0], [ { 'throttle': t } for t in [0.6, 0.8, 1.0] ])
+import copy
+import json
+import os
+import unittest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Snapshot:
+
+    """
+    Snapshot constructor, see take.
+
+    t, dt = simulation time and the next step size.
+    dt_taken, load = length of and loads in the last step, for the
+      autopilot.
+    i = step count.
+    stats = the stats of run_simulation so far.
+    rocket = Rocket.snapshot()
+    autopilot = Autopilot.snapshot() or None.
+    flight = what run_simulation holds from step to step or None: the
+      names of the events of the last step ('fired'), the time since
+      guidance last ran ('guidance_dt'), the held pitch ('delta') and air
+      data ('air', [pressure, density, speed of sound]) and
+      Scheduler.snapshot() ('rates', None without a scheduler).
+    """
+    def __init__(self, t, dt, dt_taken, load, i, stats, rocket, autopilot = None, flight = None):
+        self.t = t
+        self.dt = dt
+        self.dt_taken = dt_taken
+        self.load = load
+        self.i = i
+        self.stats = stats
+        self.rocket = rocket
+        self.autopilot = autopilot
+        self.flight = flight
+
+    """
+    Snapshot of a running simulation.
+    """
+    @staticmethod
+    def take(rocket, autopilot, stats, t, dt, dt_taken, load, i, flight = None):
+        return Snapshot(t, dt, dt_taken, load, i, copy.deepcopy(stats), rocket.snapshot(),
+                        None if autopilot is None else autopilot.snapshot(), copy.deepcopy(flight))
+
+    """
+    Put rocket, the optional autopilot and stats back in the state of the
+    snapshot. Returns [t, dt, dt_taken, load, i].
+    """
+    def restore(self, rocket, autopilot = None, stats = None):
+        rocket.restore(self.rocket)
+        if autopilot is not None and self.autopilot is not None:
+            autopilot.restore(self.autopilot)
+        if stats is not None:
+            stats.clear()
+            stats.update(copy.deepcopy(self.stats))
+        return [self.t, self.dt, self.dt_taken, self.load, self.i]
+
+    """
+    Write the snapshot to path as .npz, the arrays as they are and the
+    rest as JSON.
+    """
+    def save(self, path):
+        arrays = {}
+        meta = _flatten({
+            't': self.t, 'dt': self.dt, 'dt_taken': self.dt_taken, 'load': self.load, 'i': self.i,
+            'stats': self.stats, 'rocket': self.rocket, 'autopilot': self.autopilot, 'flight': self.flight,
+        }, '', arrays)
+        arrays['meta'] = np.array(json.dumps(meta, default=lambda value: value.item()))
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @staticmethod
+    def load(path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = { name: data[name] for name in data.files }
+        meta = _unflatten(json.loads(str(arrays.pop('meta'))), arrays)
+        return Snapshot(meta['t'], meta['dt'], meta['dt_taken'], meta['load'], meta['i'],
+                        meta['stats'], meta['rocket'], meta['autopilot'], meta.get('flight'))
+
+
+# Arrays of nested dictionaries go into arrays under their path, the
+# rest stays for JSON.
+def _flatten(value, path, arrays):
+    if isinstance(value, dict):
+        return { key: _flatten(item, path + '/' + key, arrays) for key, item in value.items() }
+    if isinstance(value, np.ndarray):
+        arrays[path] = value
+        return { '__array__': path }
+    return value
+
+def _unflatten(value, arrays):
+    if isinstance(value, dict):
+        if list(value) == ['__array__']:
+            return arrays[value['__array__']]
+        return { key: _unflatten(item, arrays) for key, item in value.items() }
+    return value
+
+
+class Checkpoints:
+
+    """
+    Snapshots taken by run_simulation.
+
+    every = seconds of simulated time between snapshots, None for none.
+    events = names of events.Event to take a snapshot right after, like
+      'staging' or 'burnout'. Snapshots are taken after the rocket
+      handled the event, a staging snapshot has the next stage lit.
+    directory = save the snapshots there as checkpoint-NNNN.npz instead of
+      keeping them in memory.
+
+    Only integrated steps are snapshot, not coasting jumps. checkpoints[n]
+    is the nth snapshot, loaded from disk when saved there.
+    """
+    def __init__(self, every = None, events = (), directory = None):
+        self.every = every
+        self.events = set(events)
+        self.directory = directory
+        self.snapshots = []
+        self.__next = every
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, n):
+        snapshot = self.snapshots[n]
+        if isinstance(snapshot, str):
+            return Snapshot.load(snapshot)
+        return snapshot
+
+    # Whether a snapshot is due at t, after the fired events.
+    def due(self, t, fired):
+        due = any( event.name in self.events for event in fired )
+        if self.every is not None and t >= self.__next:
+            while self.__next <= t:
+                self.__next += self.every
+            due = True
+        return due
+
+    def add(self, snapshot):
+        if self.directory is None:
+            self.snapshots.append(snapshot)
+            return
+        path = os.path.join(self.directory, 'checkpoint-{:04d}.npz'.format(len(self.snapshots)))
+        snapshot.save(path)
+        self.snapshots.append(path)
+
+
+"""
+Fly continuations of snapshot with run_simulation.
+
+build = function returning a new rocket like the one snapshot was taken
+  of, a module level function or functools.partial for the pool.
+variants = list of dictionaries of run_simulation keyword arguments, one
+  continuation each. 'throttle' sets the throttle of the rocket from the
+  snapshot on instead.
+workers = worker processes, None to fly them all in this process.
+kwargs = run_simulation keyword arguments for all variants.
+
+Returns per variant [stats, telemetry columns, Snapshot of the stats and
+rocket at the end].
+"""
+def fork(body, build, snapshot, variants, workers = None, **kwargs):
+    jobs = [ [body, build, snapshot, dict(kwargs, **variant)] for variant in variants ]
+    if workers is None or workers < 2:
+        return [ _continue(job) for job in jobs ]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_continue, jobs))
+
+def _continue(job):
+    import contextlib
+    import io
+    from main import run_simulation
+
+    body, build, snapshot, kwargs = job
+    throttle = kwargs.pop('throttle', None)
+    if throttle is not None:
+        snapshot = copy.copy(snapshot)
+        snapshot.rocket = dict(snapshot.rocket, throttle=throttle)
+
+    rocket = build()
+    stats = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        columns = run_simulation(body, rocket, kwargs.pop('target_orbit', None), stats=stats, resume=snapshot, **kwargs)
+    return [stats, columns, Snapshot(stats['t_end'], None, None, None, None, stats, rocket.snapshot())]
+
+
+
+def _atlas():
+    from atlas import AtlasV401
+    from body import Earth
+    from vect import Vec3
+    earth = Earth()
+    rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+    rocket.velocity = earth.surface_speed(rocket.position)
+    return rocket
+
+
+class CheckpointUnitTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import contextlib
+        import io
+        from body import Earth
+        from autopilot import Autopilot
+        from main import run_simulation
+
+        cls.earth = Earth()
+        # Up to the Centaur burning a while, with the autopilot's
+        # integrators running.
+        cls.kwargs = { 'duration': 400.0 }
+        cls.rocket = _atlas()
+        cls.stats = {}
+        cls.checkpoints = Checkpoints(every=100.0, events=['staging'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.columns = run_simulation(cls.earth, cls.rocket, None, stats=cls.stats, checkpoints=cls.checkpoints,
+                                         autopilot=Autopilot(pitch_gains=[0.5, 0.1, 0.0], load_limit=0.9), **cls.kwargs)
+
+    def test_checkpoints(self):
+        times = [ snapshot.t for snapshot in self.checkpoints.snapshots ]
+        self.assertEqual( len(times), 5 )
+        staging = [ t for t, name in self.stats['events'] if name == 'staging' ][0]
+        self.assertEqual( times[2], staging )
+        self.assertEqual( self.checkpoints[2].rocket['current_stage'], 1 )
+        self.assertTrue( self.checkpoints[2].rocket['jettisoned'][0] )
+
+    def test_resume_is_exact(self):
+        from autopilot import Autopilot
+        snapshot = self.checkpoints[2]
+        stats, columns, end = fork(self.earth, _atlas, snapshot, [ {} ], autopilot=Autopilot(pitch_gains=[0.5, 0.1, 0.0], load_limit=0.9), **self.kwargs)[0]
+        self.assertEqual( end.rocket['position'].tolist(), self.rocket.position[:] )
+        self.assertEqual( end.rocket['propellant'].tolist(), self.rocket.stage_table.propellant.tolist() )
+        self.assertEqual( stats, self.stats )
+        # Telemetry picks up after the snapshot.
+        n = len(columns[0])
+        self.assertEqual( columns[0].tolist(), self.columns[0][-n:].tolist() )
+        self.assertEqual( self.columns[0][-n - 1], snapshot.t )
+
+    def test_resume_with_rates_is_exact(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from scheduler import multirate
+        # Guidance, air data and telemetry held in between their updates.
+        rocket = _atlas()
+        stats = {}
+        checkpoints = Checkpoints(every=100.0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            columns = run_simulation(self.earth, rocket, None, stats=stats, checkpoints=checkpoints,
+                                     rates=multirate(guidance=1.0, atmosphere=2.0), **self.kwargs)
+        snapshot = checkpoints[1]
+        self.assertEqual( sorted(snapshot.flight['rates']), ['atmosphere', 'guidance', 'telemetry'] )
+        stats_resumed, columns_resumed, end = fork(self.earth, _atlas, snapshot, [ {} ], rates=multirate(guidance=1.0, atmosphere=2.0), **self.kwargs)[0]
+        self.assertEqual( end.rocket['position'].tolist(), rocket.position[:] )
+        self.assertEqual( stats_resumed, stats )
+        n = len(columns_resumed[0])
+        self.assertEqual( columns_resumed[0].tolist(), columns[0][-n:].tolist() )
+        self.assertEqual( columns_resumed[1].tolist(), columns[1][-n:].tolist() )
+
+    def test_save_and_load(self):
+        import tempfile
+        snapshot = self.checkpoints[2]
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoints = Checkpoints(directory=directory)
+            checkpoints.add(snapshot)
+            self.assertTrue( checkpoints.snapshots[0].endswith('checkpoint-0000.npz') )
+            loaded = checkpoints[0]
+        self.assertEqual( loaded.stats, snapshot.stats )
+        self.assertEqual( [loaded.t, loaded.dt, loaded.load, loaded.i], [snapshot.t, snapshot.dt, snapshot.load, snapshot.i] )
+        for name, value in snapshot.rocket.items():
+            self.assertTrue( np.array_equal(loaded.rocket[name], value) )
+        for name, value in snapshot.autopilot['throttle'].items():
+            self.assertTrue( np.array_equal(loaded.autopilot['throttle'][name], value) )
+        self.assertEqual( loaded.flight, snapshot.flight )
+
+    def test_fork_on_pool(self):
+        results = fork(self.earth, _atlas, self.checkpoints[2], [ { 'throttle': 0.5 }, { 'throttle': 1.0 } ], workers=2, duration=300.0)
+        half, full = [ end.rocket['propellant'][1] for stats, columns, end in results ]
+        self.assertGreater( half, full )
+        self.assertAlmostEqual( (self.checkpoints[2].rocket['propellant'][1] - half) * 2.0,
+                                self.checkpoints[2].rocket['propellant'][1] - full, delta=1.0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
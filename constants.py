@@ -8,4 +8,10 @@ R = 8.314
 # earth's radius in [m]
 earth_radius = 6.38e6
 # earth's mass in [kg]
-earth_mass=5.972e24 
\ No newline at end of file
+earth_mass=5.972e24 
+# zonal harmonics of earth's gravity field, EGM2008
+earth_j2 = 1.08262668e-3
+earth_j3 = -2.53265649e-6
+earth_j4 = -1.61962159e-6
+# standard gravity, defines the specific impulse in [m/s2]
+g0 = 9.80665
@@ -0,0 +1,133 @@
+# Drag coefficient models
+#
+# The drag coefficient of a launch vehicle depends on the Mach number:
+# flat while subsonic, a steep rise through the transonic region to a peak
+# a little above Mach 1 where the shocks form, then falling off slowly as
+# the flow becomes hypersonic. It also depends on the configuration, the
+# stack with its boosters strapped on is not the stack once they are gone.
+#
+# DragTable is the Cd over Mach of one configuration, given by a few
+# knots and precomputed on a shared grid of Mach numbers (MACHS), so
+# evaluating it is an index computation and one interpolation. All tables
+# share the grid so that a batch with different tables is one lookup, see
+# DragTable.coefficient_array. Above the grid the last value holds.
+#
+# https://space.stackexchange.com/questions/12649
+# https://en.wikipedia.org/wiki/Drag_coefficient
+# https://en.wikipedia.org/wiki/Wave_drag
+import unittest
+import numpy as np
+
+# Mach grid of the tables.
+MACHS = np.linspace(0.0, 30.0, 601)
+
+_dm = MACHS[1] - MACHS[0]
+
+# Drag coefficient of a rocket without a table, what Rocket always used.
+DEFAULT_CD = 0.30
+
+
+class DragTable:
+
+    """
+    DragTable constructor
+
+    mach = Mach numbers, increasing.
+    cd = drag coefficient at those Mach numbers, referred to the drag
+      surface of the rocket (its widest stage).
+    name = for printing.
+
+    Below the first and above the last knot the end values hold.
+    """
+    def __init__(self, mach, cd, name = ""):
+
+        if len(mach) != len(cd) or len(mach) < 1:
+            raise ValueError("drag.py | need as many drag coefficients as Mach numbers.")
+        if np.any(np.diff(mach) <= 0.0):
+            raise ValueError("drag.py | Mach numbers have to be increasing.")
+        self.mach = np.array(mach, dtype=float)
+        self.cd = np.array(cd, dtype=float)
+        self.name = name
+        self.table = np.interp(MACHS, self.mach, self.cd)
+
+    def __repr__(self):
+        return "DragTable({!r}, peak Cd {:.3f})".format(self.name, float(np.max(self.cd)))
+
+    """
+    Drag coefficient at Mach number mach.
+    """
+    def coefficient(self, mach):
+        x = mach / _dm
+        if x >= len(MACHS) - 1:
+            return self.table[-1]
+        if x < 0.0:
+            x = 0.0
+        i = int(x)
+        return self.table[i] + (x - i) * (self.table[i + 1] - self.table[i])
+
+    """
+    Tables stacked into one array for coefficient_array. The last row is
+    DEFAULT_CD, index -1 picks it for rockets without a table.
+    """
+    @staticmethod
+    def stack(tables):
+        return np.stack([ table.table for table in tables ] + [ np.full(len(MACHS), DEFAULT_CD) ])
+
+    """
+    Vectorized coefficient. tables = DragTable.stack of the tables, table
+    = index into tables, mach array broadcasting against table.
+    """
+    @staticmethod
+    def coefficient_array(tables, table, mach):
+        x = np.clip(mach / _dm, 0.0, len(MACHS) - 1)
+        i = np.minimum(x.astype(int), len(MACHS) - 2)
+        low = tables[table, i]
+        return low + (x - i) * (tables[table, i + 1] - low)
+
+
+"""
+Cd over Mach of a slender launch vehicle with an ogive fairing, the
+shape most published curves share. scale stretches the transonic rise,
+for stacks that are blunter (side boosters) or sleeker.
+"""
+def launch_vehicle(scale = 1.0, name = ""):
+    mach = [0.0, 0.5, 0.8, 0.95, 1.05, 1.2, 1.5, 2.0, 3.0, 5.0, 10.0]
+    cd = [0.30, 0.30, 0.33, 0.45, 0.52, 0.50, 0.44, 0.37, 0.30, 0.25, 0.22]
+    return DragTable(mach, [ DEFAULT_CD + (c - DEFAULT_CD) * scale if m > 0.5 else c for m, c in zip(mach, cd) ], name)
+
+
+
+class DragTableUnitTest(unittest.TestCase):
+
+    def test_coefficient(self):
+        table = launch_vehicle()
+        self.assertAlmostEqual( table.coefficient(0.0), 0.30 )
+        self.assertAlmostEqual( table.coefficient(-1.0), 0.30 )
+        self.assertAlmostEqual( table.coefficient(1.05), 0.52 )
+        self.assertAlmostEqual( table.coefficient(100.0), 0.22 )
+        # Peaks just above Mach 1.
+        mach = np.linspace(0.0, 10.0, 1001)
+        peak = mach[np.argmax([ table.coefficient(m) for m in mach ])]
+        self.assertTrue( 1.0 < peak < 1.2 )
+        # Blunter stacks rise higher, the subsonic part stays.
+        blunt = launch_vehicle(1.5)
+        self.assertAlmostEqual( blunt.coefficient(0.3), 0.30 )
+        self.assertAlmostEqual( blunt.coefficient(1.05), 0.63 )
+
+        with self.assertRaises(ValueError):
+            DragTable([1.0, 0.5], [0.3, 0.3])
+
+    def test_array_matches_scalar(self):
+        tables = [ launch_vehicle(), launch_vehicle(1.5), DragTable([0.0, 2.0], [0.5, 0.1]) ]
+        stacked = DragTable.stack(tables)
+        rng = np.random.default_rng(0)
+        mach = rng.uniform(-1.0, 35.0, 200)
+        table = rng.integers(-1, 3, 200)
+        cd = DragTable.coefficient_array(stacked, table, mach)
+        for k in range(200):
+            expected = DEFAULT_CD if table[k] < 0 else tables[table[k]].coefficient(mach[k])
+            self.assertAlmostEqual( cd[k], expected, places=12 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+# Rocket engine and thrust curve models
+#
+# Engine is an ideal nozzle: isentropic expansion of the exhaust from the
+# chamber through a nozzle of fixed expansion ratio. Thrust is
+#
+#   F = CF * pc * At
+#
+# with pc the chamber pressure, At the throat area and CF the thrust
+# coefficient, momentum thrust plus the pressure difference over the
+# exit area. Throttling lowers the chamber pressure, pc = throttle * pc0,
+# the same ambient pressure then costs relatively more thrust, so the Isp
+# drops with the throttle as well as with the ambient pressure.
+#
+# Once the exit pressure falls below separation * ambient pressure the
+# flow separates from the nozzle wall (Summerfield criterion), the part of
+# the nozzle beyond that point no longer contributes.
+#
+# Engines are fully determined by their vacuum thrust and Isp, the exit
+# area and the expansion ratio. Their thrust is precomputed over a grid
+# of ambient pressures and throttles (PRESSURES, THROTTLES), evaluating
+# it is a bilinear interpolation. All engines share the grid so that a
+# batch with different engines is one table lookup, see thrust_array.
+#
+# ThrustCurve is the thrust over time of a solid rocket motor, it drives
+# the throttle of the stage instead of the auto pilot.
+#
+# https://en.wikipedia.org/wiki/Rocket_engine_nozzle
+# https://en.wikipedia.org/wiki/Thrust_coefficient
+# https://en.wikipedia.org/wiki/Specific_impulse
+import math
+import unittest
+import numpy as np
+import constants
+
+# Ambient pressure (Pa) and throttle grid of the thrust tables.
+PRESSURES = np.linspace(0.0, 120e3, 121)
+THROTTLES = np.linspace(0.0, 1.0, 51)
+
+_dp = PRESSURES[1] - PRESSURES[0]
+_dt = THROTTLES[1] - THROTTLES[0]
+
+
+# Exit to throat area ratio where the pressure has dropped to r times the
+# chamber pressure, supersonic part of the nozzle.
+def _area_ratio(r, gamma):
+    return ((2.0 / (gamma + 1.0)) ** (1.0 / (gamma - 1.0)) * r ** (-1.0 / gamma)
+            / np.sqrt((gamma + 1.0) / (gamma - 1.0) * (1.0 - r ** ((gamma - 1.0) / gamma))))
+
+# Momentum part of the thrust coefficient for exit pressure ratio r.
+def _momentum_coefficient(r, gamma):
+    return np.sqrt(2.0 * gamma * gamma / (gamma - 1.0) * (2.0 / (gamma + 1.0)) ** ((gamma + 1.0) / (gamma - 1.0))
+                   * (1.0 - r ** ((gamma - 1.0) / gamma)))
+
+# Pressure ratio at the throat.
+def _critical_ratio(gamma):
+    return (2.0 / (gamma + 1.0)) ** (gamma / (gamma - 1.0))
+
+
+class Engine:
+
+    """
+    Engine constructor
+
+    thrust_vac = vacuum thrust at full throttle in N.
+    isp_vac = vacuum specific impulse at full throttle in s.
+    exit_area = nozzle exit area in m^2, of all nozzles together.
+    expansion_ratio = nozzle exit area over throat area.
+    gamma = ratio of specific heats of the exhaust.
+    separation = exit to ambient pressure ratio below which the flow
+      separates from the nozzle wall.
+    name = for printing.
+    """
+    def __init__(self, thrust_vac, isp_vac, exit_area, expansion_ratio, gamma = 1.2, separation = 0.4, name = ""):
+
+        self.thrust_vac = thrust_vac
+        self.isp_vac = isp_vac
+        self.exit_area = exit_area
+        self.expansion_ratio = expansion_ratio
+        self.gamma = gamma
+        self.separation = separation
+        self.name = name
+
+        # Full throttle mass flow.
+        self.mass_flow = thrust_vac / (isp_vac * constants.g0)
+
+        # Exit pressure ratio of the nozzle, inverting _area_ratio.
+        critical = _critical_ratio(gamma)
+        r = np.logspace(-9.0, math.log10(critical), 20000)
+        self.exit_pressure_ratio = float(np.interp(expansion_ratio, _area_ratio(r, gamma)[::-1], r[::-1]))
+
+        vacuum_coefficient = _momentum_coefficient(self.exit_pressure_ratio, gamma) + self.exit_pressure_ratio * expansion_ratio
+        # Full throttle chamber pressure and throat area.
+        throat_area = exit_area / expansion_ratio
+        self.chamber_pressure = thrust_vac / (vacuum_coefficient * throat_area)
+
+        throttle, pressure = np.meshgrid(THROTTLES, PRESSURES, indexing='ij')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chamber_pressure = throttle * self.chamber_pressure
+            ambient = pressure / chamber_pressure
+            # Where the flow separates the nozzle effectively ends at the
+            # separation point, it can not end before the throat.
+            r = np.maximum(self.exit_pressure_ratio, separation * ambient)
+            r = np.minimum(r, critical)
+            coefficient = _momentum_coefficient(r, gamma) + (r - ambient) * np.where(
+                r > self.exit_pressure_ratio, _area_ratio(r, gamma), expansion_ratio)
+            F = coefficient * chamber_pressure * throat_area
+        # [throttle, pressure], no thrust at zero throttle and no pulling.
+        self.table = np.where(throttle > 0.0, np.maximum(F, 0.0), 0.0)
+
+    def __repr__(self):
+        return "Engine({!r}, thrust_vac={}, isp_vac={}, exit_area={}, expansion_ratio={})".format(
+            self.name, self.thrust_vac, self.isp_vac, self.exit_area, self.expansion_ratio)
+
+    """
+    Thrust in N at ambient pressure p_external (Pa) and throttle 0 to 1.
+    """
+    def thrust(self, p_external, throttle):
+
+        x = p_external / _dp
+        if x > len(PRESSURES) - 1:
+            x = len(PRESSURES) - 1
+        elif x < 0.0:
+            x = 0.0
+        y = throttle / _dt
+        if y > len(THROTTLES) - 1:
+            y = len(THROTTLES) - 1
+        elif y < 0.0:
+            y = 0.0
+        # The last cell also takes its upper edge.
+        i = min(int(x), len(PRESSURES) - 2)
+        j = min(int(y), len(THROTTLES) - 2)
+        fx = x - i
+        fy = y - j
+        row = self.table[j]
+        above = self.table[j + 1]
+        return ((1.0 - fy) * (row[i] + fx * (row[i + 1] - row[i]))
+                + fy * (above[i] + fx * (above[i + 1] - above[i])))
+
+    """
+    Specific impulse in s at ambient pressure p_external and throttle.
+    """
+    def isp(self, p_external, throttle):
+        if throttle <= 0.0:
+            return 0.0
+        return self.thrust(p_external, throttle) / (throttle * self.mass_flow * constants.g0)
+
+    """
+    Thrust tables of engines stacked into one array for thrust_array.
+    """
+    @staticmethod
+    def stack(engines):
+        if not engines:
+            return np.zeros((0, len(THROTTLES), len(PRESSURES)))
+        return np.stack([ engine.table for engine in engines ])
+
+    """
+    Vectorized thrust. tables = Engine.stack of the engines, engine =
+    index into tables, p_external and throttle arrays broadcasting
+    against engine.
+    """
+    @staticmethod
+    def thrust_array(tables, engine, p_external, throttle):
+
+        x = np.clip(p_external / _dp, 0.0, len(PRESSURES) - 1)
+        y = np.clip(throttle / _dt, 0.0, len(THROTTLES) - 1)
+        i = np.minimum(x.astype(int), len(PRESSURES) - 2)
+        j = np.minimum(y.astype(int), len(THROTTLES) - 2)
+        fx = x - i
+        fy = y - j
+        low = tables[engine, j, i]
+        low = low + fx * (tables[engine, j, i + 1] - low)
+        high = tables[engine, j + 1, i]
+        high = high + fx * (tables[engine, j + 1, i + 1] - high)
+        return low + fy * (high - low)
+
+
+
+class ThrustCurve:
+
+    """
+    ThrustCurve constructor
+
+    times = seconds since ignition, increasing.
+    thrust = thrust at those times in any unit, only the shape matters.
+    burn_time = seconds until the propellant is gone.
+
+    The curve is scaled so that it burns the propellant in burn_time,
+    fraction(t) is the throttle t seconds after ignition, averaging 1
+    over the burn. It is resampled to samples even steps so a lookup is
+    an index computation.
+    """
+    def __init__(self, times, thrust, burn_time, samples = 100):
+
+        if burn_time <= 0.0:
+            raise ValueError("engine.py | burn_time has to be positive.")
+        self.burn_time = burn_time
+        self.samples = samples
+
+        t = np.linspace(0.0, burn_time, samples + 1)
+        shape = np.interp(t, times, thrust, right=0.0)
+        # Trapezoid rule, the same the simulation steps integrate.
+        mean = np.sum(shape[1:] + shape[:-1]) / (2.0 * samples)
+        if mean <= 0.0:
+            raise ValueError("engine.py | thrust curve has no thrust.")
+        self.table = shape / mean
+
+    """
+    Throttle t seconds after ignition, 0 once burnt out.
+    """
+    def fraction(self, t):
+        x = t / self.burn_time * self.samples
+        if x >= self.samples:
+            return 0.0
+        if x < 0.0:
+            x = 0.0
+        i = int(x)
+        return self.table[i] + (x - i) * (self.table[i + 1] - self.table[i])
+
+    """
+    Tables of curves stacked, rows padded to the longest.
+    """
+    @staticmethod
+    def stack(curves):
+        if not curves:
+            return np.zeros((0, 2)), np.ones(0), np.ones(0)
+        width = max( len(curve.table) for curve in curves )
+        tables = np.zeros((len(curves), width))
+        for k, curve in enumerate(curves):
+            tables[k, :len(curve.table)] = curve.table
+        return tables, np.array([ c.burn_time for c in curves ]), np.array([ c.samples for c in curves ], dtype=float)
+
+    """
+    Vectorized fraction. stacked = ThrustCurve.stack of the curves,
+    curve = index into it, t = seconds since ignition.
+    """
+    @staticmethod
+    def fraction_array(stacked, curve, t):
+        tables, burn_time, samples = stacked
+        x = np.maximum(t / burn_time[curve] * samples[curve], 0.0)
+        i = np.minimum(x.astype(int), samples[curve].astype(int) - 1)
+        F = tables[curve, i] + (x - i) * (tables[curve, i + 1] - tables[curve, i])
+        return np.where(x < samples[curve], F, 0.0)
+
+
+
+class EngineUnitTest(unittest.TestCase):
+
+    def rd180(self):
+        return Engine(4152e3, 338.4, 3.2075, 36.87, name="RD-180")
+
+    def test_vacuum(self):
+        rd180 = self.rd180()
+        self.assertAlmostEqual( rd180.thrust(0.0, 1.0), 4152e3 )
+        self.assertAlmostEqual( rd180.isp(0.0, 1.0), 338.4 )
+        # The whole chamber pressure is throttled, vacuum thrust with it.
+        self.assertAlmostEqual( rd180.thrust(0.0, 0.5) / 4152e3, 0.5 )
+        self.assertEqual( rd180.thrust(50e3, 0.0), 0.0 )
+
+    def test_sea_level(self):
+        rd180 = self.rd180()
+        # No separation at full throttle, the exit area takes the pressure.
+        self.assertAlmostEqual( rd180.thrust(101325.0, 1.0) / 1e3, 4152.0 - 3.2075 * 101.325, places=0 )
+        self.assertGreater( rd180.exit_pressure_ratio * rd180.chamber_pressure, 0.4 * 101325.0 )
+        # Throttled down the Isp drops.
+        self.assertLess( rd180.isp(101325.0, 0.5), rd180.isp(101325.0, 1.0) - 10.0 )
+        # Separation keeps a throttled engine from losing all its thrust.
+        ideal = 0.2 * 4152e3 - 3.2075 * 101325.0
+        self.assertGreater( rd180.thrust(101325.0, 0.2), ideal )
+
+    def test_array_matches_scalar(self):
+        engines = [ self.rd180(), Engine(99.2e3, 450.5, 1.075, 84.0, name="RL10A-4-2") ]
+        tables = Engine.stack(engines)
+        rng = np.random.default_rng(0)
+        p = rng.uniform(0.0, 130e3, 50)
+        throttle = rng.uniform(0.0, 1.0, 50)
+        engine = rng.integers(0, 2, 50)
+        F = Engine.thrust_array(tables, engine, p, throttle)
+        for k in range(50):
+            self.assertAlmostEqual( F[k], engines[engine[k]].thrust(p[k], throttle[k]), delta=1e-6 * 4152e3 )
+
+    def test_thrust_curve(self):
+        # Regressive grain, twice the thrust at ignition than at burn out.
+        curve = ThrustCurve([0.0, 100.0], [2.0, 1.0], 100.0)
+        self.assertAlmostEqual( curve.fraction(0.0), 4.0 / 3.0 )
+        self.assertAlmostEqual( curve.fraction(100.0), 0.0 )
+        # Averages full throttle over the burn, stepping it with 0.5 s
+        # steps is off by less than a step.
+        f = np.array([ curve.fraction(t) for t in np.arange(0.0, 100.0, 0.5) ])
+        self.assertAlmostEqual( np.sum(f) * 0.5, 100.0, delta=0.5 )
+        stacked = ThrustCurve.stack([ ThrustCurve([0.0, 1.0], [1.0, 1.0], 10.0), curve ])
+        self.assertTrue( np.allclose(ThrustCurve.fraction_array(stacked, np.array([1, 1, 0]), np.array([0.0, 50.0, 20.0])),
+                                     [4.0 / 3.0, 1.0, 0.0]) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,360 @@
+# Events
+#
+# Things that happen at a specific moment during a flight: a stage runs
+# dry, the engines cut off, apogee, hitting the ground. Every event is a
+# function g(t, state) that changes sign where the event happens, with
+# state the integrator state [x, y, z, vx, vy, vz] as a list of floats,
+# plain floats are a lot cheaper to do a few operations on than NumPy.
+#
+# EventDetector wraps an integrator step. When an event function changes
+# sign over a step, the crossing is bracketed and located with the
+# Illinois variant of regula falsi, and the step is cut short just past
+# the crossing. The caller then handles the event and the next step
+# restarts cleanly from there, so steps can be large between events.
+# Only the signs at the ends of a step are compared, a step must not be
+# so long that an event function crosses zero twice within it.
+#
+# https://en.wikipedia.org/wiki/Regula_falsi#The_Illinois_algorithm
+import math
+import unittest
+import numpy as np
+import constants
+
+# Altitude at which re-entering vehicles are taken to hit the atmosphere,
+# 400,000 ft.
+entry_interface = 121.92e3
+
+
+class Event:
+
+    """
+    name = name reported when the event fires.
+    function = g(t, state), the event happens where g crosses zero.
+      Subclasses can override value instead.
+    direction = 1 for crossings from negative to positive only, -1 for
+      positive to negative only, 0 for both.
+    terminal = the simulation ends at this event.
+    """
+    def __init__(self, name, function = None, direction = 0, terminal = False):
+        self.name = name
+        self.direction = direction
+        self.terminal = terminal
+        self.__function = function
+
+    """
+    Called at the start of every step, for events that depend on more
+    than the integrator state, like the propellant left.
+    """
+    def begin(self, t, state):
+        pass
+
+    def value(self, t, state):
+        return self.__function(t, state)
+
+    # True when going from g0 to g1 crosses zero in our direction. The
+    # end of a crossing is g == 0 or past it, so an event that just fired
+    # does not fire again on the next step.
+    def crossed(self, g0, g1):
+        if self.direction >= 0 and g0 < 0.0 <= g1:
+            return True
+        if self.direction <= 0 and g0 > 0.0 >= g1:
+            return True
+        return False
+
+
+class Altitude(Event):
+
+    """
+    Passing altitude meters above the surface of body.
+    """
+    def __init__(self, body, altitude, name = 'altitude', direction = 0, terminal = False):
+        super().__init__(name, None, direction, terminal)
+        self.altitude = altitude
+        self.__radius = body.radius + altitude
+
+    def value(self, t, state):
+        return math.sqrt(state[0] * state[0] + state[1] * state[1] + state[2] * state[2]) - self.__radius
+
+
+class Impact(Altitude):
+
+    """
+    Coming down on the surface of body, ends the flight.
+    """
+    def __init__(self, body):
+        super().__init__(body, 0.0, 'impact', -1, True)
+
+
+class AtmosphereInterface(Altitude):
+
+    """
+    Leaving or entering the atmosphere.
+    """
+    def __init__(self, body, altitude = entry_interface):
+        super().__init__(body, altitude, 'atmosphere interface')
+
+
+class Apogee(Event):
+
+    """
+    Highest point of the orbit, radial velocity going from up to down.
+    """
+    def __init__(self, name = 'apogee', direction = -1):
+        super().__init__(name, None, direction)
+
+    def value(self, t, state):
+        return state[0] * state[3] + state[1] * state[4] + state[2] * state[5]
+
+
+class Periapsis(Apogee):
+
+    """
+    Lowest point of the orbit, radial velocity going from down to up.
+    """
+    def __init__(self):
+        super().__init__('periapsis', 1)
+
+
+class TargetVelocity(Event):
+
+    """
+    Speeding up past velocity meters per second, the auto pilot cuts off
+    the engines here.
+    """
+    def __init__(self, velocity, name = 'target velocity'):
+        super().__init__(name, None, 1)
+        self.velocity = velocity
+
+    def value(self, t, state):
+        return math.sqrt(state[3] * state[3] + state[4] * state[4] + state[5] * state[5]) - self.velocity
+
+
+class TargetApoapsis(Event):
+
+    """
+    Apoapsis rising past altitude meters above body, the auto pilot can
+    cut off the engines here. The value is in terms of 1 / apoapsis, which
+    stays finite as the orbit opens up into an escape trajectory.
+    """
+    def __init__(self, body, altitude, name = 'target apoapsis'):
+        super().__init__(name, None, 1)
+        self.altitude = altitude
+        self.__inverse_radius = 1.0 / (body.radius + altitude)
+        self.__mu = constants.G * body.mass
+
+    def value(self, t, state):
+        x, y, z, vx, vy, vz = state
+        r = math.sqrt(x * x + y * y + z * z)
+        # 1 / semi major axis from the vis-viva equation, e from h^2.
+        inverse_a = 2.0 / r - (vx * vx + vy * vy + vz * vz) / self.__mu
+        hx, hy, hz = y * vz - z * vy, z * vx - x * vz, x * vy - y * vx
+        e = math.sqrt(max(0.0, 1.0 - (hx * hx + hy * hy + hz * hz) * inverse_a / self.__mu))
+        return self.__inverse_radius - inverse_a / (1.0 + e)
+
+
+class Burnout(Event):
+
+    """
+    The current stage of rocket running out of propellant. Mass flow is
+    constant over a step, so this is the time left until burnout. It is
+    overshot by a hair so the stage really runs dry.
+    """
+    def __init__(self, rocket, name = 'burnout'):
+        super().__init__(name, None, -1)
+        self.rocket = rocket
+        self.__t_burnout = math.inf
+
+    # Whether the burnout of the current stage counts as this event.
+    def watching(self):
+        return True
+
+    def begin(self, t, state):
+        if self.watching():
+            self.__t_burnout = t + self.rocket.time_to_burnout() * (1.0 + 1e-9)
+        else:
+            self.__t_burnout = math.inf
+
+    def value(self, t, state):
+        return self.__t_burnout - t
+
+
+class Staging(Burnout):
+
+    """
+    Burnout of a stage that is jettisoned afterwards.
+    """
+    def __init__(self, rocket):
+        super().__init__(rocket, 'staging')
+
+    def watching(self):
+        return self.rocket.jettisons_at_burnout()
+
+
+class EventDetector:
+
+    """
+    events = list of Event.
+    tolerance = crossings are located to within tolerance seconds.
+    """
+    def __init__(self, events, tolerance = 1e-6):
+        self.events = list(events)
+        self.tolerance = tolerance
+        # Events with a begin, their value at the start of a step can
+        # differ from the one at the end of the step before.
+        self.__begin = [ i for i, event in enumerate(self.events) if type(event).begin is not Event.begin ]
+        self.__last = None
+
+    """
+    Take one integrator step of at most dt seconds from state at t.
+    Returns [new state, step taken, suggested next step, fired events].
+    When events fired the step ends just past the first of them, all
+    events crossed up to there are returned.
+    """
+    def step(self, integrator, derivative, t, state, dt):
+
+        for i in self.__begin:
+            self.events[i].begin(t, state)
+        s = state.tolist()
+        if self.__last is not None and self.__last[0] == t and self.__last[1] == s:
+            # Continuing where the last step ended.
+            g0 = self.__last[2]
+            for i in self.__begin:
+                g0[i] = self.events[i].value(t, s)
+        else:
+            g0 = [ event.value(t, s) for event in self.events ]
+
+        new, taken, dt_next = integrator.step(derivative, t, state, dt)
+        t1 = t + taken
+        s1 = new.tolist()
+        g1 = [ event.value(t1, s1) for event in self.events ]
+        # Sign changes first, that is cheaper than asking every event.
+        crossed = [ i for i, (a, b) in enumerate(zip(g0, g1)) if (a < 0.0 <= b or a > 0.0 >= b) and self.events[i].crossed(a, b) ]
+
+        fired = []
+        if crossed:
+            # Locate the first crossing, any other crossing is after it or
+            # within the tolerance of it.
+            for i in crossed:
+                new, taken = self.__locate(self.events[i], g0[i], integrator, derivative, t, state, new, taken)
+            t1 = t + taken
+            s1 = new.tolist()
+            g1 = [ event.value(t1, s1) for event in self.events ]
+            fired = [ event for i, event in enumerate(self.events) if event.crossed(g0[i], g1[i]) ]
+
+        self.__last = [t1, s1, g1]
+        return new, taken, dt_next, fired
+
+    # Shrink [0, taken] around the crossing of event, returns the state
+    # just past it and the step to get there.
+    def __locate(self, event, g0, integrator, derivative, t, state, new, taken):
+
+        a, ga = 0.0, g0
+        b, gb = taken, event.value(t + taken, new.tolist())
+        if not event.crossed(ga, gb):
+            return new, taken
+
+        side = 0
+        while b - a > self.tolerance:
+            c = b - gb * (b - a) / (gb - ga)
+            # Always make progress, a secant step ending on top of one of
+            # the brackets would never shrink the other.
+            c = min(max(c, a + self.tolerance / 2.0), b - self.tolerance / 2.0)
+            trial = _advance(integrator, derivative, t, state, c)
+            gc = event.value(t + c, trial.tolist())
+            if event.crossed(ga, gc):
+                b, gb, new = c, gc, trial
+                if side == 1:
+                    ga /= 2.0
+                side = 1
+            else:
+                a, ga = c, gc
+                if side == -1:
+                    gb /= 2.0
+                side = -1
+
+        return new, b
+
+
+# Integrate exactly dt seconds, an adaptive integrator may need more than
+# one step for that.
+def _advance(integrator, derivative, t, state, dt):
+    done = 0.0
+    while done < dt:
+        state, taken, dt_next = integrator.step(derivative, t + done, state, dt - done)
+        done += taken
+    return state
+
+
+
+class EventUnitTest(unittest.TestCase):
+
+    # Ball thrown straight up at 100 m/s under 10 m/s^2.
+    def throw(self, t, state):
+        return np.array([state[3], state[4], state[5], 0.0, 0.0, -10.0])
+
+    def fly(self, integrator, events, dt, duration = 100.0, height = 0.0):
+        detector = EventDetector(events)
+        state = np.array([0.0, 0.0, height, 0.0, 0.0, 100.0])
+        t = 0.0
+        log = []
+        while t < duration:
+            state, taken, dt_next, fired = detector.step(integrator, self.throw, t, state, dt)
+            t += taken
+            log.extend( (event.name, t) for event in fired )
+            if any( event.terminal for event in fired ):
+                break
+        return log, t, state
+
+    def test_apogee_and_impact(self):
+        from integrator import RK4
+        events = [
+            Event('apogee', lambda t, s: s[5], -1),
+            Event('impact', lambda t, s: s[2], -1, True),
+            Event('100m', lambda t, s: s[2] - 100.0),
+        ]
+        # Steps of 7 seconds, nowhere near any of the events.
+        log, t, state = self.fly(RK4(7.0), events, 7.0)
+        names = [ name for name, when in log ]
+        self.assertEqual( names, ['100m', 'apogee', '100m', 'impact'] )
+        self.assertAlmostEqual( log[1][1], 10.0, places=5 )
+        self.assertAlmostEqual( t, 20.0, places=5 )
+        self.assertLessEqual( state[2], 0.0 )
+        self.assertGreater( state[2], -1e-3 )
+
+    def test_direction(self):
+        from integrator import RK4
+        events = [
+            Event('up', lambda t, s: s[2] - 100.0, 1),
+            Event('clock', lambda t, s: t - 12.5, 1),
+        ]
+        log, t, state = self.fly(RK4(5.0), events, 5.0, 30.0)
+        self.assertEqual( [ name for name, when in log ], ['up', 'clock'] )
+        self.assertAlmostEqual( log[1][1], 12.5, places=5 )
+
+    def test_target_apoapsis(self):
+        from body import Earth
+        import orbit
+        earth = Earth()
+        mu = constants.G * earth.mass
+        event = TargetApoapsis(earth, 300e3)
+        position = [earth.radius + 200e3, 0.0, 0.0]
+        circular = math.sqrt(mu / position[0])
+        for speed in [circular, circular * 1.01, circular * 1.1, circular * 2.0]:
+            state = position + [0.0, speed, 0.0]
+            o = orbit.elements(np.array(state[:3]), np.array(state[3:]), mu)
+            apoapsis = o.apoapsis if o.e < 1.0 else math.inf
+            self.assertEqual( event.value(0.0, state) > 0.0, apoapsis > earth.radius + 300e3 )
+            if o.e < 1.0:
+                self.assertAlmostEqual( event.value(0.0, state) * (earth.radius + 300e3), 1.0 - (earth.radius + 300e3) / apoapsis, places=9 )
+
+    def test_adaptive(self):
+        from integrator import RK45
+        # One step all the way, only the end points are compared so the
+        # ball has to start above ground.
+        log, t, state = self.fly(RK45(), [Event('impact', lambda t, s: s[2], -1, True)], 600.0, height=105.0)
+        self.assertEqual( len(log), 1 )
+        self.assertAlmostEqual( t, 21.0, places=5 )
+
+
+if __name__ == '__main__':
+    unittest.main()
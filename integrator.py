@@ -0,0 +1,186 @@
+# Integrators
+#
+# Numerical integrators for the equations of motion. The state is a NumPy
+# array [x, y, z, vx, vy, vz] and derivative(t, state) returns the time
+# derivative of that state, [vx, vy, vz, ax, ay, az].
+#
+# https://en.wikipedia.org/wiki/Semi-implicit_Euler_method
+# https://en.wikipedia.org/wiki/Runge%E2%80%93Kutta_methods
+# https://en.wikipedia.org/wiki/Dormand%E2%80%93Prince_method
+import math
+import numpy as np
+import unittest
+import constants
+
+
+class Integrator:
+
+    """
+    Base class for integrators.
+
+    dt = (initial) step size in seconds.
+    min_step, max_step = bounds on the step size for adaptive integrators.
+    """
+    def __init__(self, dt, min_step = None, max_step = None):
+        self.initial_step = dt
+        self.min_step = dt if min_step is None else min_step
+        self.max_step = dt if max_step is None else max_step
+        # number of derivative evaluations done so far.
+        self.evaluations = 0
+
+    @property
+    def adaptive(self):
+        return False
+
+    """
+    Advance state by at most dt seconds.
+    Returns [new state, step actually taken, suggested next step].
+    """
+    def step(self, derivative, t, state, dt):
+        print("Integrator::step not defined.")
+        exit(-1)
+
+
+class SymplecticEuler(Integrator):
+
+    """
+    Fixed step semi-implicit Euler, the scheme run_simulation always used:
+    velocity += a * dt; position += velocity * dt.
+    """
+    def step(self, derivative, t, state, dt):
+        self.evaluations += 1
+        d = derivative(t, state)
+        new = np.empty_like(state)
+        new[3:] = state[3:] + d[3:] * dt
+        new[:3] = state[:3] + new[3:] * dt
+        return new, dt, self.initial_step
+
+
+class RK4(Integrator):
+
+    """
+    Classic fixed step fourth order Runge-Kutta.
+    """
+    def step(self, derivative, t, state, dt):
+        self.evaluations += 4
+        k1 = derivative(t, state)
+        k2 = derivative(t + dt / 2.0, state + k1 * (dt / 2.0))
+        k3 = derivative(t + dt / 2.0, state + k2 * (dt / 2.0))
+        k4 = derivative(t + dt, state + k3 * dt)
+        return state + (k1 + 2.0 * k2 + 2.0 * k3 + k4) * (dt / 6.0), dt, self.initial_step
+
+
+# Dormand-Prince 5(4) Butcher tableau.
+_DP_C = [0.0, 1.0/5.0, 3.0/10.0, 4.0/5.0, 8.0/9.0, 1.0, 1.0]
+_DP_A = [
+    [],
+    [1.0/5.0],
+    [3.0/40.0, 9.0/40.0],
+    [44.0/45.0, -56.0/15.0, 32.0/9.0],
+    [19372.0/6561.0, -25360.0/2187.0, 64448.0/6561.0, -212.0/729.0],
+    [9017.0/3168.0, -355.0/33.0, 46732.0/5247.0, 49.0/176.0, -5103.0/18656.0],
+    [35.0/384.0, 0.0, 500.0/1113.0, 125.0/192.0, -2187.0/6784.0, 11.0/84.0],
+]
+# 5th order weights are the last row of A, E is 5th minus 4th order weights.
+_DP_B = np.array(_DP_A[6] + [0.0])
+_DP_E = _DP_B - np.array([5179.0/57600.0, 0.0, 7571.0/16695.0, 393.0/640.0, -92097.0/339200.0, 187.0/2100.0, 1.0/40.0])
+
+
+class RK45(Integrator):
+
+    """
+    Adaptive embedded Runge-Kutta, Dormand-Prince 5(4).
+
+    The local error estimate of every step is kept below
+    atol + rtol * |state| per component, failing steps are retried
+    with a smaller step down to min_step.
+    """
+    def __init__(self, dt = 0.1, rtol = 1e-9, atol = 1e-6, min_step = 1e-3, max_step = 600.0):
+        super().__init__(dt, min_step, max_step)
+        self.rtol = rtol
+        self.atol = atol
+        self.rejected = 0
+
+    @property
+    def adaptive(self):
+        return True
+
+    def step(self, derivative, t, state, dt):
+
+        # Never step further than asked, the caller clamps at events.
+        dt = min(dt, self.max_step)
+        k = np.empty((7, len(state)))
+
+        while True:
+            k[0] = derivative(t, state)
+            for i in range(1, 7):
+                k[i] = derivative(t + _DP_C[i] * dt, state + dt * np.dot(_DP_A[i], k[:i]))
+            self.evaluations += 7
+
+            new = state + dt * np.dot(_DP_B, k)
+            scale = self.atol + self.rtol * np.maximum(np.abs(state), np.abs(new))
+            error = math.sqrt(np.mean((dt * np.dot(_DP_E, k) / scale) ** 2))
+
+            # Standard step size controller, 5th order so exponent 1/5.
+            if error == 0.0:
+                factor = 5.0
+            else:
+                factor = min(5.0, max(0.2, 0.9 * error ** -0.2))
+
+            if error <= 1.0 or dt <= self.min_step:
+                return new, dt, min(max(dt * factor, self.min_step), self.max_step)
+
+            self.rejected += 1
+            dt = max(dt * factor, min(dt, self.min_step))
+
+
+
+class IntegratorUnitTest(unittest.TestCase):
+
+    # Circular orbit at 400km around earth.
+    def kepler(self):
+        mu = constants.G * constants.earth_mass
+        r = constants.earth_radius + 400e3
+        v = math.sqrt(mu / r)
+        period = 2.0 * math.pi * math.sqrt(r ** 3 / mu)
+
+        def derivative(t, state):
+            d = np.empty(6)
+            d[:3] = state[3:]
+            d[3:] = -mu * state[:3] / np.linalg.norm(state[:3]) ** 3
+            return d
+
+        return derivative, np.array([r, 0.0, 0.0, 0.0, v, 0.0]), period
+
+    def propagate(self, integrator, duration):
+        derivative, state, period = self.kepler()
+        t = 0.0
+        dt = integrator.initial_step
+        while t < duration:
+            state, taken, dt = integrator.step(derivative, t, state, min(dt, duration - t))
+            t += taken
+        return state
+
+    def test_rk4_one_orbit(self):
+        derivative, start, period = self.kepler()
+        end = self.propagate(RK4(1.0), period)
+        self.assertLess( np.linalg.norm(end[:3] - start[:3]), 1.0 )
+
+    def test_rk45_one_orbit(self):
+        derivative, start, period = self.kepler()
+        integrator = RK45(rtol=1e-10, atol=1e-6)
+        end = self.propagate(integrator, period)
+        self.assertLess( np.linalg.norm(end[:3] - start[:3]), 1.0 )
+
+        # Euler at 0.1s needs one evaluation per 0.1s, way more than RK45.
+        self.assertLess( integrator.evaluations * 10, period / 0.1 )
+
+    def test_euler_drift(self):
+        derivative, start, period = self.kepler()
+        end = self.propagate(SymplecticEuler(0.1), period)
+        # Symplectic, so the orbit stays bounded even at this order.
+        self.assertLess( np.linalg.norm(end[:3] - start[:3]), 1e3 )
+
+
+if __name__ == '__main__':
+    unittest.main()
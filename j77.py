@@ -0,0 +1,218 @@
+# Jacchia 1977 model atmosphere generator
+#
+# NumPy port of jacchia-77/j77sri.for by David L. Huestis, SRI
+# International, see jacchia-77/aareadme.doc. Given an exospheric
+# temperature it returns altitude profiles of temperature, the number
+# densities of N2, O2, O, Ar, He and H, their sum and the molecular weight,
+# for every whole kilometer from the ground up.
+#
+# Below 86 km this is the 1976 U.S. Standard Atmosphere, from 86 to 89 km
+# the barometric equation with a fitted molecular weight, from 90 km up
+# Jacchia 1977. The Fortran integrates the barometric equation kilometer
+# by kilometer; here those recurrences are cumulative sums of logarithms.
+#
+# table() formats a profile like jacchia-77/t1000.out, which testj77.for
+# printed for 1000 K.
+import math
+import unittest
+import numpy as np
+
+# Bump when a change alters the generated numbers, cached tables made by
+# an older version are ignored.
+VERSION = 1
+
+# Molecular weights and sea level fractions.
+_wm0, _wmN2, _wmO2, _wmO, _wmAr, _wmHe, _wmH = 28.96, 28.0134, 31.9988, 15.9994, 39.948, 4.0026, 1.0079
+_qN2, _qO2, _qAr, _qHe = 0.78110, 0.20955, 0.009343, 0.000005242
+
+_pi2 = 1.57079632679
+
+# g / R for one km and one g/mol, halved for the trapezoid rule.
+_barometric = 0.5897446
+
+# U.S. Standard Atmosphere 1976 layers up to 85 km:
+# last altitude (km), base geopotential height, base pressure (atm),
+# base temperature, temperature gradient (K/km).
+_layers = [
+    [11, 0.0, 1.0, 288.15, -6.5],
+    [20, 11.0, 2.233611E-1, 216.65, 0.0],
+    [32, 20.0, 5.403295E-2, 216.65, 1.0],
+    [47, 32.0, 8.5666784E-3, 228.65, 2.8],
+    [51, 47.0, 1.0945601E-3, 270.65, 0.0],
+    [71, 51.0, 6.6063531E-4, 270.65, -2.8],
+    [85, 71.0, 3.9046834E-5, 214.65, -2.0],
+]
+
+# Relative gravity at z km.
+def _gravity(z):
+    return (1.0 + z / 6356.766) ** -2
+
+# Oxygen dissociation fit below 90 km.
+def _dissociation(z):
+    return 10.0 ** (-3.7469 + (z - 85) * (0.226434 - (z - 85) * 5.945E-3))
+
+
+"""
+Profiles for exospheric temperature Tinf (K) from 0 to maxz km, one
+row per kilometer. Returns a dictionary of arrays:
+Z (km), T (K), N2, O2, O, Ar, He, H, M (all 1/cm3) and WM (g/mol).
+"""
+def profile(Tinf, maxz = 2500):
+
+    if maxz < 100:
+        raise ValueError("j77.py | maxz has to be at least 100 km.")
+
+    Z = np.arange(maxz + 1, dtype=float)
+    T = np.empty(maxz + 1)
+    CM = np.zeros(maxz + 1)
+    WM = np.zeros(maxz + 1)
+    CN2, CO2, CO, CAr, CHe, CH = [ np.zeros(maxz + 1) for i in range(6) ]
+
+    # Up to 85 km, U.S. Standard Atmosphere 1976.
+    low = Z[:86]
+    h = low * 6369.0 / (low + 6369.0)
+    first = 0
+    for last, hbase, pbase, tbase, tgrad in _layers:
+        part = slice(first, last + 1)
+        if tgrad != 0.0:
+            T[part] = tbase + tgrad * (h[part] - hbase)
+            x = (tbase / T[part]) ** (34.163195 / tgrad)
+        else:
+            T[part] = tbase
+            x = np.exp(-34.163195 * (h[part] - hbase) / tbase)
+        CM[part] = 2.547E19 * (288.15 / T[part]) * pbase * x
+        first = last + 1
+    WM[:86] = _wm0 * (1.0 - _dissociation(low))
+
+    # 86 to 89 km, barometric equation with fudged molecular weight.
+    T[86:90] = 188.0
+    WM[86:90] = _wm0 * (1.0 - _dissociation(Z[86:90]))
+    steps = (T[85:89] / T[86:90]) * (WM[86:90] / WM[85:89]) * np.exp(-_barometric * (
+        WM[85:89] / T[85:89] * _gravity(Z[85:89]) + WM[86:90] / T[86:90] * _gravity(Z[86:90])))
+    CM[86:90] = CM[85] * np.cumprod(steps)
+
+    # Below 90 km the species follow from the dissociation.
+    y = _dissociation(Z[:90])
+    x = 1.0 - y
+    CN2[:90] = _qN2 * CM[:90]
+    CO[:90] = 2.0 * y * CM[:90]
+    CO2[:90] = (x * _qO2 - y) * CM[:90]
+    CAr[:90] = _qAr * CM[:90]
+    CHe[:90] = _qHe * CM[:90]
+
+    # From 90 km, Jacchia 1977 temperature profile.
+    high = Z[91:]
+    if Tinf < 188.1:
+        T[90:] = 188.0
+    else:
+        x = 0.0045 * (Tinf - 188.0)
+        Tx = 188.0 + 110.5 * math.log(x + math.sqrt(x * x + 1.0))
+        Gx = _pi2 * 1.9 * (Tx - 188.0) / (125.0 - 90.0)
+        T[90] = 188.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            below = (Tx + ((Tx - 188.0) / _pi2)
+                     * np.arctan((Gx / (Tx - 188.0)) * (high - 125.0) * (1.0 + 1.7 * ((high - 125.0) / (high - 90.0)) ** 2)))
+        above = Tx + ((Tinf - Tx) / _pi2) * np.arctan((Gx / (Tinf - Tx)) * (high - 125.0) * (1.0 + 5.5e-5 * (high - 125.0) ** 2))
+        T[91:] = np.where(high <= 125.0, below, above)
+
+    # 90 to 100 km, mixing with the fitted mean molecular weight.
+    x = Z[90:101] - 90.0
+    E5M = 28.89122 + x * (-2.83071E-2 + x * (-6.59924E-3 + x * (-3.39574E-4 + x * (+6.19256E-5 + x * (-1.84796E-6)))))
+    G = _gravity(Z[90:101])
+    t = T[90:101]
+    log_E6P = np.concatenate(([0.0], np.cumsum(-_barometric * (G[1:] * E5M[1:] / t[1:] + G[:-1] * E5M[:-1] / t[:-1]))))
+    E6P = 7.145E13 * T[90] * np.exp(log_E6P)
+    x = E5M / _wm0
+    y = E6P / t
+    CN2[90:101] = _qN2 * y * x
+    CO[90:101] = 2.0 * (1.0 - x) * y
+    CO2[90:101] = (x * (1.0 + _qO2) - 1.0) * y
+    CAr[90:101] = _qAr * y * x
+    CHe[90:101] = _qHe * y * x
+
+    # Above 100 km, diffusive equilibrium per species.
+    G = _gravity(Z[100:])
+    t = T[100:]
+    x = _barometric * (G[1:] / t[1:] + G[:-1] / t[:-1])
+    log_y = np.log(t[:-1] / t[1:])
+    for C, wm, thermal in [[CN2, _wmN2, 1.0], [CO2, _wmO2, 1.0], [CO, _wmO, 1.0], [CAr, _wmAr, 1.0], [CHe, _wmHe, 0.62]]:
+        C[101:] = C[100] * np.exp(np.cumsum(thermal * log_y - wm * x))
+
+    # Jacchia 1977 empirical corrections to [O] and [O2].
+    z = Z[90:]
+    CO2[90:] *= 10.0 ** (-0.07 * (1.0 + np.tanh(0.18 * (z - 111.0))))
+    CO[90:] *= 10.0 ** (-0.24 * np.exp(-0.009 * (z - 97.7) ** 2))
+    CM[90:] = CN2[90:] + CO2[90:] + CO[90:] + CAr[90:] + CHe[90:] + CH[90:]
+    WM[90:] = (_wmN2 * CN2[90:] + _wmO2 * CO2[90:] + _wmO * CO[90:] + _wmAr * CAr[90:] + _wmHe * CHe[90:] + _wmH * CH[90:]) / CM[90:]
+
+    # Hydrogen from 150 km, only when going up to 500 km or more.
+    if maxz >= 500:
+        phid00 = 10.0 ** (6.9 + 28.9 * Tinf ** -0.25) / 2.E20 * 5.24E2
+        H_500 = 10.0 ** (-0.06 + 28.9 * Tinf ** -0.25)
+
+        t = T[150:]
+        phid0 = phid00 / np.sqrt(t)
+        w = _wmH * _barometric * _gravity(Z[150:]) / t + phid0
+        flux = CM[150:] * phid0
+        w = np.concatenate(([0.0], np.cumsum(w[:-1] + w[1:])))
+        w = np.exp(w) * (t / T[150]) ** 0.75
+        flux = w * flux
+        flux = np.concatenate(([0.0], np.cumsum(0.5 * (flux[:-1] + flux[1:]))))
+        CH[150:] = (w[500 - 150] / w) * (H_500 - (flux - flux[500 - 150]))
+
+        CM[150:] = CN2[150:] + CO2[150:] + CO[150:] + CAr[150:] + CHe[150:] + CH[150:]
+        WM[150:] = (_wmN2 * CN2[150:] + _wmO2 * CO2[150:] + _wmO * CO[150:] + _wmAr * CAr[150:] + _wmHe * CHe[150:] + _wmH * CH[150:]) / CM[150:]
+
+    return { 'Z': Z, 'T': T, 'N2': CN2, 'O2': CO2, 'O': CO, 'Ar': CAr, 'He': CHe, 'H': CH, 'M': CM, 'WM': WM }
+
+
+"""
+Profile for Tinf as rows like t1000.out, one per kilometer:
+altitude (km), temperature (K), log10 of the N2, O2, O, Ar, He, H and
+total number densities per cubic meter (-9.9 for none) and the
+molecular weight.
+"""
+def table(Tinf, maxz = 2500):
+    p = profile(Tinf, maxz)
+    columns = [p['Z'], p['T']]
+    for name in ['N2', 'O2', 'O', 'Ar', 'He', 'H', 'M']:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            columns.append(np.where(p[name] > 1.26E-16, np.log10(p[name]) + 6.0, -9.9))
+    columns.append(p['WM'])
+    return np.column_stack(columns)
+
+
+
+class J77UnitTest(unittest.TestCase):
+
+    def reference(self):
+        import jacchia
+        return np.array(jacchia._parse(jacchia.table_path))
+
+    def test_matches_t1000(self):
+        reference = self.reference()
+        generated = table(1000.0)[reference[:, 0].astype(int)]
+        # Equal up to the decimals testj77.for printed.
+        self.assertLess( np.max(np.abs(generated[:, 1] - reference[:, 1])), 0.0051 )
+        self.assertLess( np.max(np.abs(generated[:, 2:9] - reference[:, 2:9])), 0.000051 )
+        self.assertLess( np.max(np.abs(generated[:, 9] - reference[:, 9])), 0.00051 )
+
+    def test_temperature(self):
+        cold = profile(600.0)
+        hot = profile(1400.0)
+        self.assertAlmostEqual( cold['T'][-1], 600.0, places=1 )
+        self.assertAlmostEqual( hot['T'][-1], 1400.0, places=1 )
+        # Below 90 km the exospheric temperature does not matter.
+        self.assertTrue( np.array_equal(cold['M'][:90], hot['M'][:90]) )
+        # A hotter thermosphere is denser at 400 km.
+        self.assertGreater( hot['M'][400], 5.0 * cold['M'][400] )
+
+    def test_short_profile(self):
+        p = profile(1000.0, 300)
+        self.assertEqual( len(p['Z']), 301 )
+        self.assertTrue( np.all(p['H'] == 0.0) )
+        self.assertTrue( np.allclose(p['N2'], profile(1000.0)['N2'][:301]) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+# Launch sites
+#
+# A LaunchSite is a latitude, longitude and launch azimuth on a rotating
+# body. z is the axis of rotation and longitude 0 lies on the x axis when
+# t = 0, the frames of body.py. Everything that only depends on the site,
+# the local up, east and north and the plane the rocket pitches over in,
+# is computed once when the site is made:
+#
+#   heading = cos(azimuth) north + sin(azimuth) east
+#   normal  = up x heading
+#
+# normal is the normal of the pitch plane, guidance turns the rocket
+# towards normal x position. Without the rotation of the body the orbit
+# ends up in that plane, cos(inclination) = cos(latitude) sin(azimuth).
+# Due east from the equator normal is z, the (-y, x, 0) guidance of
+# run_simulation. The rocket starts with the surface speed of the site,
+# which is what moves the inclination off that plane.
+#
+# LaunchSites is the same for many sites as (N, 3) arrays, so sweeping
+# azimuth and latitude over thousands of BatchSimulation runs costs a few
+# NumPy operations to set up.
+#
+#   sites = LaunchSites.grid(np.arange(0.0, 60.0, 5.0), np.arange(45.0, 136.0, 5.0))
+#   batch = batch.atlas_v401_sites(earth, sites, 8.0e3, orbit_altitude=150e3)
+#   batch.run()
+#   batch.inclination()
+#
+# https://en.wikipedia.org/wiki/Launch_azimuth
+# https://en.wikipedia.org/wiki/Orbital_inclination
+import math
+import unittest
+import numpy as np
+from vect import Vec3
+
+
+"""
+Local frames of sites, latitude and longitude in degrees, scalars or
+arrays. Returns up, east, north, each an (N, 3) array.
+"""
+def _frames(latitude, longitude):
+    phi = np.radians(np.atleast_1d(np.asarray(latitude, dtype=float)))
+    lam = np.radians(np.atleast_1d(np.asarray(longitude, dtype=float)))
+    phi, lam = np.broadcast_arrays(phi, lam)
+    cos_phi = np.cos(phi)
+    sin_phi = np.sin(phi)
+    cos_lam = np.cos(lam)
+    sin_lam = np.sin(lam)
+    up = np.stack([ cos_phi * cos_lam, cos_phi * sin_lam, sin_phi ], axis=1)
+    east = np.stack([ -sin_lam, cos_lam, np.zeros_like(lam) ], axis=1)
+    north = np.stack([ -sin_phi * cos_lam, -sin_phi * sin_lam, cos_phi ], axis=1)
+    return up, east, north
+
+
+class LaunchSite:
+
+    """
+    LaunchSite constructor
+
+    latitude = geocentric latitude in degrees, north positive.
+    longitude = in degrees, east positive.
+    azimuth = launch azimuth in degrees, clockwise from north, 90 is due
+      east.
+    altitude = of the pad above the surface in meters.
+    name = for printing.
+    """
+    def __init__(self, latitude, longitude, azimuth = 90.0, altitude = 0.0, name = ""):
+        if not -90.0 <= latitude <= 90.0:
+            raise ValueError("launch.py | latitude has to be within [-90, 90] degrees.")
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.azimuth = float(azimuth)
+        self.altitude = float(altitude)
+        self.name = name
+        up, east, north = _frames(latitude, longitude)
+        a = math.radians(azimuth)
+        heading = math.cos(a) * north[0] + math.sin(a) * east[0]
+        self.up = Vec3(up[0])
+        self.east = Vec3(east[0])
+        self.north = Vec3(north[0])
+        self.heading = Vec3(heading)
+        self.normal = self.up.cross(self.heading)
+
+    def __repr__(self):
+        return "LaunchSite({!r}, {:.3f}, {:.3f}, azimuth {:.1f})".format(self.name, self.latitude, self.longitude, self.azimuth)
+
+    """
+    Inertial position of the pad at t = 0.
+    """
+    def position(self, body):
+        return self.up.deepcopy().mult(body.radius + self.altitude)
+
+    """
+    Inertial velocity of the pad at t = 0, the surface speed of body there.
+    """
+    def velocity(self, body):
+        return body.surface_speed(self.position(body))
+
+    """
+    Put rocket on the pad, standing up. Returns the rocket.
+    """
+    def place(self, rocket, body):
+        rocket.position = self.position(body)
+        rocket.velocity = self.velocity(body)
+        rocket.set_orientation(self.up.deepcopy())
+        return rocket
+
+    """
+    Inclination in degrees of the pitch plane, the orbit the rocket would
+    reach on a body that does not rotate.
+    """
+    @property
+    def inclination(self):
+        return math.degrees(math.acos(max(-1.0, min(1.0, self.normal[2]))))
+
+
+class LaunchSites:
+
+    """
+    LaunchSites constructor, many sites as arrays. latitude, longitude,
+    azimuth and altitude broadcast against each other, in the units of
+    LaunchSite.
+    """
+    def __init__(self, latitude, longitude, azimuth = 90.0, altitude = 0.0):
+        latitude, longitude, azimuth, altitude = np.broadcast_arrays(
+            *[ np.atleast_1d(np.asarray(value, dtype=float)) for value in [latitude, longitude, azimuth, altitude] ])
+        if np.any(np.abs(latitude) > 90.0):
+            raise ValueError("launch.py | latitude has to be within [-90, 90] degrees.")
+        self.latitude = latitude.copy()
+        self.longitude = longitude.copy()
+        self.azimuth = azimuth.copy()
+        self.altitude = altitude.copy()
+        self.up, self.east, self.north = _frames(self.latitude, self.longitude)
+        a = np.radians(self.azimuth)[:, None]
+        self.heading = np.cos(a) * self.north + np.sin(a) * self.east
+        self.normal = np.cross(self.up, self.heading)
+
+    """
+    Every combination of latitudes and azimuths at one longitude, latitude
+    major.
+    """
+    @staticmethod
+    def grid(latitudes, azimuths, longitude = 0.0, altitude = 0.0):
+        latitude, azimuth = np.meshgrid(np.asarray(latitudes, dtype=float), np.asarray(azimuths, dtype=float), indexing='ij')
+        return LaunchSites(latitude.ravel(), longitude, azimuth.ravel(), altitude)
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def __getitem__(self, key):
+        return LaunchSite(self.latitude[key], self.longitude[key], self.azimuth[key], self.altitude[key])
+
+    """
+    Inertial positions of the pads at t = 0, an (N, 3) array.
+    """
+    def positions(self, body):
+        return self.up * (body.radius + self.altitude)[:, None]
+
+    """
+    Inertial velocities of the pads at t = 0, an (N, 3) array.
+    """
+    def velocities(self, body):
+        return body.surface_speed_array(self.positions(body))
+
+    """
+    Vectorized LaunchSite.inclination.
+    """
+    def inclination(self):
+        return np.degrees(np.arccos(np.clip(self.normal[:, 2], -1.0, 1.0)))
+
+
+
+class LaunchSiteUnitTest(unittest.TestCase):
+
+    def test_frame(self):
+        from body import Earth
+        earth = Earth()
+        # The launch of run_simulation, due east from [0, R, 0].
+        site = LaunchSite(0.0, 90.0)
+        self.assertTrue( np.allclose(list(site.position(earth)), [0.0, earth.radius, 0.0], atol=1e-6) )
+        self.assertTrue( np.allclose(list(site.normal), [0.0, 0.0, 1.0]) )
+        self.assertTrue( np.allclose(list(site.velocity(earth)), list(earth.surface_speed(Vec3([0.0, earth.radius, 0.0]))), atol=1e-9) )
+        self.assertAlmostEqual( site.inclination, 0.0 )
+
+        # Cape Canaveral, due east gives the latitude, north east more.
+        cape = LaunchSite(28.5, -80.6, 90.0)
+        self.assertAlmostEqual( cape.inclination, 28.5 )
+        self.assertAlmostEqual( math.cos(math.radians(LaunchSite(28.5, -80.6, 45.0).inclination)),
+                                math.cos(math.radians(28.5)) * math.sin(math.radians(45.0)) )
+        self.assertAlmostEqual( LaunchSite(28.5, -80.6, 0.0).inclination, 90.0 )
+        self.assertAlmostEqual( LaunchSite(28.5, -80.6, 270.0).inclination, 180.0 - 28.5 )
+        self.assertAlmostEqual( cape.velocity(earth).magnitude, 463.97 * math.cos(math.radians(28.5)), places=1 )
+        self.assertAlmostEqual( cape.velocity(earth).dot(cape.east), cape.velocity(earth).magnitude )
+        with self.assertRaises(ValueError):
+            LaunchSite(91.0, 0.0)
+
+    def test_sites_match_site(self):
+        from body import Earth
+        earth = Earth()
+        sites = LaunchSites.grid([0.0, 28.5, -45.0, 90.0], [0.0, 45.0, 90.0, 200.0], longitude=-80.6, altitude=10.0)
+        self.assertEqual( len(sites), 16 )
+        positions = sites.positions(earth)
+        velocities = sites.velocities(earth)
+        inclination = sites.inclination()
+        for k in range(len(sites)):
+            site = sites[k]
+            self.assertTrue( np.allclose(positions[k], list(site.position(earth)), atol=1e-6) )
+            self.assertTrue( np.allclose(velocities[k], list(site.velocity(earth)), atol=1e-9) )
+            self.assertTrue( np.allclose(sites.normal[k], list(site.normal)) )
+            self.assertAlmostEqual( inclination[k], site.inclination )
+        self.assertEqual( sites.latitude[4], 28.5 )
+        self.assertEqual( sites.azimuth[4], 0.0 )
+
+    def test_place(self):
+        from body import Earth
+        from atlas import AtlasV401
+        earth = Earth()
+        cape = LaunchSite(28.5, -80.6)
+        rocket = cape.place(AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0])), earth)
+        rocket.throttle = 1.0
+        # Standing up on the pad, thrusting straight up.
+        thrust = rocket.thrust(101325.0)
+        self.assertGreater( thrust.magnitude, 0.0 )
+        self.assertTrue( np.allclose(list(thrust.deepcopy().normalize()), list(cape.up)) )
+
+    def test_run_simulation(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from integrator import SymplecticEuler
+
+        earth = Earth()
+        def fly(site = None, rotating = False):
+            rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+            rocket.velocity = earth.surface_speed(rocket.position)
+            stats = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_simulation(earth, rocket, 150e3, SymplecticEuler(0.1), 300.0, stats=stats, site=site, rotating=rotating)
+            return rocket, stats
+
+        rocket, stats = fly()
+        equator, equator_stats = fly(LaunchSite(0.0, 90.0))
+        self.assertTrue( np.allclose(equator.position[:], rocket.position[:], rtol=1e-9) )
+        self.assertAlmostEqual( equator_stats['max_q'] / stats['max_q'], 1.0, places=9 )
+
+        cape, cape_stats = fly(LaunchSite(28.5, -80.6), rotating=True)
+        h = cape.position.cross(cape.velocity)
+        self.assertAlmostEqual( math.degrees(math.acos(h[2] / h.magnitude)), 28.5, places=2 )
+        self.assertLess( cape_stats['max_q'], stats['max_q'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
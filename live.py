@@ -0,0 +1,405 @@
+# Live telemetry
+#
+# Streams the state of running simulations to whoever is listening, over
+# TCP on localhost. The simulation records into a LiveSink, which puts a
+# decimated frame on a bounded queue without ever waiting: when the queue
+# is full the frame is dropped. A TelemetryServer runs an asyncio loop in
+# its own thread, takes the frames off the queue and sends them to every
+# subscriber. Subscribers that read slower than frames come in get the
+# frames that piled up coalesced into one message, and lose the oldest
+# ones once more than client_frames are waiting.
+#
+# The queue may also be a multiprocessing queue, sweep.py hands it to its
+# worker processes so every run of a sweep streams with its run index.
+#
+# Protocol, all little endian:
+#   hello    magic b'RSLT', version uint16, frame size uint16
+#   message  frame count uint32, followed by that many FRAME records
+#
+# python live.py run --port 8765 --wait
+# python live.py tail --port 8765
+# python sweep.py --payload 1000:12000:1000 --live 8765
+import argparse
+import asyncio
+import math
+import queue
+import struct
+import threading
+import time
+import unittest
+import numpy as np
+from telemetry import Sink, ChunkedBuffer
+
+MAGIC = b'RSLT'
+VERSION = 1
+
+# One frame. altitude in km, drag and thrust in kN like the telemetry
+# of run_simulation, run tells the runs of a sweep apart.
+FRAME = np.dtype([
+    ('run', '<u4'),
+    ('time', '<f8'),
+    ('altitude', '<f8'),
+    ('velocity', '<f8'),
+    ('drag', '<f8'),
+    ('thrust', '<f8'),
+    ('mass', '<f8'),
+    ('stage', '<u2'),
+    ('throttle', '<f4'),
+])
+
+_HELLO = struct.Struct('<4sHH')
+_COUNT = struct.Struct('<I')
+
+
+def encode(frames):
+    return _COUNT.pack(len(frames)) + np.ascontiguousarray(frames, dtype=FRAME).tobytes()
+
+
+"""
+Put frames on queue without waiting. Returns False when the queue is
+full and the frames were dropped.
+"""
+def publish(frames_queue, frames):
+    try:
+        frames_queue.put_nowait(frames)
+    except queue.Full:
+        return False
+    return True
+
+
+class LiveSink(Sink):
+
+    """
+    Telemetry sink for run_simulation that streams every Nth row.
+
+    frames_queue = where to put the frames, TelemetryServer.queue or a
+      multiprocessing queue feeding one.
+    rocket = optional Rocket, for the stage and throttle of the frames.
+    sink = sink the rows go on to, a ChunkedBuffer by default.
+    every = stream every Nth row, a stage change is streamed right away.
+    run = index of the run in the frames.
+    """
+    def __init__(self, frames_queue, rocket = None, sink = None, every = 10, run = 0):
+        if sink is None:
+            sink = ChunkedBuffer()
+        super().__init__(sink.names)
+        self.__queue = frames_queue
+        self.__rocket = rocket
+        self.__sink = sink
+        self.__every = every
+        self.__run = run
+        self.__count = 0
+        self.__stage = None
+        self.__index = [ self.names.index(name) if name in self.names else None for name in FRAME.names[1:7] ]
+        self.dropped = 0
+
+    @property
+    def sink(self):
+        return self.__sink
+
+    def record(self, *values):
+        self.__sink.record(*values)
+
+        stage, throttle = 0, 0.0
+        if self.__rocket is not None:
+            stage, throttle = self.__rocket.current_stage, self.__rocket.throttle
+        if self.__count % self.__every == 0 or stage != self.__stage:
+            frame = np.empty(1, FRAME)
+            frame[0] = (self.__run,) + tuple( math.nan if i is None else values[i] for i in self.__index ) + (stage, throttle)
+            if not publish(self.__queue, frame):
+                self.dropped += 1
+            self.__stage = stage
+        self.__count += 1
+
+    def flush(self):
+        self.__sink.flush()
+
+    def columns(self):
+        return self.__sink.columns()
+
+    def close(self):
+        self.__sink.close()
+
+
+# Frames waiting for one subscriber, at most limit of them.
+class _Subscriber:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = []
+        self.count = 0
+        self.dropped = 0
+        self.closing = False
+        self.wake = asyncio.Event()
+
+    def push(self, frames):
+        self.pending.append(frames)
+        self.count += len(frames)
+        # Reading too slowly, the oldest frames go.
+        while self.count > self.limit:
+            over = self.count - self.limit
+            first = self.pending[0]
+            if len(first) <= over:
+                self.pending.pop(0)
+                over = len(first)
+            else:
+                self.pending[0] = first[over:]
+            self.count -= over
+            self.dropped += over
+        self.wake.set()
+
+    def take(self):
+        frames = np.concatenate(self.pending) if self.pending else np.empty(0, FRAME)
+        self.pending = []
+        self.count = 0
+        return frames
+
+
+class TelemetryServer:
+
+    """
+    TelemetryServer constructor
+
+    host, port = where to listen, port 0 picks a free one, see port.
+    queue_size = frames (batches of frames really) the queue holds.
+    client_frames = frames kept for a subscriber that falls behind.
+    poll = seconds between looking at the queue.
+    frames_queue = optional queue to serve instead of a new queue.Queue,
+      a multiprocessing queue for frames from other processes.
+    """
+    def __init__(self, host = '127.0.0.1', port = 0, queue_size = 4096, client_frames = 4096, poll = 0.02, frames_queue = None):
+        self.host = host
+        self.port = port
+        self.queue = queue.Queue(queue_size) if frames_queue is None else frames_queue
+        self.__client_frames = client_frames
+        self.__poll = poll
+        self.__subscribers = set()
+        self.__started = threading.Event()
+        self.__thread = None
+        self.__loop = None
+        self.__stop = None
+        self.__error = None
+        self.frames = 0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def subscribers(self):
+        return len(self.__subscribers)
+
+    """
+    Start serving in a background thread. Returns self once listening.
+    """
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name='telemetry-server', daemon=True)
+        self.__thread.start()
+        self.__started.wait()
+        if self.__error is not None:
+            raise self.__error
+        return self
+
+    """
+    Wait until count subscribers are connected, False on timeout.
+    """
+    def wait_for_subscribers(self, count = 1, timeout = None):
+        end = None if timeout is None else time.time() + timeout
+        while self.subscribers < count:
+            if end is not None and time.time() > end:
+                return False
+            time.sleep(0.01)
+        return True
+
+    """
+    Send what is still queued, disconnect everyone and stop.
+    """
+    def close(self, timeout = 5.0):
+        if self.__thread is None:
+            return
+        self.__loop.call_soon_threadsafe(self.__stop.set)
+        self.__thread.join(timeout)
+        self.__thread = None
+
+    def __run(self):
+        try:
+            asyncio.run(self.__serve())
+        except Exception as e:
+            self.__error = e
+            self.__started.set()
+
+    async def __serve(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+        server = await asyncio.start_server(self.__subscribe, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.__started.set()
+
+        async with server:
+            while not self.__stop.is_set():
+                self.__pump()
+                try:
+                    await asyncio.wait_for(self.__stop.wait(), self.__poll)
+                except asyncio.TimeoutError:
+                    pass
+            self.__pump()
+            tasks = []
+            for subscriber in self.__subscribers:
+                subscriber.closing = True
+                subscriber.wake.set()
+                tasks.append(subscriber.task)
+            if tasks:
+                await asyncio.wait(tasks, timeout=1.0)
+
+    # Hand everything queued to the subscribers.
+    def __pump(self):
+        batches = []
+        while True:
+            try:
+                batches.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batches:
+            return
+        frames = np.concatenate(batches)
+        self.frames += len(frames)
+        for subscriber in self.__subscribers:
+            subscriber.push(frames)
+
+    async def __subscribe(self, reader, writer):
+        subscriber = _Subscriber(self.__client_frames)
+        subscriber.task = asyncio.current_task()
+        self.__subscribers.add(subscriber)
+        try:
+            writer.write(_HELLO.pack(MAGIC, VERSION, FRAME.itemsize))
+            while True:
+                await subscriber.wake.wait()
+                subscriber.wake.clear()
+                frames = subscriber.take()
+                if len(frames):
+                    writer.write(encode(frames))
+                    # Only this subscriber waits for its socket.
+                    await writer.drain()
+                if subscriber.closing:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.__subscribers.discard(subscriber)
+            writer.close()
+
+
+"""
+Connect to a TelemetryServer and yield arrays of FRAME as they come in,
+until the server closes the connection.
+"""
+async def subscribe(host = '127.0.0.1', port = 8765):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        magic, version, size = _HELLO.unpack(await reader.readexactly(_HELLO.size))
+        if magic != MAGIC or version != VERSION or size != FRAME.itemsize:
+            raise ValueError("live.py | not a telemetry server or an incompatible version.")
+        while True:
+            try:
+                count, = _COUNT.unpack(await reader.readexactly(_COUNT.size))
+                data = await reader.readexactly(count * FRAME.itemsize)
+            except asyncio.IncompleteReadError:
+                return
+            yield np.frombuffer(data, FRAME)
+    finally:
+        writer.close()
+
+
+"""
+Print the frames of a server, one line per frame.
+"""
+async def tail(host = '127.0.0.1', port = 8765):
+    async for frames in subscribe(host, port):
+        for f in frames:
+            print("run {:5d} t {:8.1f} s altitude {:8.1f} km velocity {:7.1f} m/s drag {:7.1f} kN thrust {:7.1f} kN mass {:9.0f} kg stage {} throttle {:.2f}".format(
+                f['run'], f['time'], f['altitude'], f['velocity'], f['drag'], f['thrust'], f['mass'], f['stage'], f['throttle']))
+
+
+
+class LiveUnitTest(unittest.TestCase):
+
+    def test_stream(self):
+        received = []
+
+        async def client(port):
+            async for frames in subscribe('127.0.0.1', port):
+                received.append(frames)
+
+        with TelemetryServer(poll=0.005) as server:
+            thread = threading.Thread(target=asyncio.run, args=(client(server.port),))
+            thread.start()
+            self.assertTrue( server.wait_for_subscribers(1, timeout=5.0) )
+            sink = LiveSink(server.queue, every=10, run=3)
+            for i in range(95):
+                sink.record(i * 0.1, i, 2.0, 3.0, 4.0, 5.0, 6.0)
+        thread.join(5.0)
+
+        frames = np.concatenate(received)
+        self.assertEqual( frames['altitude'].tolist(), list(range(0, 95, 10)) )
+        self.assertTrue( np.all(frames['run'] == 3) )
+        self.assertTrue( np.all(frames['thrust'] == 5.0) )
+        # The rows themselves all went on to the sink.
+        self.assertEqual( len(sink.columns()[0]), 95 )
+
+    def test_full_queue_drops(self):
+        sink = LiveSink(queue.Queue(2), every=1)
+        for i in range(5):
+            sink.record(i * 0.1, i, 2.0, 3.0, 4.0, 5.0, 6.0)
+        self.assertEqual( sink.dropped, 3 )
+
+    def test_slow_subscriber(self):
+        subscriber = _Subscriber(10)
+        frames = np.zeros(8, FRAME)
+        frames['time'] = np.arange(8)
+        subscriber.push(frames)
+        subscriber.push(frames.copy())
+        # Only the newest 10 are kept, coalesced into one array.
+        taken = subscriber.take()
+        self.assertEqual( taken['time'].tolist(), [6.0, 7.0] + list(range(8)) )
+        self.assertEqual( subscriber.dropped, 6 )
+        self.assertEqual( len(subscriber.take()), 0 )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Stream or tail live telemetry.")
+    parser.add_argument('command', choices=['run', 'tail', 'test'], help="run an AtlasV401 launch streaming its telemetry, or tail a server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--every', type=int, default=10, help="stream every Nth step")
+    parser.add_argument('--wait', action='store_true', help="wait for a subscriber before launching")
+    args = parser.parse_args()
+
+    if args.command == 'tail':
+        try:
+            asyncio.run(tail(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'run':
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from vect import Vec3
+
+        earth = Earth()
+        rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+        rocket.velocity = earth.surface_speed(rocket.position)
+        with TelemetryServer(args.host, args.port) as server:
+            print("streaming on {}:{}".format(server.host, server.port))
+            if args.wait:
+                server.wait_for_subscribers(1)
+            sink = LiveSink(server.queue, rocket, every=args.every)
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_simulation(earth, rocket, 150e3, telemetry=sink)
+            print("{} frames streamed, {} dropped".format(server.frames, sink.dropped))
+    else:
+        unittest.main(argv=[parser.prog])
@@ -18,10 +18,10 @@
 # 4. Static Drag [Done]
 # 5. Plotting of altitude and density, see Max-Q and RUD on re-entry to due excessive drag
 # 6. Implement coordinates [Done]
-# . Implement earth rotation
+# . Implement earth rotation [Done]
 # . Give rocket control over its direction []
 # . Implement thurst control []
-# . Multi Stage []
+# . Multi Stage, side boosters [Done]
 # . Orbit Calculations []
 # . Dynamic Thrust []
 
@@ -29,81 +29,339 @@ import numpy as np
 from body import Earth
 from rocket import Rocket
 from atlas import AtlasV401
-import plots
-import matplotlib.pyplot as plt
-from vect import Vector
+from vect import Vec3
+from integrator import SymplecticEuler
+from telemetry import ChunkedBuffer
+from events import EventDetector, Altitude, Apogee, AtmosphereInterface, Burnout, Impact, Periapsis, Staging, TargetVelocity
+import copy
 import time
-from pid import PID
 import math
-
-
-def run_simulation(body, rocket, target_orbit):
+import constants
+import orbit
+from pitch import PitchProgram
+from checkpoint import Snapshot
+
+
+# Returns derivative(t, state) for the integrators, t0 is the start of
+# the step. Throttle and orientation are held at their values at the start
+# of the step, mass drops with the current mass flow. Gravity, air pressure
+# and drag follow the trial state, unless air = [air pressure, density] is
+# given to hold over the step. The thrust then does not change over the step
+# either, thrust = optional thrust vector at air. drag_coefficient = the
+# coefficient to hold over the step, at the Mach number of its start.
+# rotating = drag against the air turning with the body instead of air at
+# rest.
+def equations_of_motion(body, rocket, t0, air = None, thrust = None, drag_coefficient = None, rotating = False):
+
+    mass = rocket.mass()
+    mass_flow = rocket.mass_flow()
+    if drag_coefficient is None:
+        drag_coefficient = rocket.drag_coefficient()
+    drag = -0.5 * drag_coefficient * rocket.drag_surface()
+    position = Vec3()
+    if air is not None and thrust is None:
+        thrust = rocket.thrust(air[0])
+    w = body.angular_velocity if rotating else 0.0
+
+    def derivative(t, state):
+        position.assign(state)
+        velocity = state[3:]
+        m = mass - mass_flow * (t - t0)
+
+        if air is None:
+            P0, density = body.air_pressure_and_density(position)
+            F = rocket.thrust(P0)
+        else:
+            P0, density = air
+            F = thrust
+        a = body.accelleration(position)
+        a.add_scaled(F, 1.0 / m)
+
+        d = np.empty(6)
+        d[:3] = velocity
+        d[3:] = a[:]
+        if w:
+            # velocity - omega x position
+            velocity = velocity.copy()
+            velocity[0] += w * state[1]
+            velocity[1] -= w * state[0]
+        d[3:] += velocity * (density * math.sqrt(velocity.dot(velocity)) * drag / m)
+        return d
+
+    return derivative
+
+
+# Velocity at which the auto pilot cuts off the engines.
+cutoff_velocity = 8672.0
+
+# Largest step while the engines burn, orientation is held over a step.
+max_powered_step = 1.0
+
+# [altitude, delta] pairs, above each altitude the auto pilot points the
+# thrust delta * 90 degrees up from the surface. A pitch.PitchProgram
+# can be flown instead.
+default_pitch_program = [ [0.0, 1.0], [1e3, 0.5], [200e3, 0.1] ]
+
+# Events every flight watches for. Steps end on these, so the auto pilot
+# and staging see them when they happen instead of a step later.
+def flight_events(body, rocket, pitch_program):
+    if isinstance(pitch_program, PitchProgram):
+        pitch_events = pitch_program.events(body)
+    else:
+        pitch_events = [ TargetVelocity(cutoff_velocity) ]
+        for pitch_altitude, pitch_delta in pitch_program:
+            if pitch_altitude > 0.0:
+                pitch_events.append(Altitude(body, pitch_altitude, 'pitch', 1))
+    return [
+        Burnout(rocket),
+        Staging(rocket),
+        Apogee(),
+        Periapsis(),
+        AtmosphereInterface(body),
+        Impact(body),
+    ] + pitch_events
+
+# Below this altitude drag is not negligible and coasting stops. At 200km
+# drag takes about a centimeter per second per orbit off an AtlasV401.
+coast_altitude = 200e3
+
+# Where to coast to on the Kepler orbit: [seconds, event name or None].
+# That is the next apsis, the point the orbit dips below coast_altitude
+# or the end of the simulation, whichever comes first. None when the
+# rocket is about to dip into the atmosphere.
+def coast_target(body, rocket, remaining):
+
+    mu = constants.G * body.mass
+    o = orbit.elements(rocket.position, rocket.velocity, mu)
+    floor = body.radius + coast_altitude
+    descending = rocket.position.dot(rocket.velocity) < 0.0
+
+    if o.periapsis < floor and descending and (o.e >= 1.0 or rocket.position.magnitude <= floor + 1.0):
+        return None
+
+    targets = [[remaining, None]]
+    if o.e < 1.0:
+        period = 2.0 * math.pi / orbit.mean_motion(o.a, mu)
+        for nu, name in [[0.0, 'periapsis'], [math.pi, 'apogee']]:
+            if nu == 0.0 and o.periapsis < floor:
+                continue
+            dt = orbit.time_to_anomaly(o, nu, mu)
+            # sitting on the apsis already, go for the next one.
+            if dt < 1e-6:
+                dt += period
+            targets.append([dt, name])
+        if o.periapsis < floor:
+            nu = orbit.anomaly_at_radius(o, floor)
+            targets.append([orbit.time_to_anomaly(o, 2.0 * math.pi - nu, mu), None])
+
+    return min(targets, key=lambda target: target[0])
+
+# target_orbit = altitude in meters of the orbit to reach, or None. A
+#   pitch.PitchProgram without a cutoff_apoapsis of its own cuts off the
+#   engines once the apoapsis reaches it.
+# stats = optional dictionary, filled with a summary of the flight:
+#   status (completed, rud, crashed or landed), t_end, max_q, max_q_time,
+#   max_force and events, a list of [time, name] of the events that fired.
+#   With a target_orbit also target_reached, whether the periapsis ended
+#   up at or above it.
+# telemetry = sink recording telemetry.COLUMNS every step, defaults to an
+#   in memory ChunkedBuffer.
+# events = extra events.Event to watch for, a terminal one ends the flight.
+#   They are not watched while coasting.
+# coast = once the engines are off and the rocket is above coast_altitude,
+#   jump ahead on the Kepler orbit instead of integrating, drifting with J2
+#   when the body has it. Telemetry then only gets a row at the end of
+#   every jump.
+# profiler = optional profiling.Profiler, timing every phase of a step.
+# autopilot = optional autopilot.Autopilot of one, closing the loop on the
+#   pitch and capping the loads with the throttle.
+# checkpoints = optional checkpoint.Checkpoints, snapshots the simulation at
+#   its events or intervals.
+# resume = optional checkpoint.Snapshot to continue from instead of the
+#   launch pad, of the same rocket. Telemetry starts at the snapshot, a
+#   Scheduler of the same rates carries on from the snapshot's updates.
+# rates = optional scheduler.Scheduler, runs guidance, the atmosphere and
+#   telemetry at their own rates instead of every step. It is reset first,
+#   everything updates on the first step.
+# site = optional launch.LaunchSite, puts the rocket on its pad (unless
+#   resuming) and pitches over towards its azimuth instead of along the
+#   (-y, x, 0) of the equator.
+# rotating = the atmosphere turns with the body, drag, the Mach number and
+#   the dynamic pressure follow the velocity relative to the air.
+# Returns the telemetry columns: time, altitude, drag, velocity, phi,
+# thrust and mass.
+def run_simulation(body, rocket, target_orbit, integrator = None, duration = 7500.0, pitch_program = None, stats = None, telemetry = None, events = None, coast = False, profiler = None, autopilot = None, checkpoints = None, resume = None, rates = None, site = None, rotating = False):
    
     # Time
     t = 0.0
 
-    # Our step size
-    dt = 0.1
-
-
-    time_list = []
-    altitude_list = []
-    phi_list = []
-    drag_list = []
-    thrust_list = []
-    velocity_list = []
-    mass_list = []
+    # Defaults to the fixed 0.1 second step we always used.
+    if integrator is None:
+        integrator = SymplecticEuler(0.1)
+    dt = integrator.initial_step
+
+    if pitch_program is None:
+        pitch_program = default_pitch_program
+    if target_orbit is not None and isinstance(pitch_program, PitchProgram) and pitch_program.cutoff_apoapsis is None:
+        pitch_program = copy.copy(pitch_program)
+        pitch_program.cutoff_apoapsis = target_orbit
+
+    if stats is None:
+        stats = {}
+    stats['status'] = 'completed'
+    stats['max_q'] = 0.0
+    stats['max_q_time'] = 0.0
+    stats['max_force'] = 0.0
+    stats['events'] = []
+    if telemetry is None:
+        telemetry = ChunkedBuffer()
+    if site is not None and resume is None:
+        site.place(rocket, body)
+
+    detector = EventDetector(flight_events(body, rocket, pitch_program) + list(events or []))
+    cutoff_events = None
+    if isinstance(pitch_program, PitchProgram):
+        cutoff_events = pitch_program.cutoff_events(body)
 
     start = time.time()
     
     rocket.throttle = 1.0
+    # Loads as fraction of max_forces and length of the last step, what
+    # the autopilot closes its loops on.
+    load = 0.0
+    dt_taken = 0.0
 
     # Let's run our simulation
-    for i in range(75000):
+    i = 0
+    if rates is not None:
+        rates.reset()
+    if resume is not None:
+        t, dt, dt_taken, load, i = resume.restore(rocket, autopilot, stats)
+
+    # Events of the last step, time since guidance last ran.
+    fired = []
+    guidance_dt = 0.0
+    # And what is held between steps, the scheduler's last updates too.
+    if resume is not None and resume.flight is not None:
+        fired = [ event for event in detector.events if event.name in resume.flight['fired'] ]
+        guidance_dt = resume.flight['guidance_dt']
+        delta = resume.flight['delta']
+        P0, density, speed_of_sound = resume.flight['air']
+        if rates is not None and resume.flight['rates'] is not None:
+            rates.restore(resume.flight['rates'])
+    physics_step = None if rates is None else rates.period('physics')
+    hold_air = rates is not None and 'atmosphere' in rates
+    # Coasting drifts with the secular J2 rates on an oblate body.
+    j2 = 0.0 if body.zonal is None else body.zonal[0]
+    if profiler:
+        profiler.start()
+    while t < duration:
+
+        if profiler:
+            profiler.step(i)
+
+        # Nothing but gravity acting on us, skip ahead analytically.
+        if coast and rocket.mass_flow() == 0.0 and rocket.position.magnitude - body.radius > coast_altitude:
+            target = coast_target(body, rocket, duration - t)
+            if target is not None:
+                jump, name = target
+                rocket.position, rocket.velocity = orbit.propagate(rocket.position, rocket.velocity, constants.G * body.mass, jump, j2, body.radius)
+                t = t + jump
+                if name is not None:
+                    stats['events'].append([t, name])
+                if profiler:
+                    profiler.tick('coast')
+                telemetry.record(
+                    t,
+                    (rocket.position.magnitude - body.radius ) / 1000.0,
+                    0.0,
+                    rocket.velocity.magnitude,
+                    180.0 * rocket.position.phi / math.pi,
+                    0.0,
+                    rocket.mass())
+                if profiler:
+                    profiler.tick('telemetry')
+                i += 1
+                continue
         
         # gravity depends on altitude!
         A_gravity = body.accelleration(rocket.position)
+        if profiler:
+            profiler.tick('gravity')
 
-        # Valid up to 2500,000 meters
-        P0, density = body.air_pressure_and_density(rocket.position)
-
-        # AUTO PILOT
-        # really crude pitch control. Once above target_orbit. start pushing along the surface of the earth        
+        altitude = rocket.position.magnitude - body.radius
 
-        # First find orientation of the rocket. We assume this is always
-        # along the surface of the earth, which is the tangent of the 
-        # position vector.
-        orientation = Vector([-rocket.position[1], rocket.position[0],0])
+        # Valid up to 2500,000 meters
+        if rates is None or rates.due('atmosphere', t, altitude):
+            P0, density = body.air_pressure_and_density(rocket.position)
+            speed_of_sound = body.speed_of_sound(rocket.position)
+        if profiler:
+            profiler.tick('atmosphere')
+
+        # Guidance runs at its own rate, or right after an event, holding
+        # the orientation and throttle in between.
+        guidance_dt += dt_taken
+        if rates is None or rates.due('guidance', t, force=bool(fired)):
+            # AUTO PILOT
+            # really crude pitch control. Once above target_orbit. start pushing along the surface of the earth        
+
+            # First find orientation of the rocket. We assume this is always
+            # along the surface of the earth, which is the tangent of the 
+            # position vector.
+            if site is None:
+                orientation = Vec3([-rocket.position[1], rocket.position[0],0])
+            else:
+                orientation = site.normal.cross(rocket.position)
         
-        # In order to rotate the force vector 'upwards' a certain degree
-        # we need to find the rotation axis. This is the vector orthogonal
-        # to the position and the orientation.
-        rotation_axis = rocket.position.cross( orientation ).normalize()
-
-        # High tech auto pilot
-        # Straight up first, then abruptly point force vector along the
-        # surface of the earth at 200km up. Then when orbital velocity is
-        # acchieved power down.
-        delta = 1.0
-        if rocket.position.magnitude > body.radius + 1e3:
-            delta = 0.5
-        if rocket.position.magnitude > body.radius + 200e3:
-             delta = 0.1
-
-        # should really test for velocity parallel with Earth.
-        if rocket.velocity.magnitude > 8672.0:
-            rocket.throttle = 0.0
-
-        # Negative rotation means point the force vector out from earth
-        # along the surface.
-        orientation.rotate(  - delta * math.pi/2.0, rotation_axis )
-        rocket.set_orientation(orientation.normalize())
+            # In order to rotate the force vector 'upwards' a certain degree
+            # we need to find the rotation axis. This is the vector orthogonal
+            # to the position and the orientation.
+            rotation_axis = rocket.position.cross( orientation ).normalize()
+
+            # High tech auto pilot
+            # Straight up first, then abruptly point force vector along the
+            # surface of the earth at 200km up. Then when orbital velocity is
+            # acchieved power down.
+            if cutoff_events is None:
+                delta = pitch_program[0][1]
+                for pitch_altitude, pitch_delta in pitch_program:
+                    if altitude > pitch_altitude:
+                        delta = pitch_delta
+
+                # should really test for velocity parallel with Earth.
+                if rocket.velocity.magnitude > cutoff_velocity:
+                    rocket.throttle = 0.0
+            else:
+                delta = pitch_program.delta(altitude)
+                state = rocket.position[:] + rocket.velocity[:]
+                if any( event.value(t, state) >= 0.0 for event in cutoff_events ):
+                    rocket.throttle = 0.0
+
+            if autopilot is not None:
+                flight_path = autopilot.flight_path_array(body, np.array([rocket.position[:]]), np.array([rocket.velocity[:]]))
+                delta = float(np.ravel(autopilot.pitch(delta, flight_path, guidance_dt))[0])
+                if rocket.throttle > 0.0:
+                    rocket.throttle = float(np.ravel(autopilot.throttle(load, guidance_dt, rocket.throttle))[0])
+
+            # Negative rotation means point the force vector out from earth
+            # along the surface.
+            orientation.rotate(  - delta * math.pi/2.0, rotation_axis )
+            rocket.set_orientation(orientation.normalize())
+            guidance_dt = 0.0
+        if profiler:
+            profiler.tick('autopilot')
 
         # Force from rocket thurst depends on altitude    
         F_rocket = rocket.thrust(P0)
+        if profiler:
+            profiler.tick('thrust')
         
         # Force from drag due to atmosphere
-        F_drag = rocket.drag(density)
+        air_velocity = rocket.velocity - body.surface_speed(rocket.position) if rotating else rocket.velocity
+        F_drag = rocket.drag(density, speed_of_sound, air_velocity)
+        drag_coefficient = rocket.drag_coefficient(air_velocity.magnitude / speed_of_sound)
+        if profiler:
+            profiler.tick('drag')
 
         # Force from Gravity
         F_gravity = A_gravity * rocket.mass()
@@ -116,79 +374,137 @@ def run_simulation(body, rocket, target_orbit):
 
         # if the drag magnitude becomes too big, the airframe will break.    
         maxForce = sum( force_mag_list )
+        stats['max_force'] = max(stats['max_force'], maxForce)
+        load = maxForce / rocket.max_forces
+
+        # dynamic pressure
+        q = 0.5 * density * air_velocity.dot(air_velocity)
+        if q > stats['max_q']:
+            stats['max_q'] = q
+            stats['max_q_time'] = t
+
         if ( maxForce > rocket.max_forces ):
+            stats['status'] = 'rud'
             print("R.U.D. Rapid Unscheduled Dissambly, too much forces, your rocket broke up in mid flight, iteration {}".format(i))
             print("velocity={} altitude={}, max_force={}, force_list={} delta={}".format(rocket.velocity, rocket.position.magnitude, maxForce, force_mag_list, delta))
             break
+        if profiler:
+            profiler.tick('loads')
+
+        # Staging, engine cut off and pitch changes are events, the
+        # detector ends the step on them.
+        dt = min(dt, duration - t)
+        if F_rocket_mag > 0.0:
+            dt = min(dt, max_powered_step)
+        if physics_step is not None:
+            dt = min(dt, physics_step)
 
-        # Sum Forces: Weight, Rocket Thrust and Drag in 3 dimensions.
-        Fs = F_rocket + F_drag + F_gravity
-        dv = Fs * (dt / rocket.mass())
-        
         # Time step!
-        rocket.velocity += dv
-        rocket.position += rocket.velocity * dt
+        state = np.array(rocket.position[:] + rocket.velocity[:])
+        if hold_air:
+            derivative = equations_of_motion(body, rocket, t, [P0, density], F_rocket, drag_coefficient, rotating)
+        else:
+            derivative = equations_of_motion(body, rocket, t, drag_coefficient=drag_coefficient, rotating=rotating)
+        t_start = t
+        state, dt_taken, dt, fired = detector.step(integrator, derivative, t, state, dt)
+        rocket.position = Vec3(state[:3])
+        rocket.velocity = Vec3(state[3:])
+        t = t + dt_taken
+        for event in fired:
+            stats['events'].append([t, event.name])
 
         # did we make it back to terra firma?
         # hope we are going slow.
-        if rocket.position.magnitude < body.radius - 1:
-            print("Current Forces = {}".format(force_mag_list))
-            if rocket.velocity.magnitude > 5:
-                print("R.U.D. Rapid Unscheduled Dissambly, welcome home!")
-            else:
-                print("Level: Musk, Mars is next")
+        if any( event.terminal for event in fired ):
+            if any( isinstance(event, Impact) for event in fired ):
+                print("Current Forces = {}".format(force_mag_list))
+                if rocket.velocity.magnitude > 5:
+                    print("R.U.D. Rapid Unscheduled Dissambly, welcome home!")
+                    stats['status'] = 'crashed'
+                else:
+                    print("Level: Musk, Mars is next")
+                    stats['status'] = 'landed'
             break
+        if profiler:
+            profiler.tick('integration')
 
         # debug print
         if i%5000==0:
             print("velocity={} pos={}, drag={} delta={}".format(rocket.velocity, rocket.position.magnitude, F_drag, delta))
 
         # step the rocket time ahead, this burns the fuel and potentially does stage sep.
-        rocket.time_step(dt, t)
+        rocket.time_step(dt_taken, t_start)
+        if profiler:
+            profiler.tick('staging')
         
-        # keep a list of maxForce and position so we can plot.
-        time_list.append(t)    
-        drag_list.append( ( F_drag_mag  ) / 1000.0 )
-        thrust_list.append( (F_rocket_mag ) / 1000.0 )
-        altitude_list.append((rocket.position.magnitude - body.radius ) / 1000.0)
-        phi_list.append( 180.0 * rocket.position.phi / math.pi )
-        velocity_list.append( rocket.velocity.magnitude )
-        mass_list.append(rocket.mass())
-        # next time step!
-        t = t + dt
-
+        # keep track of forces and position so we can plot.
+        if rates is None or rates.due('telemetry', t, force=bool(fired)):
+            telemetry.record(
+                t,
+                (rocket.position.magnitude - body.radius ) / 1000.0,
+                F_drag_mag / 1000.0,
+                rocket.velocity.magnitude,
+                180.0 * rocket.position.phi / math.pi,
+                F_rocket_mag / 1000.0,
+                rocket.mass())
+        if profiler:
+            profiler.tick('telemetry')
+        i += 1
+
+        if checkpoints is not None and checkpoints.due(t, fired):
+            flight = {
+                'fired': [ event.name for event in fired ],
+                'guidance_dt': guidance_dt,
+                'delta': delta,
+                'air': [P0, density, speed_of_sound],
+                'rates': None if rates is None else rates.snapshot(),
+            }
+            checkpoints.add(Snapshot.take(rocket, autopilot, stats, t, dt, dt_taken, load, i, flight))
+
+    if profiler:
+        profiler.stop(t)
+    stats['t_end'] = t
+    if target_orbit is not None:
+        o = orbit.elements(rocket.position, rocket.velocity, constants.G * body.mass)
+        stats['target_reached'] = o.e < 1.0 and o.periapsis - body.radius >= target_orbit
     print("Simulation ran for {} seconds".format(time.time()-start))
 
-    return time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list
-
+    telemetry.flush()
+    return telemetry.columns()
 
 
-recalculate = True
-earth = Earth()
-
-if recalculate:
-    
-    # 8000kg to LEO please.
-    rocket = AtlasV401(8.0e3, Vector([0.0, earth.radius, 0.0]) )
-    rocket.velocity = earth.surface_speed(rocket.position)
-
-    time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list = run_simulation(earth, rocket, 150e3)
-    np.savetxt('launch.txt', np.c_[time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list], header='time, alt, drag, velocity, phi, thrust, mass_list', delimiter=',')
-    altitude_list = np.array(altitude_list)
-    phi_list = np.array(phi_list)
-else:
-    C = np.loadtxt('launch.txt', delimiter=',')
-    time_list = C[:,0]
-    altitude_list = C[:,1]
-    drag_list = C[:,2]
-    velocity_list = C[:,3]    
-    phi_list = C[:,4]
-    thrust_list = C[:,5]
-    mass_list = C[:,6]
 
+if __name__ == '__main__':
 
-plots.status_plot(time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list)
-plots.plot_trajectory(earth, altitude_list * 1000 + earth.radius, phi_list)
-
+    import os
+    import plots
+    from trajectory import TrajectoryWriter, Trajectory, convert_csv
 
+    recalculate = True
+    earth = Earth()
 
+    if recalculate:
+    
+        # 8000kg to LEO please.
+        rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]) )
+        rocket.velocity = earth.surface_speed(rocket.position)
+
+        telemetry = TrajectoryWriter('launch.traj', metadata = { 'rocket': 'AtlasV401', 'payload_mass': 8.0e3, 'body': earth.name })
+        run_simulation(earth, rocket, 150e3, telemetry = telemetry)
+        telemetry.close()
+    elif not os.path.exists('launch.traj'):
+        # launch.txt from before the binary format.
+        convert_csv('launch.txt', 'launch.traj')
+
+    launch = Trajectory('launch.traj')
+    time_list = launch['time']
+    altitude_list = launch['altitude']
+    drag_list = launch['drag']
+    velocity_list = launch['velocity']
+    phi_list = launch['phi']
+    thrust_list = launch['thrust']
+    mass_list = launch['mass']
+
+
+    plots.status_plot(time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list)
+    plots.plot_trajectory(earth, altitude_list * 1000 + earth.radius, phi_list)
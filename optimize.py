@@ -0,0 +1,270 @@
+# Pitch program optimizer
+#
+# Searches the pitch program (see pitch.py) and payload mass that put the
+# most payload into a target orbit with an AtlasV401. The engines cut off
+# once the apoapsis reaches the target, the periapsis then shows how well
+# the program flattened out in time.
+#
+# Differential evolution, DE/current-to-best/1/bin. A whole generation
+# flies at once as one BatchSimulation, optionally split over worker
+# processes, so a generation costs about as much as a single launch.
+#
+# Runs that miss the orbit, break up or come down are penalized by
+# penalty kg of payload per meter they are off, so the search is pulled
+# towards the orbit from both sides.
+#
+# https://en.wikipedia.org/wiki/Differential_evolution
+#
+# python optimize.py --apoapsis 300e3 --periapsis 200e3 --population 48 --generations 30
+import argparse
+import contextlib
+import io
+import math
+import time
+import unittest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import constants
+from atlas import AtlasV401
+from batch import BatchSimulation, RUNNING, ORBIT
+from pitch import PitchProgram
+from vect import Vec3
+
+# Optimized parameters and their search ranges.
+PARAMETERS = ['payload_mass', 'kick_altitude', 'kick_delta', 'turn_altitude', 'turn_delta', 'shape']
+BOUNDS = {
+    'payload_mass': [1e3, 15e3],
+    'kick_altitude': [200.0, 20e3],
+    'kick_delta': [0.5, 1.0],
+    'turn_altitude': [50e3, 400e3],
+    'turn_delta': [-0.3, 0.5],
+    'shape': [0.2, 5.0],
+}
+
+# Longest powered flight of an AtlasV401 is 1095 seconds.
+max_powered_time = 1200.0
+
+
+"""
+PitchProgram for parameter vector x, cutting off at apoapsis meters.
+"""
+def program(x, apoapsis):
+    p = dict(zip(PARAMETERS, x))
+    return PitchProgram(p['kick_altitude'], p['kick_delta'], p['turn_altitude'], p['turn_delta'], p['shape'], cutoff_apoapsis=apoapsis)
+
+
+"""
+Fly every parameter vector of population (rows of PARAMETERS) in one
+BatchSimulation until all engines are off. Returns a dictionary of
+arrays: status (batch status codes), apoapsis and periapsis altitudes.
+"""
+def evaluate(body, population, apoapsis, dt = 0.1):
+
+    rockets = []
+    for x in population:
+        rocket = AtlasV401(x[0], Vec3([0.0, body.radius, 0.0]))
+        rocket.velocity = body.surface_speed(rocket.position)
+        rocket.throttle = 1.0
+        rockets.append(rocket)
+
+    sim = BatchSimulation(body, rockets, dt=dt, pitch_programs=[ program(x, apoapsis) for x in population ])
+    while sim.t < max_powered_time and np.any(sim.powered):
+        sim.step()
+
+    return {
+        'status': sim.status.copy(),
+        'apoapsis': sim.apoapsis(sim.position, sim.velocity) - body.radius,
+        'periapsis': sim.periapsis(sim.position, sim.velocity) - body.radius,
+    }
+
+
+"""
+Payload mass minus penalty kg per meter the orbit is off by more than
+tolerance meters. Runs that did not survive count as missing by the
+whole target orbit.
+"""
+def fitness(results, payload_mass, apoapsis, periapsis, tolerance = 5e3, penalty = 1.0):
+
+    miss = np.maximum(0.0, periapsis - tolerance - results['periapsis'])
+    with np.errstate(invalid='ignore'):
+        miss += np.maximum(0.0, np.abs(results['apoapsis'] - apoapsis) - tolerance)
+    failed = ((results['status'] != RUNNING) & (results['status'] != ORBIT)) | ~np.isfinite(miss)
+    miss = np.where(failed, apoapsis + periapsis, miss)
+    return payload_mass - penalty * miss
+
+
+# Split population over the pool, one batch per worker.
+def _evaluate(pool, workers, body, population, apoapsis, dt):
+    if pool is None:
+        return evaluate(body, population, apoapsis, dt)
+
+    chunks = np.array_split(population, workers)
+    parts = list(pool.map(evaluate, [body] * workers, chunks, [apoapsis] * workers, [dt] * workers))
+    return { name: np.concatenate([ part[name] for part in parts ]) for name in parts[0] }
+
+
+"""
+Maximize payload into an orbit with the given apoapsis and periapsis
+altitudes in meters.
+
+population = candidates per generation, a multiple of the worker count
+  keeps the workers evenly busy.
+generations = generations to evolve.
+workers = worker processes, None to fly every generation in this process.
+dt = batch time step, larger is faster and coarser. 0.2 seconds still
+  agrees with run_simulation, at 0.5 the optimizer finds programs that
+  only work with that coarse a step.
+mutation, crossover = differential evolution weight F and crossover rate CR.
+callback = called with (generation, result) after every generation.
+
+Returns a dictionary with the best parameters, its PitchProgram,
+payload_mass, fitness, apoapsis and periapsis, plus the number of
+generations and evaluations.
+"""
+def optimize(body, apoapsis, periapsis, population = 32, generations = 40, seed = None, workers = None, dt = 0.1,
+             tolerance = 5e3, penalty = 1.0, mutation = 0.6, crossover = 0.9, callback = None):
+
+    if periapsis > apoapsis:
+        raise ValueError("optimize.py | periapsis has to be below apoapsis.")
+    if population < 4:
+        raise ValueError("optimize.py | population needs at least 4 members.")
+
+    rng = np.random.default_rng(seed)
+    low = np.array([ BOUNDS[name][0] for name in PARAMETERS ])
+    high = np.array([ BOUNDS[name][1] for name in PARAMETERS ])
+    n, d = population, len(PARAMETERS)
+
+    pool = ProcessPoolExecutor(workers) if workers is not None and workers > 1 else None
+    try:
+        def score(candidates):
+            results = _evaluate(pool, workers, body, candidates, apoapsis, dt)
+            return fitness(results, candidates[:, 0], apoapsis, periapsis, tolerance, penalty), results
+
+        pop = low + rng.random((n, d)) * (high - low)
+        fit, results = score(pop)
+
+        for generation in range(generations):
+            # Two distinct others for every member.
+            keys = rng.random((n, n))
+            keys[np.arange(n), np.arange(n)] = math.inf
+            a, b = np.argsort(keys, axis=1)[:, :2].T
+            best = pop[np.argmax(fit)]
+            mutant = pop + mutation * (best - pop) + mutation * (pop[a] - pop[b])
+            # Fold what leaves the bounds back in.
+            mutant = np.where(mutant < low, low + (low - mutant) % (high - low), mutant)
+            mutant = np.where(mutant > high, high - (mutant - high) % (high - low), mutant)
+
+            cross = rng.random((n, d)) < crossover
+            cross[np.arange(n), rng.integers(0, d, n)] = True
+            trial = np.where(cross, mutant, pop)
+
+            trial_fit, trial_results = score(trial)
+            better = trial_fit >= fit
+            pop[better] = trial[better]
+            fit[better] = trial_fit[better]
+            for name in results:
+                results[name][better] = trial_results[name][better]
+
+            if callback is not None:
+                callback(generation, _result(pop, fit, results, apoapsis, generation + 1, (generation + 2) * n))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return _result(pop, fit, results, apoapsis, generations, (generations + 1) * n)
+
+
+def _result(pop, fit, results, apoapsis, generations, evaluations):
+    best = int(np.argmax(fit))
+    return {
+        'parameters': dict(zip(PARAMETERS, pop[best].tolist())),
+        'program': program(pop[best], apoapsis),
+        'payload_mass': float(pop[best][0]),
+        'fitness': float(fit[best]),
+        'apoapsis': float(results['apoapsis'][best]),
+        'periapsis': float(results['periapsis'][best]),
+        'generations': generations,
+        'evaluations': evaluations,
+    }
+
+
+"""
+Fly a result of optimize with run_simulation and the adaptive integrator,
+returns [stats, orbit.Elements] of the final orbit.
+"""
+def verify(body, result):
+    from main import run_simulation
+    from integrator import RK45
+    import orbit
+
+    rocket = AtlasV401(result['payload_mass'], Vec3([0.0, body.radius, 0.0]))
+    rocket.velocity = body.surface_speed(rocket.position)
+    stats = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_simulation(body, rocket, None, RK45(), max_powered_time, result['program'], stats)
+    return stats, orbit.elements(rocket.position, rocket.velocity, constants.G * body.mass)
+
+
+
+class OptimizeUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        from body import Earth
+        self.earth = Earth()
+
+    def test_fitness(self):
+        results = {
+            'status': np.array([RUNNING, RUNNING, RUNNING, 1]),
+            'apoapsis': np.array([300e3, 300e3, math.inf, 300e3]),
+            'periapsis': np.array([200e3, 150e3, 200e3, 200e3]),
+        }
+        f = fitness(results, np.full(4, 5e3), 300e3, 200e3, tolerance=5e3, penalty=0.1)
+        self.assertEqual( f[0], 5e3 )
+        self.assertEqual( f[1], 5e3 - 0.1 * 45e3 )
+        self.assertEqual( f[2], 5e3 - 0.1 * 500e3 )
+        self.assertEqual( f[3], 5e3 - 0.1 * 500e3 )
+
+    def test_evaluate(self):
+        # The default program with its cutoff moved to the apoapsis.
+        x = [8e3, 1e3, 0.5, 200e3, 0.1, 0.0]
+        results = evaluate(self.earth, np.array([x, x]), 150e3, dt=0.5)
+        self.assertTrue( np.array_equal(results['apoapsis'], results['apoapsis'][::-1]) )
+        self.assertAlmostEqual( results['apoapsis'][0] / 150e3, 1.0, places=1 )
+
+    def test_optimize_improves(self):
+        seen = []
+        result = optimize(self.earth, 300e3, 100e3, population=8, generations=2, seed=1, dt=1.0,
+                          callback=lambda generation, best: seen.append(best['fitness']))
+        self.assertEqual( result['evaluations'], 24 )
+        self.assertEqual( len(seen), 2 )
+        self.assertLessEqual( seen[0], seen[1] )
+        self.assertEqual( result['program'].cutoff_apoapsis, 300e3 )
+
+
+if __name__ == '__main__':
+
+    from body import Earth
+
+    parser = argparse.ArgumentParser(description="Optimize the AtlasV401 pitch program for maximum payload.")
+    parser.add_argument('--apoapsis', type=float, default=300e3, help="target apoapsis altitude in meters")
+    parser.add_argument('--periapsis', type=float, default=200e3, help="target periapsis altitude in meters")
+    parser.add_argument('--population', type=int, default=48)
+    parser.add_argument('--generations', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dt', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    earth = Earth()
+    start = time.time()
+
+    def report(generation, best):
+        print("generation {:3d} {:6.0f} s payload {:8.1f} kg fitness {:8.1f} apoapsis {:6.1f} km periapsis {:6.1f} km".format(
+            generation, time.time() - start, best['payload_mass'], best['fitness'], best['apoapsis'] / 1e3, best['periapsis'] / 1e3))
+
+    result = optimize(earth, args.apoapsis, args.periapsis, args.population, args.generations, args.seed, args.workers, args.dt, callback=report)
+    print(result['program'])
+    stats, o = verify(earth, result)
+    print("run_simulation: {}, apoapsis {:.1f} km periapsis {:.1f} km".format(
+        stats['status'], (o.apoapsis - earth.radius) / 1e3, (o.periapsis - earth.radius) / 1e3))
@@ -0,0 +1,320 @@
+# Orbit calculations
+#
+# https://en.wikipedia.org/wiki/Orbital_elements
+# https://en.wikipedia.org/wiki/Orbital_state_vectors
+# https://en.wikipedia.org/wiki/Kepler%27s_equation
+import math
+import unittest
+from collections import namedtuple
+import constants
+from vect import Vec3
+
+# Classical orbital elements, angles in radians, distances in meters
+# measured from the center of the body.
+# a = semi major axis (negative for hyperbolic orbits)
+# e = eccentricity
+# i = inclination
+# raan = right ascension of the ascending node
+# argp = argument of periapsis
+# nu = true anomaly
+Elements = namedtuple('Elements', ['a', 'e', 'i', 'raan', 'argp', 'nu', 'periapsis', 'apoapsis'])
+
+# Angle from a to b in [0, 2 pi), counter clockwise seen from the tip of
+# the normal h. atan2 of sine and cosine, acos loses sqrt(eps) of accuracy
+# at 0 and pi, right where the apsides are.
+def _angle(a, b, h):
+    return math.atan2(h.dot(a.cross(b)) / h.magnitude, a.dot(b)) % (2.0 * math.pi)
+
+# Converts a state vector into classical orbital elements.
+# mu = gravitational parameter of the body, G * mass.
+def elements(position, velocity, mu):
+
+    r = Vec3(position)
+    v = Vec3(velocity)
+    radius = r.magnitude
+    speed2 = v.dot(v)
+
+    h = r.cross(v)
+    node = Vec3([-h[1], h[0], 0.0])
+    e_vector = (r * (speed2 - mu / radius) - v * r.dot(v)) * (1.0 / mu)
+    e = e_vector.magnitude
+
+    energy = speed2 / 2.0 - mu / radius
+    a = math.inf if energy == 0.0 else -mu / (2.0 * energy)
+
+    i = math.acos(max(-1.0, min(1.0, h[2] / h.magnitude)))
+
+    # Equatorial and circular orbits leave node and periapsis undefined,
+    # fall back to the x axis as reference.
+    if node.magnitude > 0.0:
+        raan = math.atan2(node[1], node[0]) % (2.0 * math.pi)
+    else:
+        raan = 0.0
+        node = Vec3([1.0, 0.0, 0.0])
+
+    if e > 1e-12:
+        argp = _angle(node, e_vector, h)
+        nu = _angle(e_vector, r, h)
+    else:
+        argp = 0.0
+        nu = _angle(node, r, h)
+
+    p = h.dot(h) / mu
+    periapsis = p / (1.0 + e)
+    apoapsis = p / (1.0 - e) if e < 1.0 else math.inf
+
+    return Elements(a, e, i, raan, argp, nu, periapsis, apoapsis)
+
+
+# Converts classical orbital elements back into a state vector, returns
+# [position, velocity]. Uses the same reference directions as elements
+# for equatorial and circular orbits, so the two round trip.
+def state_vector(o, mu):
+
+    p = o.a * (1.0 - o.e * o.e)
+    cos_nu = math.cos(o.nu)
+    sin_nu = math.sin(o.nu)
+    radius = p / (1.0 + o.e * cos_nu)
+
+    # Position and velocity in the orbital plane, x towards periapsis.
+    px = radius * cos_nu
+    py = radius * sin_nu
+    f = math.sqrt(mu / p)
+    vx = -f * sin_nu
+    vy = f * (o.e + cos_nu)
+
+    # Rotate by argp around z, i around x and raan around z.
+    cw, sw = math.cos(o.argp), math.sin(o.argp)
+    ci, si = math.cos(o.i), math.sin(o.i)
+    cr, sr = math.cos(o.raan), math.sin(o.raan)
+    P = [cr * cw - sr * sw * ci, sr * cw + cr * sw * ci, sw * si]
+    Q = [-cr * sw - sr * cw * ci, -sr * sw + cr * cw * ci, cw * si]
+
+    position = Vec3([ P[k] * px + Q[k] * py for k in range(3) ])
+    velocity = Vec3([ P[k] * vx + Q[k] * vy for k in range(3) ])
+    return position, velocity
+
+
+# Radians per second the mean anomaly advances.
+def mean_motion(a, mu):
+    return math.sqrt(mu / abs(a) ** 3)
+
+# Mean anomaly for true anomaly nu, hyperbolic mean anomaly when e > 1.
+def mean_anomaly(e, nu):
+    if e < 1.0:
+        E = 2.0 * math.atan2(math.sqrt(1.0 - e) * math.sin(nu / 2.0), math.sqrt(1.0 + e) * math.cos(nu / 2.0))
+        return (E - e * math.sin(E)) % (2.0 * math.pi)
+    F = 2.0 * math.atanh(math.sqrt((e - 1.0) / (e + 1.0)) * math.tan(nu / 2.0))
+    return e * math.sinh(F) - F
+
+# True anomaly for mean anomaly M, solves Kepler's equation with Newton.
+def true_anomaly(e, M):
+    if e < 1.0:
+        M = M % (2.0 * math.pi)
+        E = M if e < 0.8 else math.pi
+        for i in range(50):
+            step = (E - e * math.sin(E) - M) / (1.0 - e * math.cos(E))
+            E -= step
+            if abs(step) < 1e-14:
+                break
+        return 2.0 * math.atan2(math.sqrt(1.0 + e) * math.sin(E / 2.0), math.sqrt(1.0 - e) * math.cos(E / 2.0)) % (2.0 * math.pi)
+
+    F = math.asinh(M / e)
+    for i in range(50):
+        step = (e * math.sinh(F) - F - M) / (e * math.cosh(F) - 1.0)
+        F -= step
+        if abs(step) < 1e-14:
+            break
+    return 2.0 * math.atan(math.sqrt((e + 1.0) / (e - 1.0)) * math.tanh(F / 2.0))
+
+# Seconds until the orbit reaches true anomaly nu. For closed orbits this
+# is the next time, between 0 and one period, for open orbits it is
+# negative when nu has been passed already.
+def time_to_anomaly(o, nu, mu):
+    dM = mean_anomaly(o.e, nu) - mean_anomaly(o.e, o.nu)
+    if o.e < 1.0:
+        dM = dM % (2.0 * math.pi)
+    return dM / mean_motion(o.a, mu)
+
+# True anomaly between 0 and pi where the orbit passes radius, the
+# orbit passes it on the way down at 2 pi minus that. None when the orbit
+# never gets there.
+def anomaly_at_radius(o, radius):
+    if radius < o.periapsis or radius > o.apoapsis:
+        return None
+    if o.e == 0.0:
+        return 0.0
+    p = o.a * (1.0 - o.e * o.e)
+    return math.acos(max(-1.0, min(1.0, (p / radius - 1.0) / o.e)))
+
+# Analytic two body propagation, returns [position, velocity] dt seconds
+# later. Parabolic orbits are not supported.
+# j2, radius = optional J2 and reference radius of the body, closed orbits
+#   then drift with the secular J2 rates: the node regresses, periapsis
+#   and mean anomaly advance. The short periodic terms are left out.
+def propagate(position, velocity, mu, dt, j2 = 0.0, radius = 0.0):
+    o = elements(position, velocity, mu)
+    n = mean_motion(o.a, mu)
+    if j2 == 0.0 or o.e >= 1.0:
+        M = mean_anomaly(o.e, o.nu) + n * dt
+        return state_vector(o._replace(nu = true_anomaly(o.e, M)), mu)
+
+    p = o.a * (1.0 - o.e * o.e)
+    k = 0.75 * n * j2 * (radius / p) ** 2
+    c = math.cos(o.i)
+    raan = o.raan - 2.0 * k * c * dt
+    argp = o.argp + k * (5.0 * c * c - 1.0) * dt
+    M = mean_anomaly(o.e, o.nu) + (n + k * math.sqrt(1.0 - o.e * o.e) * (3.0 * c * c - 1.0)) * dt
+    return state_vector(o._replace(raan = raan, argp = argp, nu = true_anomaly(o.e, M)), mu)
+
+
+
+class OrbitUnitTest(unittest.TestCase):
+
+    mu = constants.G * constants.earth_mass
+
+    def test_circular(self):
+        r = constants.earth_radius + 400e3
+        v = math.sqrt(self.mu / r)
+        o = elements([r, 0.0, 0.0], [0.0, v, 0.0], self.mu)
+        self.assertAlmostEqual( o.e, 0.0, places=9 )
+        self.assertAlmostEqual( o.a / r, 1.0, places=9 )
+        self.assertAlmostEqual( o.periapsis / r, 1.0, places=9 )
+        self.assertAlmostEqual( o.apoapsis / r, 1.0, places=9 )
+        self.assertAlmostEqual( o.i, 0.0 )
+
+    def test_elliptic(self):
+        # At periapsis of an orbit with e = 0.1, inclined 30 degrees.
+        rp = constants.earth_radius + 300e3
+        e = 0.1
+        a = rp / (1.0 - e)
+        v = math.sqrt(self.mu * (2.0 / rp - 1.0 / a))
+        inc = math.radians(30.0)
+        o = elements([rp, 0.0, 0.0], [0.0, v * math.cos(inc), v * math.sin(inc)], self.mu)
+        self.assertAlmostEqual( o.e, e, places=9 )
+        self.assertAlmostEqual( o.a / a, 1.0, places=9 )
+        self.assertAlmostEqual( o.i, inc, places=9 )
+        self.assertAlmostEqual( o.apoapsis / (a * (1.0 + e)), 1.0, places=9 )
+        self.assertAlmostEqual( o.nu, 0.0, places=6 )
+
+    def test_hyperbolic(self):
+        r = constants.earth_radius
+        v = 1.5 * math.sqrt(2.0 * self.mu / r)
+        o = elements([r, 0.0, 0.0], [0.0, v, 0.0], self.mu)
+        self.assertTrue( o.e > 1.0 )
+        self.assertTrue( o.a < 0.0 )
+        self.assertEqual( o.apoapsis, math.inf )
+
+    def test_coast_apsides(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from integrator import RK45
+
+        earth = Earth()
+        rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+        rocket.velocity = earth.surface_speed(rocket.position)
+        stats = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_simulation(earth, rocket, 150e3, RK45(), 20000.0, stats=stats, coast=True)
+        apsides = [ event for event in stats['events'] if event[1] in ('apogee', 'periapsis') ]
+        # Every jump lands on the next apsis, never on the same one twice.
+        self.assertGreaterEqual( len(apsides), 4 )
+        for (t0, name0), (t1, name1) in zip(apsides, apsides[1:]):
+            self.assertNotEqual( name0, name1 )
+            self.assertGreater( t1 - t0, 60.0 )
+
+    def test_round_trip(self):
+        rp = constants.earth_radius + 300e3
+        a = rp / 0.9
+        v = math.sqrt(self.mu * (2.0 / rp - 1.0 / a))
+        inc = math.radians(51.6)
+        for position, velocity in [
+                ([rp, 0.0, 0.0], [0.0, v * math.cos(inc), v * math.sin(inc)]),
+                ([0.0, 0.0, rp], [1000.0, v, 0.0]),
+                ([rp, 0.0, 0.0], [0.0, math.sqrt(self.mu / rp), 0.0]),
+                ([rp, 0.0, 0.0], [-2000.0, 1.5 * math.sqrt(2.0 * self.mu / rp), 0.0])]:
+            r, v2 = state_vector(elements(position, velocity, self.mu), self.mu)
+            self.assertLess( (r - Vec3(position)).magnitude, 1e-3 )
+            self.assertLess( (v2 - Vec3(velocity)).magnitude, 1e-6 )
+
+    def test_propagate(self):
+        from integrator import RK45
+        import numpy as np
+        rp = constants.earth_radius + 300e3
+        a = rp / 0.9
+        v = math.sqrt(self.mu * (2.0 / rp - 1.0 / a))
+        inc = math.radians(30.0)
+        position, velocity = [rp, 0.0, 0.0], [0.0, v * math.cos(inc), v * math.sin(inc)]
+
+        def derivative(t, state):
+            d = np.empty(6)
+            d[:3] = state[3:]
+            d[3:] = -self.mu * state[:3] / np.linalg.norm(state[:3]) ** 3
+            return d
+
+        integrator = RK45(rtol=1e-12, atol=1e-6)
+        state = np.array(position + velocity)
+        t = 0.0
+        dt = 10.0
+        while t < 3000.0:
+            state, taken, dt = integrator.step(derivative, t, state, min(dt, 3000.0 - t))
+            t += taken
+
+        r, v2 = propagate(position, velocity, self.mu, 3000.0)
+        self.assertLess( (r - Vec3(state[:3])).magnitude, 1.0 )
+
+        # A whole period later we are back where we started.
+        period = 2.0 * math.pi / mean_motion(a, self.mu)
+        r, v2 = propagate(position, velocity, self.mu, period)
+        self.assertLess( (r - Vec3(position)).magnitude, 1e-3 )
+
+        # and halfway round at apoapsis.
+        o = elements(position, velocity, self.mu)
+        self.assertAlmostEqual( time_to_anomaly(o, math.pi, self.mu), period / 2.0, places=6 )
+        self.assertAlmostEqual( anomaly_at_radius(o, a * (1.0 - 0.01)), math.pi / 2.0 )
+        self.assertIsNone( anomaly_at_radius(o, rp - 1.0) )
+
+    def test_propagate_j2(self):
+        from integrator import RK45
+        from body import Earth
+        import numpy as np
+        earth = Earth(harmonics=True)
+        r = earth.radius + 400e3
+        v = math.sqrt(self.mu / r)
+        inc = math.radians(51.6)
+        position, velocity = [r, 0.0, 0.0], [0.0, v * math.cos(inc), v * math.sin(inc)]
+
+        def derivative(t, state):
+            d = np.empty(6)
+            d[:3] = state[3:]
+            d[3:] = earth.accelleration_array(state[None, :3])[0]
+            return d
+
+        # Ten orbits, the node regresses some 3 degrees.
+        duration = 10.0 * 2.0 * math.pi / mean_motion(r, self.mu)
+        integrator = RK45(rtol=1e-10, atol=1e-6)
+        state = np.array(position + velocity)
+        t = 0.0
+        dt = 10.0
+        while t < duration:
+            state, taken, dt = integrator.step(derivative, t, state, min(dt, duration - t))
+            t += taken
+
+        o = elements(state[:3], state[3:], self.mu)
+        p, v2 = propagate(position, velocity, self.mu, duration, constants.earth_j2, earth.radius)
+        drifted = elements(p, v2, self.mu)
+        kepler = elements(*propagate(position, velocity, self.mu, duration), self.mu)
+        self.assertAlmostEqual( kepler.raan, 0.0, places=9 )
+        self.assertLess( math.degrees(o.raan - 2.0 * math.pi), -2.5 )
+        self.assertLess( abs(drifted.raan - o.raan), 0.02 * abs(o.raan - 2.0 * math.pi) )
+        # Along the orbit the osculating semi major axis of the start is
+        # off its mean, still closer than Kepler.
+        latitude = lambda e: (e.argp + e.nu) % (2.0 * math.pi)
+        self.assertLess( abs(latitude(drifted) - latitude(o)), abs(latitude(kepler) - latitude(o)) )
+
+
+if __name__ == '__main__':
+    unittest.main()
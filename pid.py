@@ -28,7 +28,8 @@
 """Ivmech PID Controller is simple implementation of a Proportional-Integral-Derivative (PID) Controller in the Python Programming Language.
 More information about PID Controller: http://en.wikipedia.org/wiki/PID_controller
 """
-import time
+import unittest
+import numpy as np
 
 class PID:
     """PID Controller
@@ -118,3 +119,131 @@ class PID:
         Based on a pre-determined sampe time, the PID decides if it should compute or return immediately.
         """
         self.sample_time = sample_time
+
+
+class PIDBank:
+    """Bank of PID controllers updated together
+
+    The control law of PID for n controllers at once. Gains, set points,
+    integrators, windup guards, sample times and last errors are arrays
+    with one entry per controller, so one update call serves a whole
+    batch of rockets, or several axes of one.
+
+    Unlike PID, the time of calls that come before a controller's sample
+    time is kept and counts towards its next update.
+    """
+
+    def __init__(self, n, P=0.2, I=0.0, D=0.0, windup_guard=20.0, sample_time=0.0, output_limits=None):
+
+        def column(value):
+            return np.array(np.broadcast_to(np.asarray(value, dtype=float), (n,)))
+
+        self.Kp = column(P)
+        self.Ki = column(I)
+        self.Kd = column(D)
+        self.windup_guard = column(windup_guard)
+        self.sample_time = column(sample_time)
+        if output_limits is None:
+            output_limits = [-np.inf, np.inf]
+        self.output_low = column(output_limits[0])
+        self.output_high = column(output_limits[1])
+
+        self.SetPoint = np.zeros(n)
+        self.ITerm = np.zeros(n)
+        self.last_error = np.zeros(n)
+        self.elapsed = np.zeros(n)
+        self.output = np.zeros(n)
+
+    def __len__(self):
+        return len(self.output)
+
+    def clear(self, idx=None):
+        """Clears the computations of controllers idx, all when None"""
+        if idx is None:
+            idx = slice(None)
+        self.ITerm[idx] = 0.0
+        self.last_error[idx] = 0.0
+        self.elapsed[idx] = 0.0
+        self.output[idx] = 0.0
+
+    # Arrays that change while the controllers run.
+    STATE = ['SetPoint', 'ITerm', 'last_error', 'elapsed', 'output']
+
+    def snapshot(self):
+        """Copy of the running state of all controllers, a dictionary"""
+        return { name: getattr(self, name).copy() for name in self.STATE }
+
+    def restore(self, snapshot):
+        """Puts back the running state of a snapshot"""
+        for name in self.STATE:
+            getattr(self, name)[:] = snapshot[name]
+
+    def update(self, feedback_value, delta_time, setpoint=None, idx=None):
+        """Calculates the outputs of controllers idx, all when None, for
+        their feedback and the time since their last update call. Both
+        are scalars or arrays matching idx, as is the optional new
+        setpoint. Controllers that have not reached their sample time
+        keep their output. Returns the outputs of idx.
+        """
+        if idx is None:
+            idx = slice(None)
+        if setpoint is not None:
+            self.SetPoint[idx] = setpoint
+
+        elapsed = self.elapsed[idx] + delta_time
+        due = elapsed >= self.sample_time[idx]
+
+        error = self.SetPoint[idx] - feedback_value
+        guard = self.windup_guard[idx]
+        ITerm = np.clip(self.ITerm[idx] + error * elapsed, -guard, guard)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            DTerm = np.where(elapsed > 0.0, (error - self.last_error[idx]) / elapsed, 0.0)
+        output = self.Kp[idx] * error + self.Ki[idx] * ITerm + self.Kd[idx] * DTerm
+        output = np.clip(output, self.output_low[idx], self.output_high[idx])
+
+        self.ITerm[idx] = np.where(due, ITerm, self.ITerm[idx])
+        self.last_error[idx] = np.where(due, error, self.last_error[idx])
+        self.output[idx] = np.where(due, output, self.output[idx])
+        self.elapsed[idx] = np.where(due, 0.0, elapsed)
+        return self.output[idx]
+
+
+
+class PIDBankUnitTest(unittest.TestCase):
+
+    def test_matches_pid(self):
+        rng = np.random.default_rng(0)
+        gains = [[1.2, 1.0, 0.001], [0.5, 0.2, 0.1], [2.0, 0.0, 0.0]]
+        scalars = [ PID(*g) for g in gains ]
+        bank = PIDBank(3, *np.array(gains).T)
+        for pid in scalars:
+            pid.SetPoint = 1.0
+        bank.SetPoint[:] = 1.0
+        for i in range(200):
+            feedback = rng.uniform(-2.0, 2.0, 3)
+            dt = rng.uniform(0.01, 0.2)
+            bank.update(feedback, dt)
+            for k, pid in enumerate(scalars):
+                pid.update(feedback[k], dt)
+                self.assertAlmostEqual( bank.output[k], pid.output )
+
+    def test_sample_time_and_subsets(self):
+        bank = PIDBank(3, P=1.0, I=1.0, sample_time=[0.0, 0.25, 0.0], windup_guard=0.5, output_limits=[-1.0, 1.0])
+        out = bank.update(np.zeros(2), 0.1, setpoint=[1.0, 1.0], idx=np.array([0, 1]))
+        # The second controller waits for its sample time.
+        self.assertEqual( out.tolist(), [1.0, 0.0] )
+        self.assertEqual( bank.output[2], 0.0 )
+        bank.update(np.zeros(2), 0.2, idx=np.array([0, 1]))
+        # ... and then integrates all the time since.
+        self.assertAlmostEqual( bank.ITerm[1], 0.3 )
+        self.assertAlmostEqual( bank.ITerm[0], 0.3 )
+        bank.update(np.zeros(3), 1.0)
+        # Windup guard and output limits.
+        self.assertTrue( np.all(bank.ITerm[:2] == 0.5) )
+        self.assertTrue( np.all(bank.output[:2] == 1.0) )
+        bank.clear(1)
+        self.assertEqual( bank.ITerm[1], 0.0 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# Pitch programs
+#
+# The auto pilot points the thrust delta * 90 degrees up from the surface,
+# delta = 1 is straight up and 0 along the surface. A PitchProgram gives
+# delta as a function of altitude:
+#
+#   up to kick_altitude             1, straight up.
+#   kick_altitude to turn_altitude  from kick_delta down to turn_delta,
+#                                   turn_delta + (kick_delta - turn_delta) * (1 - x)^shape
+#                                   with x going from 0 to 1 over the turn.
+#   above turn_altitude             turn_delta.
+#
+# shape = 0 holds kick_delta for the whole turn, which with the defaults
+# is the [altitude, delta] program main.py always flew. shape = 1 turns
+# linearly with altitude, larger values turn faster early on.
+#
+# The engines cut off once the velocity passes cutoff_velocity or, when
+# set, the apoapsis reaches cutoff_apoapsis meters above the surface.
+import math
+import unittest
+import numpy as np
+from events import Altitude, TargetApoapsis, TargetVelocity
+
+
+class PitchProgram:
+
+    def __init__(self, kick_altitude = 1e3, kick_delta = 0.5, turn_altitude = 200e3, turn_delta = 0.1, shape = 0.0,
+                 cutoff_velocity = 8672.0, cutoff_apoapsis = None):
+        if turn_altitude < kick_altitude:
+            raise ValueError("pitch.py | turn_altitude has to be at least kick_altitude.")
+        self.kick_altitude = kick_altitude
+        self.kick_delta = kick_delta
+        self.turn_altitude = turn_altitude
+        self.turn_delta = turn_delta
+        self.shape = shape
+        self.cutoff_velocity = cutoff_velocity
+        self.cutoff_apoapsis = cutoff_apoapsis
+
+    def __repr__(self):
+        return "PitchProgram(kick_altitude={}, kick_delta={}, turn_altitude={}, turn_delta={}, shape={}, cutoff_velocity={}, cutoff_apoapsis={})".format(
+            self.kick_altitude, self.kick_delta, self.turn_altitude, self.turn_delta, self.shape, self.cutoff_velocity, self.cutoff_apoapsis)
+
+    """
+    delta at altitude meters above the surface.
+    """
+    def delta(self, altitude):
+        if altitude <= self.kick_altitude:
+            return 1.0
+        if altitude > self.turn_altitude:
+            return self.turn_delta
+        span = self.turn_altitude - self.kick_altitude
+        x = (altitude - self.kick_altitude) / span if span > 0.0 else 1.0
+        return self.turn_delta + (self.kick_delta - self.turn_delta) * (1.0 - x) ** self.shape
+
+    """
+    Events for the detector: the kick and the end of the turn, where delta
+    jumps or bends, and the cut off.
+    """
+    def events(self, body):
+        return [
+            Altitude(body, self.kick_altitude, 'pitch', 1),
+            Altitude(body, self.turn_altitude, 'pitch', 1),
+        ] + self.cutoff_events(body)
+
+    """
+    Events that cut off the engines once their value reaches zero.
+    """
+    def cutoff_events(self, body):
+        events = [ TargetVelocity(self.cutoff_velocity) ]
+        if self.cutoff_apoapsis is not None:
+            events.append(TargetApoapsis(body, self.cutoff_apoapsis))
+        return events
+
+    """
+    Parameters of programs as arrays, one entry per program, for
+    delta_array. A cutoff_apoapsis of None becomes inf.
+    """
+    @staticmethod
+    def stack(programs):
+        return {
+            'kick_altitude': np.array([ p.kick_altitude for p in programs ], dtype=float),
+            'kick_delta': np.array([ p.kick_delta for p in programs ], dtype=float),
+            'turn_altitude': np.array([ p.turn_altitude for p in programs ], dtype=float),
+            'turn_delta': np.array([ p.turn_delta for p in programs ], dtype=float),
+            'shape': np.array([ p.shape for p in programs ], dtype=float),
+            'cutoff_velocity': np.array([ p.cutoff_velocity for p in programs ], dtype=float),
+            'cutoff_apoapsis': np.array([ math.inf if p.cutoff_apoapsis is None else p.cutoff_apoapsis for p in programs ], dtype=float),
+        }
+
+    """
+    Vectorized delta, altitude and every entry of stacked are arrays of
+    the same length.
+    """
+    @staticmethod
+    def delta_array(altitude, stacked):
+        kick_altitude = stacked['kick_altitude']
+        span = stacked['turn_altitude'] - kick_altitude
+        x = np.clip((altitude - kick_altitude) / np.where(span > 0.0, span, 1.0), 0.0, 1.0)
+        turn_delta = stacked['turn_delta']
+        delta = turn_delta + (stacked['kick_delta'] - turn_delta) * (1.0 - x) ** stacked['shape']
+        return np.where(altitude <= kick_altitude, 1.0, np.where(altitude > stacked['turn_altitude'], turn_delta, delta))
+
+
+
+class PitchProgramUnitTest(unittest.TestCase):
+
+    def test_default_is_step_program(self):
+        program = PitchProgram()
+        for altitude, delta in [[0.0, 1.0], [1e3, 1.0], [1e3 + 1.0, 0.5], [200e3, 0.5], [200e3 + 1.0, 0.1]]:
+            self.assertEqual( program.delta(altitude), delta )
+
+    def test_turn(self):
+        program = PitchProgram(10e3, 0.9, 110e3, -0.1, 1.0)
+        self.assertAlmostEqual( program.delta(60e3), 0.4 )
+        self.assertEqual( program.delta(120e3), -0.1 )
+
+    def test_array_matches_scalar(self):
+        programs = [ PitchProgram(), PitchProgram(10e3, 0.9, 110e3, -0.1, 2.5), PitchProgram(5e3, 0.7, 5e3, 0.2, 1.0) ]
+        stacked = PitchProgram.stack(programs)
+        for altitude in np.linspace(0.0, 300e3, 61):
+            delta = PitchProgram.delta_array(np.full(3, altitude), stacked)
+            for i, program in enumerate(programs):
+                self.assertAlmostEqual( delta[i], program.delta(altitude) )
+
+    def test_target_orbit(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from vect import Vec3
+        from integrator import RK45
+
+        earth = Earth()
+        def fly(target_orbit, program):
+            rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+            rocket.velocity = earth.surface_speed(rocket.position)
+            stats = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_simulation(earth, rocket, target_orbit, RK45(), 800.0, program, stats)
+            return rocket, stats
+
+        # The target orbit is the cut off of a program without its own.
+        targeted, stats = fly(150e3, PitchProgram())
+        cutoff, cutoff_stats = fly(None, PitchProgram(cutoff_apoapsis=150e3))
+        self.assertEqual( targeted.position[:], cutoff.position[:] )
+        self.assertIn( 'target_reached', stats )
+        self.assertNotIn( 'target_reached', cutoff_stats )
+        # Cut off on the way up, the periapsis is nowhere near.
+        self.assertFalse( stats['target_reached'] )
+
+
+if __name__ == '__main__':
+    unittest.main()
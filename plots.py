@@ -1,24 +1,114 @@
 #
 # Handy plots
 #
+# Every plot downsamples its lines to about points samples before they go
+# to matplotlib, a launch has hundreds of thousands of steps and a screen
+# a few thousand pixels. Two ways to pick the samples:
+#
+#   lttb    Largest Triangle Three Buckets, keeps the shape of the line.
+#           https://skemman.is/handle/1946/15343
+#   minmax  the lowest and highest sample of every pixel column, keeps
+#           every peak, like max-Q on the drag.
+#
+# points = None plots every sample.
+#
+# Plots show on screen unless given an output file. render() draws a list
+# of plots to files on a pool of headless (Agg) worker processes.
+#
+# python plots.py launch.traj status.png trajectory.png
+#
 
 import matplotlib.pyplot as plt
 import numpy as np
-from vect import Vector
+from concurrent.futures import ProcessPoolExecutor
 import math
+import sys
+import unittest
+
+"""
+Indices of points samples of y(x) picked by Largest Triangle Three
+Buckets. The first and last sample are always kept.
+"""
+def lttb(x, y, points):
+    n = len(x)
+    if points is None or points >= n or points < 3:
+        return np.arange(n)
+
+    # points - 2 buckets between the first and last sample.
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    idx = np.empty(points, dtype=np.intp)
+    idx[0] = 0
+    idx[-1] = n - 1
+
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket, the last sample after the last bucket.
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        cx = x[hi:next_hi].mean()
+        cy = y[hi:next_hi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + np.argmax(area)
+        idx[i + 1] = a
+    return idx
+
+"""
+Indices of the lowest and highest sample of y in each of pixels columns,
+in order. Columns split the range of x when x is sorted, the samples
+otherwise. The first and last sample are always kept.
+"""
+def minmax(x, y, pixels):
+    n = len(x)
+    if pixels is None or 2 * pixels + 2 >= n:
+        return np.arange(n)
+
+    if np.all(x[1:] >= x[:-1]):
+        edges = np.searchsorted(x, np.linspace(x[0], x[-1], pixels + 1)[1:-1])
+    else:
+        edges = np.linspace(0, n, pixels + 1)[1:-1].astype(np.intp)
+    column = np.zeros(n, dtype=np.intp)
+    np.add.at(column, edges, 1)
+    column = np.cumsum(column)
 
-def plot_accelleration_due_to_mass_to_alt( body, altitude ):
-    altitude_list = []
-    gravity_list = []
-    pos = Vector()
-    
+    # Sorted by column then y, a column's first is its min and last its max.
+    order = np.lexsort((y, column))
+    change = column[order][1:] != column[order][:-1]
+    first = order[np.concatenate(([True], change))]
+    last = order[np.concatenate((change, [True]))]
+    return np.unique(np.concatenate((first, last, [0, n - 1])))
 
+"""
+x and y downsampled to about points samples with method 'lttb' or 'minmax'.
+"""
+def downsample(x, y, points = 2000, method = 'lttb'):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if points is None:
+        return x, y
+    if method == 'lttb':
+        idx = lttb(x, y, points)
+    elif method == 'minmax':
+        idx = minmax(x, y, points // 2)
+    else:
+        raise ValueError("plots.py | unknown downsampling method {}".format(method))
+    return x[idx], y[idx]
+
+# Show fig, or save it to output and let it go.
+def _finish(fig, output):
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+        plt.close(fig)
+    return output
+
+def plot_accelleration_due_to_mass_to_alt( body, altitude, output = None ):
     steps = 1000
-    for i in range(steps):
-        alt = i * altitude / steps
-        pos[2] = body.radius + alt
-        altitude_list.append( alt )
-        gravity_list.append ( body.accelleration( pos ).magnitude )
+    altitude_list = np.arange(steps) * altitude / steps
+    pos = np.zeros((steps, 3))
+    pos[:, 2] = body.radius + altitude_list
+    a = body.accelleration_array( pos )
+    gravity_list = np.sqrt(np.einsum('ij,ij->i', a, a))
 
     fig = plt.figure()
 
@@ -28,22 +118,14 @@ def plot_accelleration_due_to_mass_to_alt( body, altitude ):
     ax.set_xlabel("Altitude [m]")
     ax.set_ylabel("Acceleration due to Gravity $m/s^2$")
     ax.grid()
-    plt.show()
-
-def plot_air_pressure_to_alt( body, altitude ):
-    altitude_list = []
-    air_pressure_list = []
-    density_list = []
-    pos = Vector()
+    return _finish(fig, output)
 
+def plot_air_pressure_to_alt( body, altitude, output = None ):
     steps = 1000
-    for i in range(steps+1):
-        alt = i * altitude / ( steps )
-        pos[2] = body.radius + alt
-        altitude_list.append( alt )
-        P0, density = body.air_pressure_and_density( pos )
-        air_pressure_list.append ( P0 )
-        density_list.append ( density )
+    altitude_list = np.arange(steps + 1) * altitude / steps
+    pos = np.zeros((steps + 1, 3))
+    pos[:, 2] = body.radius + altitude_list
+    air_pressure_list, density_list = body.air_pressure_and_density_array( pos )
 
     fig = plt.figure()
 
@@ -59,59 +141,170 @@ def plot_air_pressure_to_alt( body, altitude ):
     ax.set_yscale('log')
     ax2.set_yscale('log')
     ax.grid()
-    plt.show()        
+    return _finish(fig, output)
 
 
-def status_plot(time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list):
+def status_plot(time_list, altitude_list, drag_list, velocity_list, phi_list, thrust_list, mass_list, output = None, points = 2000, method = 'lttb'):
     fig = plt.figure(figsize=(10,5))
 
-    fig.suptitle('Rocket Statistics') 
+    def line(ax, x, y, style):
+        ax.plot(*downsample(x, y, points, method), style)
+
+    fig.suptitle('Rocket Statistics')
     alt_and_drag_ax, velocity_ax, theta_ax = fig.subplots(1,3)
 
-    alt_and_drag_ax.plot(time_list, altitude_list, 'r')
+    line(alt_and_drag_ax, time_list, altitude_list, 'r')
     alt_and_drag_ax.set_xlabel("Time [s]")
     alt_and_drag_ax.set_ylabel("Altitude [km]")
     alt_and_drag_ax.grid()
 
     alt_and_drag_ax2 = alt_and_drag_ax.twinx()
-    alt_and_drag_ax2.plot(time_list, drag_list, 'b')
-    alt_and_drag_ax2.plot(time_list, thrust_list, 'g')
+    line(alt_and_drag_ax2, time_list, drag_list, 'b')
+    line(alt_and_drag_ax2, time_list, thrust_list, 'g')
     alt_and_drag_ax2.set_ylabel("Force [kN]")
     #alt_and_drag_ax2.set_yscale('log')
 
 
-    theta_ax.plot(phi_list, altitude_list, 'r')
+    line(theta_ax, phi_list, altitude_list, 'r')
     theta_ax.set_xlabel("Azimuth φ (degrees)")
     theta_ax.set_ylabel("Altitude [km]")
     theta_ax.grid()
 
 
-    velocity_ax.plot(time_list, velocity_list, 'r')
+    line(velocity_ax, time_list, velocity_list, 'r')
     velocity_ax.set_xlabel("Time [s]")
     velocity_ax.set_ylabel("Velocity [m/s]")
     velocity_ax.grid()
 
     velocity_ax2 = velocity_ax.twinx()
-    velocity_ax2.plot(time_list, mass_list, 'b')    
+    line(velocity_ax2, time_list, mass_list, 'b')
     velocity_ax2.set_ylabel("Mass [kg]")
 
     plt.tight_layout()
 
-    plt.show()
+    return _finish(fig, output)
 
-def plot_trajectory(body, altitude_list, phi_list):
+def plot_trajectory(body, altitude_list, phi_list, output = None, points = 2000, method = 'lttb'):
 
     fig = plt.figure(figsize=(10,10))
     ax = plt.subplot(1,1, 1, projection='polar')
-    ax.plot(phi_list * math.pi / 180.0 , altitude_list, 'r-')
-    #fig.suptitle('Rocket Path') 
+    phi, altitude = downsample(phi_list, altitude_list, points, method)
+    ax.plot(phi * math.pi / 180.0 , altitude, 'r-')
+    #fig.suptitle('Rocket Path')
     #ax = fig.subplots(1,1)
-    
-    
+
+
     angles = np.array(range(360)) * math.pi  / 180.0
     height = np.full((360,), body.radius)
     ax.plot(angles, height, 'bo')
 
-    
+
     plt.tight_layout()
-    plt.show()
+    return _finish(fig, output)
+
+"""
+Altitude over time of many runs in one plot, for sweeps. runs is a list
+of telemetry columns, dictionaries with 'time' and 'altitude'. Every run
+is downsampled to points samples and all go to matplotlib as one
+LineCollection.
+"""
+def overlay_plot(runs, output = None, points = 500, method = 'lttb', alpha = 0.3):
+    from matplotlib.collections import LineCollection
+
+    fig = plt.figure(figsize=(10,5))
+    fig.suptitle('Altitude of {} runs'.format(len(runs)))
+    ax = fig.subplots(1,1)
+    lines = [ np.column_stack(downsample(run['time'], run['altitude'], points, method)) for run in runs ]
+    ax.add_collection(LineCollection(lines, colors='r', alpha=alpha))
+    ax.autoscale()
+    ax.set_xlabel("Time [s]")
+    ax.set_ylabel("Altitude [km]")
+    ax.grid()
+    return _finish(fig, output)
+
+
+def _headless():
+    plt.switch_backend('Agg')
+
+def _render(job):
+    function, args, kwargs = job
+    return function(*args, **kwargs)
+
+"""
+Draw plots to files without a display. jobs is a list of
+[plot function, args, kwargs], kwargs with the output file of each.
+workers = worker processes, None or 1 draws in this process.
+Returns the output files.
+"""
+def render(jobs, workers = None):
+    for function, args, kwargs in jobs:
+        if kwargs.get('output') is None:
+            raise ValueError("plots.py | render needs an output file for every plot.")
+
+    if workers is None or workers < 2:
+        backend = plt.get_backend()
+        _headless()
+        try:
+            return [ _render(job) for job in jobs ]
+        finally:
+            plt.switch_backend(backend)
+
+    with ProcessPoolExecutor(workers, initializer=_headless) as pool:
+        return list(pool.map(_render, jobs))
+
+
+
+class PlotsUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.linspace(0.0, 100.0, 10001)
+        self.y = np.sin(self.x / 10.0)
+        self.y[5000] = 5.0
+
+    def test_lttb(self):
+        idx = lttb(self.x, self.y, 200)
+        self.assertEqual( len(idx), 200 )
+        self.assertEqual( [idx[0], idx[-1]], [0, 10000] )
+        self.assertTrue( np.all(np.diff(idx) > 0) )
+        self.assertIn( 5000, idx )
+        self.assertEqual( len(lttb(self.x[:100], self.y[:100], 200)), 100 )
+
+    def test_minmax(self):
+        idx = minmax(self.x, self.y, 100)
+        self.assertLessEqual( len(idx), 202 )
+        self.assertIn( 5000, idx )
+        self.assertEqual( self.y[idx].min(), self.y.min() )
+        # Unsorted x splits by sample.
+        idx = minmax(self.x[::-1], self.y, 100)
+        self.assertIn( 5000, idx )
+        with self.assertRaises(ValueError):
+            downsample(self.x, self.y, 100, 'median')
+
+    def test_render(self):
+        import os
+        import tempfile
+        from body import Earth
+        with tempfile.TemporaryDirectory() as directory:
+            runs = [ { 'time': self.x, 'altitude': self.y * i } for i in range(3) ]
+            jobs = [
+                [overlay_plot, [runs], { 'output': os.path.join(directory, 'overlay.png') }],
+                [plot_air_pressure_to_alt, [Earth(), 150e3], { 'output': os.path.join(directory, 'pressure.png') }],
+            ]
+            outputs = render(jobs)
+            self.assertTrue( all(os.path.getsize(output) > 0 for output in outputs) )
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 4:
+        from trajectory import Trajectory
+        from body import Earth
+        earth = Earth()
+        launch = Trajectory(sys.argv[1])
+        columns = [ np.asarray(launch[name]) for name in ['time', 'altitude', 'drag', 'velocity', 'phi', 'thrust', 'mass'] ]
+        render([
+            [status_plot, columns, { 'output': sys.argv[2] }],
+            [plot_trajectory, [earth, columns[1] * 1000 + earth.radius, columns[4]], { 'output': sys.argv[3] }],
+        ], workers=2)
+    else:
+        unittest.main()
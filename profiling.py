@@ -0,0 +1,312 @@
+# Profiling
+#
+# Opt in timing of the simulation loop. run_simulation takes a Profiler
+# and calls tick(phase) after every part of a step, the time since the
+# previous tick goes to that phase. Without a profiler the loop only pays
+# for an `if profiler:` per phase.
+#
+# A profiler hook, cProfile or the SamplingProfiler below, can be attached
+# to a range of steps only, for example the first stage burn.
+#
+# summary() returns plain dictionaries and lists, write() stores them as
+# JSON so runs can be compared over time.
+#
+# python profiling.py --steps 1000:2000 --output profile.json
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import signal
+import time
+import unittest
+
+
+class Profiler:
+
+    """
+    steps = [first, last) step range to run hook over, None for no hook.
+    hook = object with enable() and disable(), defaults to a
+      cProfile.Profile when steps is given.
+    """
+    def __init__(self, steps = None, hook = None):
+        self.steps = steps
+        if hook is None and steps is not None:
+            hook = cProfile.Profile()
+        self.hook = hook
+        self.__phases = {}
+        self.__step_count = 0
+        self.__hooked = False
+        self.__start = None
+        self.__last = None
+        self.__wall_time = 0.0
+        self.__simulated_time = 0.0
+
+    def start(self):
+        self.__start = self.__last = time.perf_counter()
+
+    """
+    Called at the start of step i.
+    """
+    def step(self, i):
+        self.__step_count += 1
+        if self.hook is not None:
+            if i == self.steps[0] and not self.__hooked:
+                self.hook.enable()
+                self.__hooked = True
+            elif i == self.steps[1] and self.__hooked:
+                self.hook.disable()
+                self.__hooked = False
+        self.__last = time.perf_counter()
+
+    """
+    Book the time since the last tick on phase.
+    """
+    def tick(self, phase):
+        now = time.perf_counter()
+        entry = self.__phases.get(phase)
+        if entry is None:
+            entry = self.__phases[phase] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += now - self.__last
+        self.__last = now
+
+    """
+    simulated_time = seconds simulated, for the simulated time rate.
+    """
+    def stop(self, simulated_time = 0.0):
+        if self.__hooked:
+            self.hook.disable()
+            self.__hooked = False
+        self.__wall_time = time.perf_counter() - self.__start
+        self.__simulated_time = simulated_time
+
+    @property
+    def wall_time(self):
+        return self.__wall_time
+
+    def summary(self, top = 25):
+        wall = self.__wall_time
+        summary = {
+            'steps': self.__step_count,
+            'wall_time': wall,
+            'simulated_time': self.__simulated_time,
+            'steps_per_second': self.__step_count / wall if wall > 0.0 else 0.0,
+            'realtime_factor': self.__simulated_time / wall if wall > 0.0 else 0.0,
+            'phases': {
+                name: {
+                    'calls': calls,
+                    'seconds': seconds,
+                    'us_per_call': 1e6 * seconds / calls,
+                    'fraction': seconds / wall if wall > 0.0 else 0.0,
+                }
+                for name, (calls, seconds) in sorted(self.__phases.items(), key=lambda item: -item[1][1])
+            },
+        }
+        if self.hook is not None:
+            summary['profile'] = {
+                'steps': list(self.steps),
+                'functions': _hook_summary(self.hook, top),
+            }
+        return summary
+
+    def write(self, path, top = 25):
+        with open(path, 'wt') as f:
+            json.dump(self.summary(top), f, indent=2)
+
+    def report(self):
+        summary = self.summary()
+        print("{} steps in {:.3f} s, {:.0f} steps/s, {:.1f}x real time".format(
+            summary['steps'], summary['wall_time'], summary['steps_per_second'], summary['realtime_factor']))
+        for name, phase in summary['phases'].items():
+            print("  {:<12} {:8.3f} s {:5.1f}% {:8.2f} us/call".format(name, phase['seconds'], 100.0 * phase['fraction'], phase['us_per_call']))
+        for function in summary.get('profile', {}).get('functions', [])[:10]:
+            print("  {}".format(function))
+
+
+# Functions the hook saw, most expensive first.
+def _hook_summary(hook, top):
+    if hasattr(hook, 'summary'):
+        return hook.summary(top)
+
+    stats = pstats.Stats(hook)
+    functions = []
+    for (filename, line, name), (cc, nc, tottime, cumtime, callers) in stats.stats.items():
+        functions.append({
+            'function': "{}:{}({})".format(os.path.basename(filename), line, name),
+            'calls': nc,
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+    functions.sort(key=lambda f: -f['tottime'])
+    return functions[:top]
+
+
+class SamplingProfiler:
+
+    """
+    Statistical profiler, a SIGPROF timer interrupts the main thread every
+    interval seconds of CPU time and the stack it was in is counted. Much
+    lower overhead than cProfile on a hot loop, at the price of only
+    seeing roughly where the time goes. Unix only, and it has to be
+    enabled from the main thread.
+    """
+    def __init__(self, interval = 0.001):
+        self.interval = interval
+        self.samples = 0
+        self.__self = {}
+        self.__total = {}
+        self.__previous = None
+
+    def enable(self):
+        self.__previous = signal.signal(signal.SIGPROF, self.__sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0.0, 0.0)
+        signal.signal(signal.SIGPROF, self.__previous or signal.SIG_DFL)
+
+    def __sample(self, signum, frame):
+        self.samples += 1
+        seen = set()
+        top = True
+        while frame is not None:
+            code = frame.f_code
+            key = "{}:{}({})".format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+            if top:
+                self.__self[key] = self.__self.get(key, 0) + 1
+                top = False
+            if key not in seen:
+                self.__total[key] = self.__total.get(key, 0) + 1
+                seen.add(key)
+            frame = frame.f_back
+
+    def summary(self, top = 25):
+        functions = [
+            {
+                'function': key,
+                'self_samples': self.__self.get(key, 0),
+                'samples': samples,
+                'fraction': samples / self.samples,
+            }
+            for key, samples in self.__total.items()
+        ]
+        functions.sort(key=lambda f: (-f['self_samples'], -f['samples']))
+        return functions[:top]
+
+
+
+class ProfilerUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test_profile.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def busy(self, n):
+        return sum( i * i for i in range(n) )
+
+    def test_phases(self):
+        profiler = Profiler()
+        profiler.start()
+        for i in range(10):
+            profiler.step(i)
+            self.busy(1000)
+            profiler.tick('first')
+            self.busy(10000)
+            profiler.tick('second')
+        profiler.stop(10.0)
+
+        summary = profiler.summary()
+        self.assertEqual( summary['steps'], 10 )
+        self.assertEqual( list(summary['phases']), ['second', 'first'] )
+        self.assertEqual( summary['phases']['first']['calls'], 10 )
+        self.assertNotIn( 'profile', summary )
+
+        profiler.write(self.path)
+        with open(self.path) as f:
+            self.assertEqual( json.load(f)['steps'], 10 )
+
+    def test_cprofile_range(self):
+        profiler = Profiler(steps=(2, 4))
+        profiler.start()
+        for i in range(6):
+            profiler.step(i)
+            self.busy(100)
+        profiler.stop()
+        functions = profiler.summary()['profile']['functions']
+        busy = [ f for f in functions if f['function'].endswith('(busy)') ]
+        self.assertEqual( busy[0]['calls'], 2 )
+
+    def test_sampling(self):
+        sampler = SamplingProfiler(0.001)
+        profiler = Profiler(steps=(0, 1), hook=sampler)
+        profiler.start()
+        profiler.step(0)
+        end = time.perf_counter() + 0.1
+        while time.perf_counter() < end:
+            self.busy(1000)
+        profiler.step(1)
+        profiler.stop()
+        self.assertGreater( sampler.samples, 0 )
+        names = [ f['function'] for f in profiler.summary()['profile']['functions'] ]
+        self.assertTrue( any( name.endswith('(test_sampling)') for name in names ) )
+
+    def test_simulation(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from vect import Vec3
+        earth = Earth()
+        rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+        profiler = Profiler()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_simulation(earth, rocket, None, duration=10.0, profiler=profiler)
+        summary = profiler.summary()
+        self.assertGreaterEqual( summary['steps'], 100 )
+        for phase in ['gravity', 'atmosphere', 'autopilot', 'thrust', 'drag', 'integration', 'telemetry', 'staging']:
+            self.assertEqual( summary['phases'][phase]['calls'], summary['steps'] )
+
+
+if __name__ == '__main__':
+
+    import contextlib
+    import io
+    from main import run_simulation
+    from body import Earth
+    from atlas import AtlasV401
+    from vect import Vec3
+    from integrator import SymplecticEuler, RK45
+
+    parser = argparse.ArgumentParser(description="Profile an AtlasV401 launch.")
+    parser.add_argument('--duration', type=float, default=7500.0)
+    parser.add_argument('--integrator', choices=['euler', 'rk45'], default='euler')
+    parser.add_argument('--coast', action='store_true')
+    parser.add_argument('--steps', default=None, help="first:last step range to attach a profiler to")
+    parser.add_argument('--sampling', action='store_true', help="use the sampling profiler instead of cProfile")
+    parser.add_argument('--output', default=None, help="write the summary as JSON")
+    args = parser.parse_args()
+
+    steps = None
+    hook = None
+    if args.steps is not None:
+        steps = [ int(v) for v in args.steps.split(':') ]
+        if args.sampling:
+            hook = SamplingProfiler()
+
+    earth = Earth()
+    rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+    rocket.velocity = earth.surface_speed(rocket.position)
+    integrator = RK45() if args.integrator == 'rk45' else SymplecticEuler(0.1)
+
+    profiler = Profiler(steps, hook)
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_simulation(earth, rocket, None, integrator, args.duration, coast=args.coast, profiler=profiler)
+    profiler.report()
+    if args.output is not None:
+        profiler.write(args.output)
@@ -8,7 +8,9 @@
 import numpy as np
 import constants
 import math
-from vect import Vector
+from vect import Vec3
+from stage import StageTable
+from drag import DEFAULT_CD
 
 class Rocket:
 
@@ -18,16 +20,21 @@ class Rocket:
     
     Rocket currently is simulated as a point mass. Real geometry will be later.
 
-    Only simple stacked stages for now. Side boosters in next iteration.
+    The stages are compiled into a stage.StageTable. Only the stages that
+    are lit are visited every step, total mass and drag surface are cached
+    and only recomputed when staging, so a step costs the same however
+    many stages there are.
 
     max_force = maximum force the airframe can handle.
     position = cartesian coordinates ( body center is 0,0 )
     velocity = orientation, please face rocket pointing up!
+    parents = optional, per stage the index of the main stack stage it is
+      strapped to as a side booster, None for main stack stages.
     """
-    def __init__(self, stages, max_force, position, orientation = None):
+    def __init__(self, stages, max_force, position, orientation = None, parents = None):
 
         self.__stages = stages
-        self.__current_stage = 0
+        self.__table = StageTable(stages, parents)
         self.__max_force = max_force
         self.__position = position
         
@@ -38,16 +45,31 @@ class Rocket:
         else:
             self.__orientation = orientation
 
-        self.__velocity = Vector()
-        self.__drag = Vector()
-        self.__thrust = Vector()
+        self.__velocity = Vec3()
+        self.__drag = Vec3()
+        self.__thrust = Vec3()
         self.__throttle = 0.0
+
+        self.__current_stage = self.__table.stack[0]
+        self.__ignite(self.__current_stage)
         
 
     @property
     def max_forces(self):
         return self.__max_force
 
+    @property
+    def stages(self):
+        return self.__stages
+
+    @property
+    def stage_table(self):
+        return self.__table
+
+    @property
+    def current_stage(self):
+        return self.__current_stage
+
     @property
     def position(self):
         return self.__position
@@ -64,24 +86,83 @@ class Rocket:
     def velocity(self, value):
         self.__velocity = value
     
+    # Light stage i of the main stack and its side boosters.
+    def __ignite(self, i):
+        table = self.__table
+        self.__active = [ j for j in table.group(i) if not table.jettisoned[j] ]
+        table.active[:] = False
+        table.active[self.__active] = True
+        for j in self.__active:
+            if self.__stages[j].thrust_curve is None:
+                self.__stages[j].throttle = self.__throttle
+        self.__restage()
+
+    # Refresh the per step caches after the lit or jettisoned stages changed.
+    def __restage(self):
+        table = self.__table
+        kept = ~table.jettisoned & ~table.active
+        # Mass of the stages that are not lit, they do not change until
+        # the next staging.
+        self.__idle_mass = float(np.sum(table.dry_mass[kept] + table.propellant[kept]))
+        self.__drag_surface = float(np.max(table.area[~table.jettisoned], initial=0.0))
+        configuration = table.configuration(self.__current_stage)
+        self.__drag_table = None if configuration < 0 else table.drags[configuration]
+        # [index, burn rate, static thrust, Engine or None, ThrustCurve or
+        # None] of every lit stage with propellant left.
+        self.__burning = [
+            [ i, float(table.burn_rate[i]), float(table.static_thrust[i]), self.__stages[i].engine, self.__stages[i].thrust_curve ]
+            for i in self.__active if table.propellant[i] > 0.0 ]
+        self.__solids = any( burning[4] is not None for burning in self.__burning )
+        self.__update_mass()
+        self.__update_mass_flow()
+
+    def __update_mass(self):
+        table = self.__table
+        mass = self.__idle_mass
+        for i in self.__active:
+            mass += table.dry_mass[i] + table.propellant[i]
+        self.__mass = float(mass)
+
+    def __update_mass_flow(self):
+        self.__mass_flow = sum( self.__stage_throttle(burning) * burning[1] for burning in self.__burning )
 
-    def drag_coefficient(self):
-        # really this is dependent on velocity and vehicle configuration 
-        # see https://space.stackexchange.com/questions/12649
-        return 0.30
+    # Throttle of a burning stage, solids follow their thrust curve.
+    def __stage_throttle(self, burning):
+        curve = burning[4]
+        if curve is None:
+            return self.__throttle
+        return curve.fraction(self.__table.burning_time[burning[0]])
+
+    # The drag.DragTable of the current configuration, None without one.
+    @property
+    def drag_table(self):
+        return self.__drag_table
+
+    # Depends on the Mach number and the configuration, see drag.py.
+    # Without a drag table it is the constant drag.DEFAULT_CD.
+    def drag_coefficient(self, mach = 0.0):
+        if self.__drag_table is None:
+            return DEFAULT_CD
+        return self.__drag_table.coefficient(mach)
+
+
+    # the widest part of the rocket is used for drag calculations.
+    def drag_surface(self):
+        return self.__drag_surface
 
 
-    def drag(self, atmosphere_mass_density):
+    # speed_of_sound = in m/s, for the Mach number. Without it the drag
+    #   coefficient is the one at rest.
+    # air_velocity = velocity relative to the air, the rocket's velocity
+    #   when not given.
+    def drag(self, atmosphere_mass_density, speed_of_sound = None, air_velocity = None):
 
-        # find the wides part of the rocket and
-        # use that for drag calculations
-        max_drag_surface = 0.0
-        for stage in self.__stages:
-            if not stage.jettisoned and stage.drag_surface >= max_drag_surface:
-                max_drag_surface = stage.drag_surface
+        max_drag_surface = self.drag_surface()
+        if air_velocity is None:
+            air_velocity = self.__velocity
 
         # Get velocity
-        velocity = self.__velocity.magnitude
+        velocity = air_velocity.magnitude
 
         # No speed, no drag!
         if ( velocity == 0.0 ):
@@ -89,49 +170,133 @@ class Rocket:
             return self.__drag
         
         # Calculate drag depends on atmosphere of course
-        f = -0.5 * atmosphere_mass_density * velocity * velocity * self.drag_coefficient() * max_drag_surface
+        mach = 0.0 if speed_of_sound is None else velocity / speed_of_sound
+        f = -0.5 * atmosphere_mass_density * velocity * velocity * self.drag_coefficient(mach) * max_drag_surface
         
         # Force is directed against the velocity vector.
-        return self.__drag.assign(self.velocity).mult(f / velocity)
-        
+        return self.__drag.assign(air_velocity).mult(f / velocity)
 
-    def mass(self):
+    """
+    Vectorized counterpart of drag for batch runs.
+    velocity is an (N, 3) array, the other arguments have one entry per rocket.
+    """
+    @staticmethod
+    def drag_array(velocity, atmosphere_mass_density, drag_coefficient, drag_surface):
 
-        mass = 0.0
-        for stage in self.__stages:
-            if not stage.jettisoned:
-                mass += stage.mass
+        # f / |v| * v, written so that zero velocity gives zero drag.
+        speed = np.sqrt(np.einsum('ij,ij->i', velocity, velocity))
+        f = -0.5 * atmosphere_mass_density * speed * drag_coefficient * drag_surface
+        return velocity * f[:, None]
+        
 
-        return mass
+    def mass(self):
+        return self.__mass
 
 
     def thrust(self, p_external):
 
-        # Only the lowest stage can be active at any time for now.
-        # Once we get multiple stages running at the same time 
-        # this will change a bit.
-        stage = self.__stages[self.__current_stage] 
-        
-        if stage.propellant_mass <= 0.0:
+        if not self.__burning:
             self.__thrust.zero()
             return self.__thrust
 
-        
-        F = stage.thrust(p_external)        
-        return self.__thrust.assign(self.__orientation).mult(F)        
+        # Every lit stage with propellant left pushes along the orientation.
+        F = 0.0
+        for burning in self.__burning:
+            throttle = self.__throttle if burning[4] is None else self.__stage_throttle(burning)
+            engine = burning[3]
+            if engine is not None:
+                F += engine.thrust(p_external, throttle)
+            else:
+                # Really only valid at sea level, engine.Engine knows better.
+                F += burning[2] * throttle
+        return self.__thrust.assign(self.__orientation).mult(F)
 
+    # Burn dt seconds of propellant and stage. t = time at the start of
+    # the step, the one the integrator started from.
     def time_step(self, dt, t):
-        
-        stage = self.__stages[self.__current_stage]
-        
-        propellant_left = stage.burn(dt)
-        if propellant_left <= 0.0 and stage.jettison_after_use and self.__current_stage < len(self.__stages) - 1:
-            print("Staging! {} jettisoning {}, next stage = {}".format(t, self.__stages[self.__current_stage].name, self.__stages[self.__current_stage+1].name))
-            self.__current_stage = self.__current_stage + 1
-            stage.jettisoned = True
-            self.__stages[self.__current_stage].throttle = self.__throttle
-            print("Force from stage {} = {}".format(self.__stages[self.__current_stage].name, self.__stages[self.__current_stage].thrust(0.0)))
-            
+
+        table = self.__table
+        propellant = table.propellant
+        empty = []
+        for burning in self.__burning:
+            i = burning[0]
+            curve = burning[4]
+            if curve is None:
+                left = propellant[i] - self.__throttle * burning[1] * dt
+            else:
+                left = propellant[i] - self.__stage_throttle(burning) * burning[1] * dt
+                table.burning_time[i] += dt
+                # Burnt out by the curve, whatever the steps left over.
+                if table.burning_time[i] >= curve.burn_time:
+                    left = 0.0
+            if left <= 0.0:
+                left = 0.0
+                empty.append(i)
+            propellant[i] = left
+        self.__update_mass()
+        if self.__solids:
+            self.__update_mass_flow()
+
+        core = self.__current_stage
+        if not empty and propellant[core] > 0.0:
+            return
+
+        # Side boosters that ran dry drop off on their own.
+        staged = False
+        for i in empty:
+            if i != core and table.jettison_after_use[i]:
+                print("Staging! {} jettisoning {}".format(t, self.__stages[i].name))
+                table.jettisoned[i] = True
+                staged = True
+
+        following = table.next_stage(core)
+        if propellant[core] <= 0.0 and table.jettison_after_use[core] and following is not None:
+            print("Staging! {} jettisoning {}, next stage = {}".format(t, self.__stages[core].name, self.__stages[following].name))
+            # Boosters still strapped on go with it.
+            for i in table.group(core):
+                table.jettisoned[i] = True
+            self.__current_stage = following
+            self.__ignite(following)
+            print("Force from stage {} = {}".format(self.__stages[following].name, self.__stages[following].thrust(0.0)))
+        elif empty or staged:
+            self.__active = [ i for i in self.__active if not table.jettisoned[i] ]
+            table.active[:] = False
+            table.active[self.__active] = True
+            self.__restage()
+
+    # Propellant burned per second by all lit stages.
+    def mass_flow(self):
+        return self.__mass_flow
+
+    # [seconds, stage index] until the first lit stage runs out of
+    # propellant at the current throttle, [inf, None] when nothing burns.
+    # Solids burn out when their thrust curve ends.
+    def next_burnout(self):
+        first = [math.inf, None]
+        for burning in self.__burning:
+            i = burning[0]
+            if burning[4] is not None:
+                seconds = burning[4].burn_time - self.__table.burning_time[i]
+            elif self.__throttle > 0.0:
+                seconds = self.__table.propellant[i] / (self.__throttle * burning[1])
+            else:
+                continue
+            if seconds < first[0]:
+                first = [float(seconds), i]
+        return first
+
+    # Seconds until a lit stage runs out of propellant at the current
+    # throttle, infinite when it is not burning.
+    def time_to_burnout(self):
+        return self.next_burnout()[0]
+
+    # Whether the stage that runs out of propellant first is jettisoned
+    # when it does.
+    def jettisons_at_burnout(self):
+        i = self.next_burnout()[1]
+        if i is None or not self.__table.jettison_after_use[i]:
+            return False
+        return i != self.__current_stage or self.__table.next_stage(i) is not None
 
     @property
     def throttle(self):
@@ -140,10 +305,53 @@ class Rocket:
     @throttle.setter
     def throttle(self, value):
         self.__throttle = value
-        stage = self.__stages[self.__current_stage]
-        stage.throttle = value
+        for i in self.__active:
+            if self.__stages[i].thrust_curve is None:
+                self.__stages[i].throttle = value
+        self.__update_mass_flow()
+
+    """
+    Flight state of the rocket as a dictionary, everything the stages and
+    their table do not fix at construction: position, velocity,
+    orientation, throttle, current stage and per stage the propellant,
+    jettisoned, burning time and throttle. See checkpoint.py.
+    """
+    def snapshot(self):
+        table = self.__table
+        return {
+            'position': np.array(self.__position[:]),
+            'velocity': np.array(self.__velocity[:]),
+            'orientation': np.array(self.__orientation[:]),
+            'throttle': self.__throttle,
+            'current_stage': self.__current_stage,
+            'propellant': table.propellant.copy(),
+            'jettisoned': table.jettisoned.copy(),
+            'burning_time': table.burning_time.copy(),
+            'stage_throttle': np.array([ stage.throttle for stage in self.__stages ], dtype=float),
+        }
+
+    """
+    Put the rocket back in the state of a snapshot taken of a rocket with
+    the same stages.
+    """
+    def restore(self, snapshot):
+        table = self.__table
+        if len(snapshot['propellant']) != len(table):
+            raise ValueError("Rocket::restore snapshot of a rocket with {} stages, this one has {}.".format(len(snapshot['propellant']), len(table)))
+        self.__position = Vec3(snapshot['position'])
+        self.__velocity = Vec3(snapshot['velocity'])
+        self.__orientation = Vec3(snapshot['orientation'])
+        self.__throttle = float(snapshot['throttle'])
+        table.propellant[:] = snapshot['propellant']
+        table.jettisoned[:] = snapshot['jettisoned']
+        table.burning_time[:] = snapshot['burning_time']
+        self.__current_stage = int(snapshot['current_stage'])
+        self.__ignite(self.__current_stage)
+        for stage, throttle in zip(self.__stages, snapshot['stage_throttle']):
+            stage.throttle = float(throttle)
+        self.__update_mass_flow()
 
-    # Once we go away from point source we can calculate 
+    # Once we go away from point source we can calculate
     # orientation based on forces. For now fake it!
     def set_orientation(self, orientation):
-        self.__orientation = orientation
\ No newline at end of file
+        self.__orientation = orientation
@@ -0,0 +1,191 @@
+# Multi rate scheduling
+#
+# run_simulation runs everything at the rate of the integrator. Guidance
+# and air data change a lot slower than the state, a Scheduler lets them
+# update at their own rate and holds their last values in between:
+#
+#   physics     period caps the integrator step, 0.01 for 100 Hz.
+#   guidance    pitch program, engine cut off and autopilot. Also runs
+#               right after any event, a cut off or pitch change is never
+#               held back.
+#   atmosphere  air pressure and density, by period and/or after the
+#               altitude moved delta meters. Held inside the integrator
+#               step as well.
+#   telemetry   rows, also recorded on every event.
+#
+# Subsystems that are not registered run every step, as without a
+# Scheduler. The loads check, gravity, thrust and drag always run.
+#
+#   run_simulation(earth, rocket, 150e3, SymplecticEuler(0.01), rates=multirate())
+import math
+import unittest
+
+# Slack on due times, t is a sum of steps and lands a hair short of
+# multiples of the period.
+_slack = 1e-9
+
+
+class Scheduler:
+
+    def __init__(self):
+        self.__rates = {}
+        self.updates = {}
+
+    """
+    Update name every period seconds, and/or whenever the value it watches
+    moved by delta. Returns self for chaining.
+    """
+    def register(self, name, period = None, delta = None):
+        if period is None and delta is None:
+            raise ValueError("scheduler.py | {} needs a period or a delta.".format(name))
+        # [period, delta, next update time, value at the last update]
+        self.__rates[name] = [period, delta, -math.inf, None]
+        self.updates[name] = 0
+        return self
+
+    """
+    Forget the last updates, everything is due at the next call.
+    run_simulation does this first, a Scheduler can fly many runs.
+    """
+    def reset(self):
+        for name, rate in self.__rates.items():
+            rate[2] = -math.inf
+            rate[3] = None
+            self.updates[name] = 0
+        return self
+
+    # What configures the scheduler, for cache.fingerprint: the rates and
+    # not when they last updated.
+    def _fingerprint(self):
+        return { name: rate[:2] for name, rate in self.__rates.items() }
+
+    """
+    When everything last updated, for checkpoint.Snapshot: per name the
+    next update time, the watched value and the update count.
+    """
+    def snapshot(self):
+        return { name: [rate[2], rate[3], self.updates[name]] for name, rate in self.__rates.items() }
+
+    """
+    Put the scheduler back in the state of snapshot, of the same rates.
+    """
+    def restore(self, snapshot):
+        for name, [next_t, last, updates] in snapshot.items():
+            self.__rates[name][2] = next_t
+            self.__rates[name][3] = last
+            self.updates[name] = updates
+        return self
+
+    def __contains__(self, name):
+        return name in self.__rates
+
+    """
+    Period of name, None when not registered or updated by delta only.
+    """
+    def period(self, name):
+        rate = self.__rates.get(name)
+        return None if rate is None else rate[0]
+
+    """
+    Whether name updates at time t with its watched value, force makes it
+    update anyway. A due update counts as done.
+    """
+    def due(self, name, t, value = None, force = False):
+        rate = self.__rates.get(name)
+        if rate is None:
+            return True
+        period, delta, next_t, last = rate
+        if not (force or t >= next_t - _slack or (delta is not None and last is not None and abs(value - last) >= delta)):
+            return False
+        rate[2] = math.inf if period is None else t + period
+        rate[3] = value
+        self.updates[name] += 1
+        return True
+
+
+"""
+Scheduler with the usual rates: guidance at 10 Hz, the atmosphere every
+second or 100 m, telemetry at 1 Hz. physics = optional integrator period.
+"""
+def multirate(physics = None, guidance = 0.1, atmosphere = 1.0, altitude_delta = 100.0, telemetry = 1.0):
+    scheduler = Scheduler()
+    if physics is not None:
+        scheduler.register('physics', physics)
+    scheduler.register('guidance', guidance)
+    scheduler.register('atmosphere', atmosphere, altitude_delta)
+    scheduler.register('telemetry', telemetry)
+    return scheduler
+
+
+
+class SchedulerUnitTest(unittest.TestCase):
+
+    def test_due(self):
+        s = Scheduler().register('guidance', 1.0).register('atmosphere', None, 100.0)
+        t = 0.0
+        updates = []
+        for i in range(30):
+            if s.due('guidance', t):
+                updates.append(i)
+            t += 0.1
+        # Sums of 0.1 still land on the whole seconds.
+        self.assertEqual( updates, [0, 10, 20] )
+        self.assertTrue( s.due('guidance', 2.5, force=True) )
+        self.assertEqual( s.updates['guidance'], 4 )
+
+        self.assertTrue( s.due('atmosphere', 0.0, 0.0) )
+        self.assertFalse( s.due('atmosphere', 1.0, 99.0) )
+        self.assertTrue( s.due('atmosphere', 2.0, -100.0) )
+        self.assertTrue( s.due('telemetry', 0.0) )
+        s.reset()
+        self.assertTrue( s.due('guidance', 2.6) )
+        self.assertTrue( s.due('atmosphere', 2.6, -100.0) )
+        self.assertEqual( s.updates['guidance'], 1 )
+        self.assertNotIn( 'telemetry', s )
+        with self.assertRaises(ValueError):
+            s.register('telemetry')
+
+    def test_launch(self):
+        import contextlib
+        import io
+        from main import run_simulation
+        from body import Earth
+        from atlas import AtlasV401
+        from vect import Vec3
+        from integrator import SymplecticEuler
+        import constants
+        import orbit
+
+        earth = Earth()
+        results = []
+        held_rates = multirate(physics=0.05)
+        for rates in [None, held_rates]:
+            rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+            rocket.velocity = earth.surface_speed(rocket.position)
+            stats = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                columns = run_simulation(earth, rocket, 150e3, SymplecticEuler(0.05), 700.0, stats=stats, rates=rates)
+            o = orbit.elements(rocket.position, rocket.velocity, constants.G * earth.mass)
+            results.append([o.apoapsis - earth.radius, o.periapsis - earth.radius, len(columns[0]), stats])
+
+        held, full = results[1], results[0]
+        self.assertEqual( held[3]['status'], full[3]['status'] )
+        self.assertAlmostEqual( held[0] / full[0], 1.0, places=2 )
+        self.assertAlmostEqual( held[1] / full[1], 1.0, places=2 )
+        # A row a second plus the events.
+        self.assertLess( held[2], 700 + 2 * len(held[3]['events']) + 2 )
+        self.assertGreaterEqual( full[2], 14000 )
+        self.assertLess( held_rates.updates['guidance'], 7000 + len(held[3]['events']) + 2 )
+
+        # The same scheduler flies the next run from scratch.
+        rocket = AtlasV401(8.0e3, Vec3([0.0, earth.radius, 0.0]))
+        rocket.velocity = earth.surface_speed(rocket.position)
+        stats = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_simulation(earth, rocket, 150e3, SymplecticEuler(0.05), 700.0, stats=stats, rates=held_rates)
+        o = orbit.elements(rocket.position, rocket.velocity, constants.G * earth.mass)
+        self.assertEqual( [o.apoapsis - earth.radius, o.periapsis - earth.radius], held[:2] )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import math
+import unittest
 import numpy as np
+import constants
 from vect import Vector
 
 class Stage:
@@ -9,17 +11,28 @@ class Stage:
 
     dry_mass of stage without propellant in kg
     propellant_mass = mass of propellant in kg
-    burn_time = burn time at 100% throttle till propellant is used up.    
+    burn_time = burn time at 100% throttle till propellant is used up.
+      With an engine its mass flow sets the burn instead.
     static_thrust = thrust at sea level in N
     diameter = diameter of stage in meters.
     jettison_after_use = boolean indicating if this stage is jettisoned when empty.
+    engine = optional engine.Engine, its thrust replaces static_thrust.
+    thrust_curve = optional engine.ThrustCurve of a solid motor, it sets
+      the throttle from ignition on instead of the auto pilot.
+    drag = optional drag.DragTable of the rocket while this is its lowest
+      stage, or while it is strapped on for side boosters. Without one
+      the drag coefficient is drag.DEFAULT_CD.
     """
-    def __init__(self, dry_mass, propellant_mass, burn_time, static_thrust, diameter, jettison_after_use = True, name = ""):
+    def __init__(self, dry_mass, propellant_mass, burn_time, static_thrust, diameter, jettison_after_use = True, name = "",
+                 engine = None, thrust_curve = None, drag = None):
         
         self.__dry_mass = dry_mass 
         self.__propellant_mass = propellant_mass
         self.__propellant_mass_at_start = propellant_mass
-        if burn_time == 0:
+        if engine is not None:
+            # The engine burns what its thrust and Isp take.
+            self.__propellant_100_percent_burn_rate = engine.mass_flow
+        elif burn_time == 0:
             self.__propellant_100_percent_burn_rate = 0
         else:
             self.__propellant_100_percent_burn_rate = propellant_mass / burn_time
@@ -29,15 +42,17 @@ class Stage:
         self.__name = name
         self.__jettison_after_use = jettison_after_use
         self.__jettisoned = False
+        self.__engine = engine
+        self.__thrust_curve = thrust_curve
+        self.__drag = drag
                         
         self.__throttle = 0.0
         self.__drag_surface = math.pi * ( self.__diameter / 2.0 ) ** 2
         self.__lastx = ""
-        # advanced rocket engine equations
-        self._ispVac = None
-        self._exit_area = None
-        #self.__ispVac = IspVac
-        # self.exit_area = math.pi * ( 1.4 / 2.0 )**2
+        # StageTable holding the propellant and jettisoned state once the
+        # stage is part of a Rocket, see StageTable.
+        self._table = None
+        self._index = None
 
     @property
     def name(self):
@@ -45,12 +60,22 @@ class Stage:
 
     @property
     def propellant_mass(self):
+        if self._table is not None:
+            return float(self._table.propellant[self._index])
         return self.__propellant_mass
 
     @property
     def dry_mass(self):
         return self.__dry_mass
 
+    @property
+    def static_thrust(self):
+        return self.__static_thrust
+
+    @property
+    def burn_rate(self):
+        return self.__propellant_100_percent_burn_rate
+
     @property
     def throttle(self):
         return self.__throttle
@@ -73,42 +98,233 @@ class Stage:
 
     @property
     def jettisoned(self):
+        if self._table is not None:
+            return bool(self._table.jettisoned[self._index])
         return self.__jettisoned
 
     @jettisoned.setter
     def jettisoned(self, value):
+        if self._table is not None:
+            self._table.jettisoned[self._index] = value
         self.__jettisoned = value
 
     def burn(self, dt):
-        self.__propellant_mass -= self.mass_flow() * dt
-        if self.__propellant_mass < 0.0:
-            self.__propellant_mass = 0.0            
-        return self.__propellant_mass
+        propellant_mass = self.propellant_mass - self.mass_flow() * dt
+        if propellant_mass < 0.0:
+            propellant_mass = 0.0
+        if self._table is not None:
+            self._table.propellant[self._index] = propellant_mass
+        self.__propellant_mass = propellant_mass
+        return propellant_mass
     
+    # Throttle the stage burns at, a thrust curve sets it from ignition
+    # on whatever throttle was set.
+    def __burning_throttle(self):
+        if self.__thrust_curve is None:
+            return self.throttle
+        burning_time = 0.0 if self._table is None else float(self._table.burning_time[self._index])
+        return self.__thrust_curve.fraction(burning_time)
+
     def mass_flow(self):
 
         if self.propellant_mass <= 0.0:
             return 0.0
         
-        return self.throttle * self.__propellant_100_percent_burn_rate
+        return self.__burning_throttle() * self.__propellant_100_percent_burn_rate
 
     def thrust(self, p_external):
         
         if self.propellant_mass <= 0.0:
             return 0.0
 
-        # https://en.wikipedia.org/wiki/Rocket_engine_nozzle
-        if self._ispVac is not None:
-            F = self._ispVac * 9.81 * self.mass_flow() - self._exit_area * p_external
-            return F
+        if self.__engine is not None:
+            return self.__engine.thrust(p_external, self.__burning_throttle())
 
         # x = "{}, thrust {},  throttle {}, st {}".format(self.__name, self.__static_thrust, self.throttle, self.throttle * self.__static_thrust)        
         # if x != self.__lastx:
         #     self.__lastx = x
         #     print(x)
         
-        # Really only valid at sea level, needs improvement from rocket equation.        
-        return self.__static_thrust * self.throttle
-    
+        # Really only valid at sea level, engine.Engine knows better.
+        return self.__static_thrust * self.__burning_throttle()
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def thrust_curve(self):
+        return self.__thrust_curve
+
+    @property
+    def drag(self):
+        return self.__drag
+
     def control( self, throttle):
-        self.__throttle = throttle        
\ No newline at end of file
+        self.__throttle = throttle        
+
+
+class StageTable:
+
+    """
+    The stages of a rocket compiled into NumPy arrays, one entry per stage.
+    Rocket keeps the flight state (propellant, jettisoned) here, the Stage
+    objects read it back.
+
+    stages = list of Stage, the main stack bottom to top plus side boosters.
+    parents = per stage the index of the stage a side booster is strapped
+      to, None or -1 for stages in the main stack. Boosters burn together
+      with their parent and go with it when it is jettisoned.
+
+    Static columns: dry_mass, burn_rate, static_thrust, engine, curve and
+    drag (index into engines, curves and drags, -1 for none), area (drag
+    surface), parent, jettison_after_use.
+    State columns: propellant, jettisoned, active (lit, burning whenever
+    the throttle is open and there is propellant left), burning_time
+    (seconds since ignition, drives the thrust curves).
+    """
+    def __init__(self, stages, parents = None):
+        n = len(stages)
+        if parents is None:
+            parents = [-1] * n
+        if len(parents) != n:
+            raise ValueError("Need one parent per stage.")
+
+        self.dry_mass = np.array([ s.dry_mass for s in stages ], dtype=float)
+        self.propellant = np.array([ s.propellant_mass for s in stages ], dtype=float)
+        self.burn_rate = np.array([ s.burn_rate for s in stages ], dtype=float)
+        self.static_thrust = np.array([ s.static_thrust for s in stages ], dtype=float)
+        self.engines = []
+        self.engine = np.array([ self.__lookup(self.engines, s.engine) for s in stages ], dtype=int)
+        self.curves = []
+        self.curve = np.array([ self.__lookup(self.curves, s.thrust_curve) for s in stages ], dtype=int)
+        self.drags = []
+        self.drag = np.array([ self.__lookup(self.drags, s.drag) for s in stages ], dtype=int)
+        self.area = np.array([ s.drag_surface for s in stages ], dtype=float)
+        self.parent = np.array([ -1 if p is None else p for p in parents ], dtype=int)
+        self.jettison_after_use = np.array([ s.jettison_after_use for s in stages ], dtype=bool)
+        self.jettisoned = np.array([ s.jettisoned for s in stages ], dtype=bool)
+        self.active = np.zeros(n, dtype=bool)
+        self.burning_time = np.zeros(n)
+
+        for i, p in enumerate(self.parent):
+            if p >= 0 and (p >= n or self.parent[p] >= 0):
+                raise ValueError("Side boosters have to be strapped to a stage of the main stack.")
+
+        # Main stack in flight order.
+        self.stack = np.flatnonzero(self.parent < 0).tolist()
+        if not self.stack:
+            raise ValueError("A rocket needs at least one stage in its main stack.")
+
+        for i, stage in enumerate(stages):
+            stage._table = self
+            stage._index = i
+
+    def __len__(self):
+        return len(self.dry_mass)
+
+    # Index of item in items, added when new. -1 for None.
+    @staticmethod
+    def __lookup(items, item):
+        if item is None:
+            return -1
+        for k, known in enumerate(items):
+            if known is item:
+                return k
+        items.append(item)
+        return len(items) - 1
+
+    """
+    Stack stage that follows stage i, None for the top of the stack.
+    """
+    def next_stage(self, i):
+        k = self.stack.index(i)
+        return self.stack[k + 1] if k + 1 < len(self.stack) else None
+
+    """
+    Stage i and its side boosters.
+    """
+    def group(self, i):
+        return [i] + np.flatnonzero(self.parent == i).tolist()
+
+    """
+    Index into drags of the configuration flying on stack stage i, -1 for
+    none: the table of a side booster still strapped to it, else its own.
+    jettisoned = optional column to use instead of the table's.
+    """
+    def configuration(self, i, jettisoned = None):
+        if jettisoned is None:
+            jettisoned = self.jettisoned
+        for j in self.group(i)[1:]:
+            if not jettisoned[j] and self.drag[j] >= 0:
+                return int(self.drag[j])
+        return int(self.drag[i])
+
+
+
+class StageTableUnitTest(unittest.TestCase):
+
+    def test_columns(self):
+        core = Stage(1000.0, 9000.0, 90.0, 200e3, 2.0, True, "core")
+        booster = Stage(100.0, 900.0, 30.0, 50e3, 1.0, True, "booster")
+        upper = Stage(500.0, 1500.0, 300.0, 20e3, 2.0, True, "upper")
+        table = StageTable([core, booster, upper], [None, 0, None])
+
+        self.assertEqual( table.stack, [0, 2] )
+        self.assertEqual( table.next_stage(0), 2 )
+        self.assertIsNone( table.next_stage(2) )
+        self.assertEqual( table.group(0), [0, 1] )
+        self.assertEqual( table.burn_rate[1], 30.0 )
+        self.assertEqual( table.engine[0], -1 )
+        self.assertEqual( table.configuration(0), -1 )
+
+        # The stages read their state from the table.
+        table.propellant[1] = 10.0
+        table.jettisoned[2] = True
+        self.assertEqual( booster.propellant_mass, 10.0 )
+        self.assertTrue( upper.jettisoned )
+
+        with self.assertRaises(ValueError):
+            StageTable([core, booster], [1, 0])
+
+    def test_engines_are_shared(self):
+        from engine import Engine
+        rl10 = Engine(99.2e3, 450.5, 1.075, 84.0)
+        stages = [ Stage(100.0, 900.0, 30.0, 0.0, 1.0, True, "stage", rl10) for i in range(2) ]
+        table = StageTable(stages + [ Stage(1.0, 0.0, 0.0, 0.0, 1.0, False) ])
+        self.assertEqual( table.engines, [rl10] )
+        self.assertEqual( table.engine.tolist(), [0, 0, -1] )
+        # The engine replaces the static thrust.
+        stages[0].throttle = 1.0
+        self.assertAlmostEqual( stages[0].thrust(0.0), 99.2e3 )
+        # And burns what its Isp takes, burn_time does not matter.
+        self.assertEqual( table.burn_rate[0], rl10.mass_flow )
+        self.assertAlmostEqual( stages[0].thrust(0.0) / (stages[0].mass_flow() * constants.g0), 450.5 )
+        stages[0].throttle = 0.5
+        self.assertAlmostEqual( stages[0].thrust(20e3) / (stages[0].mass_flow() * constants.g0), rl10.isp(20e3, 0.5) )
+
+    def test_thrust_curve_stage(self):
+        from engine import ThrustCurve
+        # A solid burns on its curve without anyone setting its throttle.
+        solid = Stage(100.0, 900.0, 30.0, 50e3, 1.0, True, "solid", thrust_curve=ThrustCurve([0.0, 30.0], [1.0, 1.0], 30.0))
+        self.assertAlmostEqual( solid.thrust(0.0), 50e3 )
+        self.assertAlmostEqual( solid.mass_flow(), 30.0 )
+        table = StageTable([solid])
+        table.burning_time[0] = 40.0
+        self.assertEqual( solid.thrust(0.0), 0.0 )
+
+    def test_drag_configuration(self):
+        from drag import launch_vehicle
+        stack, strapped = launch_vehicle(), launch_vehicle(1.5)
+        core = Stage(1000.0, 9000.0, 90.0, 200e3, 2.0, True, "core", drag=stack)
+        boosters = [ Stage(100.0, 900.0, 30.0, 50e3, 1.0, True, "booster", drag=strapped) for i in range(2) ]
+        upper = Stage(500.0, 1500.0, 300.0, 20e3, 2.0, True, "upper")
+        table = StageTable([core, upper] + boosters, [None, None, 0, 0])
+        self.assertEqual( table.drags, [stack, strapped] )
+        self.assertEqual( table.configuration(0), 1 )
+        table.jettisoned[2] = True
+        self.assertEqual( table.configuration(0), 1 )
+        table.jettisoned[3] = True
+        self.assertEqual( table.configuration(0), 0 )
+        self.assertEqual( table.configuration(0, np.zeros(4, dtype=bool)), 1 )
+        self.assertEqual( table.configuration(1), -1 )
@@ -0,0 +1,323 @@
+# Parameter sweeps
+#
+# Runs run_simulation for every combination of a parameter grid on a pool
+# of worker processes. Each worker builds its own Earth and AtlasV401 and
+# only sends back a summary of the flight. Finished runs are appended to a
+# single trajectory file (see trajectory.py) as they come in, so an
+# interrupted sweep picks up where it left off when started again.
+#
+# With --cache DIR runs go through a cache.RunCache there, runs flown
+# before by any sweep come back without simulating them again.
+#
+# With --live PORT every run streams its flight to a live.TelemetryServer,
+# tail it with python live.py tail --port PORT.
+#
+# python sweep.py --payload 1000:12000:1000 --turn-altitude 150e3,200e3 --output sweep.traj
+import argparse
+import contextlib
+import io
+import itertools
+import math
+import os
+import time
+import unittest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import constants
+from trajectory import TrajectoryWriter, Trajectory
+
+# Parameters a sweep can vary and their defaults, the defaults match
+# default_pitch_program in main.py.
+DEFAULTS = {
+    'payload_mass': 8.0e3,
+    'kick_altitude': 1e3,
+    'kick_delta': 0.5,
+    'turn_altitude': 200e3,
+    'turn_delta': 0.1,
+}
+
+# Summary columns written for every run. Altitudes are above the surface.
+RESULTS = [
+    'status', 't_end', 'apoapsis', 'periapsis', 'eccentricity', 'inclination',
+    'semi_major_axis', 'max_q', 'max_q_time', 'max_force', 'propellant_margin', 'wall_time',
+]
+
+COLUMNS = ['index'] + list(DEFAULTS) + RESULTS
+
+# Live frame queue of the worker processes, see run_sweep.
+_live = None
+DTYPES = [ '<i8' if name == 'index' else 'S16' if name == 'status' else '<f8' for name in COLUMNS ]
+
+
+"""
+Cartesian product of the given parameter values, missing parameters take
+their default. Returns a list of parameter dictionaries, each with an index.
+"""
+def grid(**values):
+
+    for name in values:
+        if name not in DEFAULTS:
+            raise ValueError("Unknown sweep parameter {}".format(name))
+
+    names = list(DEFAULTS)
+    axes = [ values.get(name, [DEFAULTS[name]]) for name in names ]
+
+    runs = []
+    for index, combination in enumerate(itertools.product(*axes)):
+        params = dict(zip(names, combination))
+        params['index'] = index
+        runs.append(params)
+    return runs
+
+
+"""
+Simulate one launch and summarize it. Runs inside the worker processes.
+cache = optional RunCache directory.
+"""
+def simulate(params, duration = 7500.0, cache = None):
+
+    # Imported here so the parent process does not need the whole simulation.
+    from main import run_simulation
+    from body import Earth
+    from atlas import AtlasV401
+    from vect import Vec3
+    from integrator import RK45
+    import orbit
+
+    start = time.time()
+    earth = Earth()
+    rocket = AtlasV401(params['payload_mass'], Vec3([0.0, earth.radius, 0.0]))
+    rocket.velocity = earth.surface_speed(rocket.position)
+
+    pitch_program = [
+        [0.0, 1.0],
+        [params['kick_altitude'], params['kick_delta']],
+        [params['turn_altitude'], params['turn_delta']],
+    ]
+
+    telemetry = None
+    if _live is not None:
+        from live import LiveSink
+        telemetry = LiveSink(_live, rocket, every=50, run=params['index'])
+
+    stats = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        if cache is not None and telemetry is None:
+            from cache import RunCache
+            RunCache(cache).run(earth, rocket, None, integrator=RK45(), duration=duration, pitch_program=pitch_program, stats=stats, coast=True)
+        else:
+            run_simulation(earth, rocket, None, RK45(), duration, pitch_program, stats, telemetry, coast=True)
+
+    o = orbit.elements(rocket.position, rocket.velocity, constants.G * earth.mass)
+
+    record = dict(params)
+    record.update({
+        'status': stats['status'],
+        't_end': stats['t_end'],
+        'apoapsis': o.apoapsis - earth.radius,
+        'periapsis': o.periapsis - earth.radius,
+        'eccentricity': o.e,
+        'inclination': math.degrees(o.i),
+        'semi_major_axis': o.a,
+        'max_q': stats['max_q'],
+        'max_q_time': stats['max_q_time'],
+        'max_force': stats['max_force'],
+        'propellant_margin': sum( stage.propellant_mass for stage in rocket.stages if not stage.jettisoned ),
+        'wall_time': time.time() - start,
+    })
+    return record
+
+
+def _init_worker(live):
+    global _live
+    _live = live
+
+
+"""
+Read a sweep file back as columns, a dictionary of arrays. Numeric
+columns are memory mapped.
+"""
+def load(path):
+
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return { name: np.empty(0, dtype=str if name == 'status' else dtype) for name, dtype in zip(COLUMNS, DTYPES) }
+
+    trajectory = Trajectory(path)
+    columns = { name: trajectory[name] for name in COLUMNS }
+    columns['status'] = columns['status'].astype(str)
+    return columns
+
+
+"""
+Run all runs of a grid on a process pool and stream the summaries into
+output. Runs already in output are skipped when resume is set, raises
+ValueError when output holds runs of a different grid.
+live = optional multiprocessing queue the runs stream their frames on,
+  served by a live.TelemetryServer.
+cache = optional RunCache directory, live runs bypass it.
+Returns the complete sweep as columns, see load.
+"""
+def run_sweep(runs, output, workers = None, duration = 7500.0, resume = True, live = None, cache = None):
+
+    done = set()
+    if resume:
+        # Rows are matched on their parameters as well as their index, an
+        # output of another grid is not resumed.
+        previous = load(output)
+        wanted = { params['index']: tuple( float(params[name]) for name in DEFAULTS ) for params in runs }
+        for k, index in enumerate(previous['index'].tolist()):
+            values = tuple( float(previous[name][k]) for name in DEFAULTS )
+            if index in wanted and wanted[index] != values:
+                raise ValueError("sweep.py | {} holds run {} with other parameters, resume it with its own grid or pass resume=False.".format(output, index))
+            done.add(index)
+    elif os.path.exists(output):
+        os.remove(output)
+
+    todo = [ params for params in runs if params['index'] not in done ]
+
+    writer = TrajectoryWriter(output, COLUMNS, DTYPES, append=True)
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(live,)) as pool:
+            futures = [ pool.submit(simulate, params, duration, cache) for params in todo ]
+            for count, future in enumerate(as_completed(futures)):
+                record = future.result()
+                writer.record(*[ record[name] for name in COLUMNS ])
+                # flush every row so an interrupted sweep loses nothing.
+                writer.flush()
+                print("{}/{} payload={} status={} periapsis={:.0f} apoapsis={:.0f}".format(
+                    count + 1, len(todo), record['payload_mass'], record['status'], record['periapsis'], record['apoapsis']))
+    finally:
+        writer.close()
+
+    return load(output)
+
+
+"""
+Row of the heaviest payload that reached an orbit with at least the given
+periapsis altitude, and when apoapsis is given, an apoapsis altitude within
+tolerance meters of it. Returns None when no run qualifies.
+"""
+def max_payload(results, periapsis, apoapsis = None, tolerance = 50e3):
+
+    ok = (results['status'] == 'completed') & (results['periapsis'] >= periapsis)
+    if apoapsis is not None:
+        ok &= np.abs(results['apoapsis'] - apoapsis) <= tolerance
+
+    if not np.any(ok):
+        return None
+
+    best = np.flatnonzero(ok)[np.argmax(results['payload_mass'][ok])]
+    return { name: results[name][best].item() for name in COLUMNS }
+
+
+# start:stop:step or a comma separated list of values.
+def _values(text):
+    if ':' in text:
+        start, stop, step = [ float(v) for v in text.split(':') ]
+        return np.arange(start, stop + step / 2.0, step).tolist()
+    return [ float(v) for v in text.split(',') ]
+
+
+
+class SweepUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'test_sweep.traj')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_grid(self):
+        runs = grid(payload_mass=[1e3, 2e3], turn_altitude=[150e3, 200e3, 250e3])
+        self.assertEqual( len(runs), 6 )
+        self.assertEqual( [ r['index'] for r in runs ], list(range(6)) )
+        self.assertEqual( runs[0]['kick_delta'], DEFAULTS['kick_delta'] )
+        with self.assertRaises(ValueError):
+            grid(payload=[1.0])
+
+    def test_resume(self):
+        runs = grid(payload_mass=[1e3, 5e3, 9e3])
+        results = run_sweep(runs[:2], self.output, workers=2, duration=30.0)
+        self.assertEqual( len(results['index']), 2 )
+
+        # Only the missing run is simulated the second time around.
+        results = run_sweep(runs, self.output, workers=2, duration=30.0)
+        self.assertEqual( sorted(results['index'].tolist()), [0, 1, 2] )
+        self.assertTrue( np.all(results['status'] == 'completed') )
+        self.assertTrue( np.all(results['t_end'] >= 30.0) )
+
+        # Another grid does not reuse these results.
+        with self.assertRaises(ValueError):
+            run_sweep(grid(payload_mass=[2e3, 5e3, 9e3]), self.output, workers=2, duration=30.0)
+
+    def test_live(self):
+        import multiprocessing
+        from live import TelemetryServer
+        with TelemetryServer(frames_queue=multiprocessing.Queue(1024)) as server:
+            run_sweep(grid(payload_mass=[1e3, 5e3]), self.output, workers=2, duration=10.0, resume=False, live=server.queue)
+        # Both runs streamed, from the worker processes.
+        self.assertGreater( server.frames, 0 )
+
+    def test_cache(self):
+        import tempfile
+        runs = grid(payload_mass=[1e3, 5e3])
+        with tempfile.TemporaryDirectory() as directory:
+            first = run_sweep(runs, self.output, workers=2, duration=30.0, resume=False, cache=directory)
+            again = run_sweep(runs, self.output, workers=2, duration=30.0, resume=False, cache=directory)
+        order = np.argsort(first['index']), np.argsort(again['index'])
+        for name in ['t_end', 'apoapsis', 'periapsis', 'max_q', 'propellant_margin']:
+            self.assertTrue( np.array_equal(first[name][order[0]], again[name][order[1]]) )
+
+    def test_max_payload(self):
+        results = {
+            'status': np.array(['completed', 'completed', 'rud']),
+            'periapsis': np.array([200e3, 90e3, 300e3]),
+            'apoapsis': np.array([250e3, 300e3, 300e3]),
+            'payload_mass': np.array([5e3, 9e3, 12e3]),
+        }
+        for name in COLUMNS:
+            results.setdefault(name, np.zeros(3))
+        self.assertEqual( max_payload(results, 150e3)['payload_mass'], 5e3 )
+        self.assertIsNone( max_payload(results, 400e3) )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Sweep AtlasV401 launches over payload and pitch program.")
+    parser.add_argument('--payload', type=_values, default=[DEFAULTS['payload_mass']], help="payload mass in kg, start:stop:step or a,b,c")
+    parser.add_argument('--kick-altitude', type=_values, default=[DEFAULTS['kick_altitude']])
+    parser.add_argument('--kick-delta', type=_values, default=[DEFAULTS['kick_delta']])
+    parser.add_argument('--turn-altitude', type=_values, default=[DEFAULTS['turn_altitude']])
+    parser.add_argument('--turn-delta', type=_values, default=[DEFAULTS['turn_delta']])
+    parser.add_argument('--duration', type=float, default=7500.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='sweep.traj')
+    parser.add_argument('--restart', action='store_true', help="ignore results already in output")
+    parser.add_argument('--periapsis', type=float, default=150e3, help="minimum periapsis altitude for max payload")
+    parser.add_argument('--apoapsis', type=float, default=None, help="target apoapsis altitude for max payload")
+    parser.add_argument('--cache', default=None, metavar='DIR', help="reuse runs cached in this directory, see cache.py")
+    parser.add_argument('--live', type=int, default=None, metavar='PORT', help="stream the runs on this port, see live.py")
+    args = parser.parse_args()
+
+    runs = grid(
+        payload_mass=args.payload,
+        kick_altitude=args.kick_altitude,
+        kick_delta=args.kick_delta,
+        turn_altitude=args.turn_altitude,
+        turn_delta=args.turn_delta)
+
+    if args.live is None:
+        results = run_sweep(runs, args.output, args.workers, args.duration, not args.restart, cache=args.cache)
+    else:
+        import multiprocessing
+        from live import TelemetryServer
+        with TelemetryServer(port=args.live, frames_queue=multiprocessing.Queue(4096)) as server:
+            results = run_sweep(runs, args.output, args.workers, args.duration, not args.restart, server.queue)
+    best = max_payload(results, args.periapsis, args.apoapsis)
+    if best is None:
+        print("No run reached the requested orbit.")
+    else:
+        print("Max payload {} kg: {}".format(best['payload_mass'], best))
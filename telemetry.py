@@ -0,0 +1,298 @@
+# Telemetry
+#
+# Sinks that record one row of numbers per simulation step.
+#
+# ChunkedBuffer   keeps everything in memory in NumPy blocks.
+# RingBuffer      keeps only the last rows, constant memory.
+# NpyFileSink     streams the rows to a .npy file in blocks, constant memory.
+# DecimatingSink  forwards every Nth row, or rows where a column changed,
+#                 to another sink.
+#
+# Every sink hands its data back through columns(), one array per column.
+import os
+import struct
+import unittest
+import numpy as np
+
+# Columns recorded by run_simulation, in order.
+COLUMNS = ['time', 'altitude', 'drag', 'velocity', 'phi', 'thrust', 'mass']
+
+
+class Sink:
+
+    """
+    Base class for telemetry sinks.
+    columns = names of the recorded columns.
+    """
+    def __init__(self, columns = COLUMNS):
+        self.names = list(columns)
+
+    """
+    Record one row, one value per column.
+    """
+    def record(self, *values):
+        print("Sink::record not defined.")
+        exit(-1)
+
+    """
+    Make everything recorded so far available, for example write it to disk.
+    """
+    def flush(self):
+        pass
+
+    """
+    The recorded data, a tuple with one array per column.
+    """
+    def columns(self):
+        print("Sink::columns not defined.")
+        exit(-1)
+
+    def close(self):
+        self.flush()
+
+
+class ChunkedBuffer(Sink):
+
+    """
+    In memory sink. Rows are gathered in a flat list and turned into a
+    NumPy block of chunk_size rows once it is full, filling a Python list
+    is a lot cheaper per row than assigning into a NumPy array. Full
+    blocks are kept as they are, nothing is copied while recording.
+    """
+    def __init__(self, columns = COLUMNS, chunk_size = 8192):
+        super().__init__(columns)
+        self.__chunk_values = chunk_size * len(self.names)
+        self.__chunks = []
+        self.__pending = []
+
+    def __len__(self):
+        return (len(self.__chunks) * self.__chunk_values + len(self.__pending)) // len(self.names)
+
+    def record(self, *values):
+        self.__pending.extend(values)
+        if len(self.__pending) >= self.__chunk_values:
+            self.__chunks.append(np.array(self.__pending).reshape(-1, len(self.names)))
+            self.__pending = []
+
+    def array(self):
+        pending = np.array(self.__pending, dtype=float).reshape(-1, len(self.names))
+        return np.concatenate(self.__chunks + [pending])
+
+    def columns(self):
+        return tuple(self.array().T)
+
+
+class RingBuffer(Sink):
+
+    """
+    In memory sink that only keeps the last capacity rows.
+    """
+    def __init__(self, columns = COLUMNS, capacity = 8192):
+        super().__init__(columns)
+        self.__buffer = np.empty((capacity, len(self.names)))
+        self.__count = 0
+
+    def __len__(self):
+        return min(self.__count, len(self.__buffer))
+
+    def record(self, *values):
+        self.__buffer[self.__count % len(self.__buffer)] = values
+        self.__count += 1
+
+    def array(self):
+        capacity = len(self.__buffer)
+        if self.__count <= capacity:
+            return self.__buffer[:self.__count].copy()
+        start = self.__count % capacity
+        return np.concatenate((self.__buffer[start:], self.__buffer[:start]))
+
+    def columns(self):
+        return tuple(self.array().T)
+
+
+# Size of the .npy header we write. Fixed so the row count can be updated
+# in place, 128 bytes leaves room for any row count.
+_NPY_HEADER_SIZE = 128
+
+def _npy_header(rows, columns):
+    header = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({}, {}), }}".format(rows, columns)
+    # magic, version 1.0, header length, header padded with spaces, newline.
+    length = _NPY_HEADER_SIZE - 10
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', length) + header.ljust(length - 1).encode('latin1') + b'\n'
+
+
+class NpyFileSink(Sink):
+
+    """
+    Streams rows to path as a float64 .npy file. Rows are collected in a
+    block of block_size rows and written out when the block is full, the
+    header is updated on every flush so the file is always valid.
+    np.load(path, mmap_mode='r') opens it without reading it in.
+    """
+    def __init__(self, path, columns = COLUMNS, block_size = 8192):
+        super().__init__(columns)
+        self.__path = path
+        self.__file = open(path, 'wb+')
+        self.__block_values = block_size * len(self.names)
+        self.__pending = []
+        self.__rows = 0
+        self.__file.write(_npy_header(0, len(self.names)))
+
+    @property
+    def path(self):
+        return self.__path
+
+    def __len__(self):
+        return self.__rows + len(self.__pending) // len(self.names)
+
+    def record(self, *values):
+        self.__pending.extend(values)
+        if len(self.__pending) >= self.__block_values:
+            self.__write_block()
+
+    def __write_block(self):
+        self.__file.seek(0, os.SEEK_END)
+        self.__file.write(np.array(self.__pending, dtype='<f8').tobytes())
+        self.__rows += len(self.__pending) // len(self.names)
+        self.__pending = []
+
+    def flush(self):
+        if self.__file.closed:
+            return
+        self.__write_block()
+        self.__file.seek(0)
+        self.__file.write(_npy_header(self.__rows, len(self.names)))
+        self.__file.flush()
+
+    def columns(self):
+        self.flush()
+        return tuple(np.load(self.__path, mmap_mode='r').T)
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+
+class DecimatingSink(Sink):
+
+    """
+    Forwards every Nth row to sink. Rows where one of the on_change
+    columns differs from the last forwarded row are always forwarded,
+    and so is the very last row on close. A flush in the middle of a run
+    does not forward it, that would add rows the decimation left out.
+    """
+    def __init__(self, sink, every = 10, on_change = None):
+        super().__init__(sink.names)
+        self.__sink = sink
+        self.__every = every
+        self.__watch = [ self.names.index(name) for name in (on_change or []) ]
+        self.__last = None
+        self.__pending = None
+        self.__count = 0
+
+    @property
+    def sink(self):
+        return self.__sink
+
+    def record(self, *values):
+        forward = self.__count % self.__every == 0
+        if not forward and self.__watch:
+            for i in self.__watch:
+                if values[i] != self.__last[i]:
+                    forward = True
+                    break
+
+        if forward:
+            self.__sink.record(*values)
+            self.__last = values
+            self.__pending = None
+        else:
+            self.__pending = values
+        self.__count += 1
+
+    def flush(self):
+        self.__sink.flush()
+
+    # Forwarded rows, and the last row while it is pending.
+    def columns(self):
+        columns = self.__sink.columns()
+        if self.__pending is None:
+            return columns
+        return tuple( np.append(column, value) for column, value in zip(columns, self.__pending) )
+
+    def close(self):
+        if self.__pending is not None:
+            self.__sink.record(*self.__pending)
+            self.__last = self.__pending
+            self.__pending = None
+        self.__sink.close()
+
+
+class TelemetryUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test_telemetry.npy')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rows(self, n):
+        return [ (i * 0.1, i, 2.0 * i) for i in range(n) ]
+
+    def test_chunked(self):
+        sink = ChunkedBuffer(['t', 'a', 'b'], chunk_size=16)
+        for row in self.rows(50):
+            sink.record(*row)
+        t, a, b = sink.columns()
+        self.assertEqual( len(sink), 50 )
+        self.assertTrue( np.array_equal(a, np.arange(50)) )
+        self.assertTrue( np.array_equal(b, 2.0 * np.arange(50)) )
+
+    def test_ring(self):
+        sink = RingBuffer(['t', 'a', 'b'], capacity=16)
+        for row in self.rows(10):
+            sink.record(*row)
+        self.assertTrue( np.array_equal(sink.columns()[1], np.arange(10)) )
+        for row in self.rows(50)[10:]:
+            sink.record(*row)
+        self.assertEqual( len(sink), 16 )
+        self.assertTrue( np.array_equal(sink.columns()[1], np.arange(34, 50)) )
+
+    def test_file(self):
+        sink = NpyFileSink(self.path, ['t', 'a', 'b'], block_size=16)
+        for row in self.rows(40):
+            sink.record(*row)
+
+        # Valid after a flush, even while still recording.
+        sink.flush()
+        self.assertEqual( np.load(self.path).shape, (40, 3) )
+
+        for row in self.rows(50)[40:]:
+            sink.record(*row)
+        sink.close()
+
+        data = np.load(self.path, mmap_mode='r')
+        self.assertEqual( data.shape, (50, 3) )
+        self.assertTrue( np.array_equal(data[:, 1], np.arange(50)) )
+
+    def test_decimating(self):
+        sink = DecimatingSink(ChunkedBuffer(['t', 'a', 'stage']), every=10, on_change=['stage'])
+        for i in range(95):
+            sink.record(i * 0.1, i, 0 if i < 33 else 1)
+        t, a, stage = sink.columns()
+        self.assertEqual( a.tolist(), [0, 10, 20, 30, 33, 40, 50, 60, 70, 80, 90, 94] )
+
+        # Flushing along the way adds no rows, close keeps the last one.
+        sink = DecimatingSink(ChunkedBuffer(['t', 'a', 'stage']), every=10)
+        for i in range(95):
+            sink.record(i * 0.1, i, 0)
+            if i % 7 == 0:
+                sink.flush()
+        sink.close()
+        self.assertEqual( sink.sink.columns()[1].tolist(), list(range(0, 95, 10)) + [94] )
+
+
+if __name__ == '__main__':
+    unittest.main()
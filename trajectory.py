@@ -0,0 +1,322 @@
+# Trajectory files
+#
+# Versioned binary format for telemetry and sweep results. Loading goes
+# through np.memmap, so even multi-GB files open instantly and columns or
+# time ranges are only read from disk when used.
+#
+# Layout:
+#   magic    6 bytes  b'RSTRAJ'
+#   version  uint16   little endian
+#   length   uint32   length of the JSON header in bytes
+#   header   JSON     {"columns": [[name, dtype], ...], "metadata": {...}}
+#                     padded with spaces so the records start on a
+#                     multiple of 64 bytes.
+#   records  packed little endian records, one per row.
+#
+# The row count is not stored, it follows from the file size. That keeps
+# appending cheap, and a record cut short by an interrupted write is
+# simply ignored.
+#
+# python trajectory.py convert launch.txt launch.traj
+# python trajectory.py info launch.traj
+import json
+import os
+import struct
+import sys
+import unittest
+import numpy as np
+from telemetry import Sink, COLUMNS
+
+MAGIC = b'RSTRAJ'
+VERSION = 1
+_ALIGN = 64
+
+# Header line np.savetxt wrote in main.py before this format existed.
+_LEGACY_LAUNCH_HEADER = ['time', 'alt', 'drag', 'velocity', 'phi', 'thrust', 'mass_list']
+
+
+def _record_dtype(columns, dtypes):
+    return np.dtype([ (name, np.dtype(dtype).newbyteorder('<')) for name, dtype in zip(columns, dtypes) ])
+
+def _read_header(f):
+    start = f.read(12)
+    if len(start) < 12 or start[:6] != MAGIC:
+        raise ValueError("Not a trajectory file.")
+    version, length = struct.unpack('<HI', start[6:])
+    if version > VERSION:
+        raise ValueError("Trajectory file version {} is newer than supported version {}.".format(version, VERSION))
+    header = json.loads(f.read(length).decode('utf-8'))
+    header['version'] = version
+    header['offset'] = 12 + length
+    return header
+
+
+class TrajectoryWriter(Sink):
+
+    """
+    Writes rows to a trajectory file, also usable as a telemetry sink.
+
+    columns = column names.
+    dtypes = NumPy dtype per column, float64 when not given.
+    metadata = JSON serializable dictionary stored in the header.
+    append = add to an existing file with the same columns instead of
+      starting a new one.
+    block_size = rows collected in memory before they are written.
+    """
+    def __init__(self, path, columns = COLUMNS, dtypes = None, metadata = None, append = False, block_size = 8192):
+        super().__init__(columns)
+        if dtypes is None:
+            dtypes = ['<f8'] * len(self.names)
+        self.__dtype = _record_dtype(self.names, dtypes)
+        # With a single dtype for all columns the records are plain rows,
+        # which NumPy converts a lot faster than structured records.
+        base = self.__dtype[0]
+        self.__row_dtype = base if all( self.__dtype[i] == base for i in range(len(self.names)) ) else None
+        self.__path = path
+        self.__block_size = block_size
+        self.__pending = []
+
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                header = _read_header(f)
+            existing = _record_dtype([ c[0] for c in header['columns'] ], [ c[1] for c in header['columns'] ])
+            if existing != self.__dtype:
+                raise ValueError("Columns of {} do not match.".format(path))
+            self.__file = open(path, 'rb+')
+            # drop a record cut short by an interrupted write.
+            rows = (os.path.getsize(path) - header['offset']) // self.__dtype.itemsize
+            self.__file.truncate(header['offset'] + rows * self.__dtype.itemsize)
+            self.__file.seek(0, os.SEEK_END)
+        else:
+            self.__file = open(path, 'wb')
+            header = json.dumps({
+                'columns': [ [name, self.__dtype[name].str] for name in self.names ],
+                'metadata': metadata or {},
+            }).encode('utf-8')
+            padding = (-(12 + len(header))) % _ALIGN
+            header += b' ' * padding
+            self.__file.write(MAGIC + struct.pack('<HI', VERSION, len(header)) + header)
+
+    @property
+    def path(self):
+        return self.__path
+
+    def record(self, *values):
+        self.__pending.append(values)
+        if len(self.__pending) >= self.__block_size:
+            self.__write_block()
+
+    """
+    Write many rows at once, an (N, columns) array or structured array.
+    """
+    def write(self, rows):
+        self.__write_block()
+        rows = np.asarray(rows)
+        if rows.dtype.names is None:
+            records = np.empty(len(rows), dtype=self.__dtype)
+            for i, name in enumerate(self.names):
+                records[name] = rows[:, i]
+            rows = records
+        self.__file.write(rows.astype(self.__dtype, copy=False).tobytes())
+
+    def __write_block(self):
+        if self.__pending:
+            self.__file.write(np.array(self.__pending, dtype=self.__row_dtype or self.__dtype).tobytes())
+            self.__pending = []
+
+    def flush(self):
+        if self.__file.closed:
+            return
+        self.__write_block()
+        self.__file.flush()
+
+    def columns(self):
+        self.flush()
+        trajectory = Trajectory(self.__path)
+        return tuple( trajectory[name] for name in self.names )
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+
+class Trajectory:
+
+    """
+    Read only view of a trajectory file. Nothing is read until used:
+    trajectory['time'] is a memory mapped column, time_range and rows
+    return memory mapped slices of the records.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = _read_header(f)
+
+        self.__path = path
+        self.__version = header['version']
+        self.__metadata = header['metadata']
+        self.__dtype = _record_dtype([ c[0] for c in header['columns'] ], [ c[1] for c in header['columns'] ])
+
+        rows = (os.path.getsize(path) - header['offset']) // self.__dtype.itemsize
+        if rows > 0:
+            self.__records = np.memmap(path, dtype=self.__dtype, mode='r', offset=header['offset'], shape=(rows,))
+        else:
+            self.__records = np.empty(0, dtype=self.__dtype)
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def version(self):
+        return self.__version
+
+    @property
+    def metadata(self):
+        return self.__metadata
+
+    @property
+    def columns(self):
+        return list(self.__dtype.names)
+
+    @property
+    def dtype(self):
+        return self.__dtype
+
+    @property
+    def records(self):
+        return self.__records
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __getitem__(self, name):
+        return self.__records[name]
+
+    """
+    Records start up to stop, memory mapped.
+    """
+    def rows(self, start = None, stop = None):
+        return self.__records[start:stop]
+
+    """
+    Records with start <= column < stop, column must be increasing.
+    """
+    def time_range(self, start = None, stop = None, column = 'time'):
+        t = self.__records[column]
+        first = 0 if start is None else np.searchsorted(t, start, side='left')
+        last = len(t) if stop is None else np.searchsorted(t, stop, side='left')
+        return self.__records[first:last]
+
+
+"""
+Convert a CSV file written by np.savetxt, like the launch.txt main.py used
+to write, into a trajectory file. Column names come from the '#' header
+line unless given. The CSV is read in blocks of block_size lines so it
+never has to fit in memory.
+"""
+def convert_csv(csv_path, trajectory_path, columns = None, delimiter = ',', block_size = 65536, metadata = None):
+
+    with open(csv_path, 'rt') as f:
+        first = f.readline()
+        if first.startswith('#'):
+            names = [ name.strip() for name in first[1:].split(delimiter) ]
+        else:
+            names = None
+            f.seek(0)
+
+        if columns is None:
+            if names == _LEGACY_LAUNCH_HEADER:
+                columns = COLUMNS
+            elif names is not None:
+                columns = names
+            else:
+                raise ValueError("{} has no header, please pass the column names.".format(csv_path))
+
+        writer = TrajectoryWriter(trajectory_path, columns, metadata=metadata)
+        while True:
+            lines = [ line for line in (f.readline() for i in range(block_size)) if line ]
+            if not lines:
+                break
+            writer.write(np.loadtxt(lines, delimiter=delimiter, ndmin=2))
+        writer.close()
+
+    return Trajectory(trajectory_path)
+
+
+
+class TrajectoryUnitTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test_trajectory.traj')
+        self.csv = os.path.join(self.directory.name, 'test_trajectory.txt')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        writer = TrajectoryWriter(self.path, ['time', 'altitude', 'stage'], ['<f8', '<f4', '<i4'], {'payload': 8000.0}, block_size=16)
+        for i in range(100):
+            writer.record(i * 0.5, i * 10.0, i // 40)
+        writer.close()
+
+        trajectory = Trajectory(self.path)
+        self.assertEqual( trajectory.version, VERSION )
+        self.assertEqual( trajectory.columns, ['time', 'altitude', 'stage'] )
+        self.assertEqual( trajectory.metadata, {'payload': 8000.0} )
+        self.assertEqual( len(trajectory), 100 )
+        self.assertEqual( trajectory['stage'].dtype, np.dtype('<i4') )
+        self.assertTrue( np.array_equal(trajectory['altitude'], np.arange(100) * 10.0) )
+        self.assertTrue( isinstance(trajectory.records, np.memmap) )
+
+        part = trajectory.time_range(10.0, 20.0)
+        self.assertEqual( part['time'][0], 10.0 )
+        self.assertEqual( part['time'][-1], 19.5 )
+
+    def test_append(self):
+        writer = TrajectoryWriter(self.path, ['a', 'b'])
+        writer.write(np.ones((10, 2)))
+        writer.close()
+
+        # Half a record left behind by an interrupted write.
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 5)
+        self.assertEqual( len(Trajectory(self.path)), 10 )
+
+        writer = TrajectoryWriter(self.path, ['a', 'b'], append=True)
+        writer.record(2.0, 3.0)
+        writer.close()
+        trajectory = Trajectory(self.path)
+        self.assertEqual( len(trajectory), 11 )
+        self.assertEqual( trajectory['b'][-1], 3.0 )
+
+        with self.assertRaises(ValueError):
+            TrajectoryWriter(self.path, ['a', 'c'], append=True)
+
+    def test_convert(self):
+        data = np.arange(70, dtype=float).reshape(10, 7)
+        np.savetxt(self.csv, data, header='time, alt, drag, velocity, phi, thrust, mass_list', delimiter=',')
+        trajectory = convert_csv(self.csv, self.path, block_size=3)
+        self.assertEqual( trajectory.columns, COLUMNS )
+        self.assertTrue( np.array_equal(trajectory['mass'], data[:, 6]) )
+
+    def test_bad_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a trajectory')
+        with self.assertRaises(ValueError):
+            Trajectory(self.path)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 4 and sys.argv[1] == 'convert':
+        trajectory = convert_csv(sys.argv[2], sys.argv[3])
+        print("{} rows, columns {}".format(len(trajectory), trajectory.columns))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'info':
+        trajectory = Trajectory(sys.argv[2])
+        print("version {}, {} rows".format(trajectory.version, len(trajectory)))
+        print("columns {}".format(trajectory.dtype))
+        print("metadata {}".format(trajectory.metadata))
+    else:
+        unittest.main()
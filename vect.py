@@ -77,13 +77,14 @@ class Vector:
         return [r,theta, phi]
 
     """
-    Converts the coordinates from spherical to Cartesian
+    Converts the coordinates from spherical to Cartesian, [r, theta, phi]
+    as toSpherical returns them. z is r cos(theta), it used to take phi.
     """
     @staticmethod
     def toCartesian( vect ):
         x = vect[0] * math.sin( vect[1] ) * math.cos( vect[2] )
         y = vect[0] * math.sin( vect[1] ) * math.sin( vect[2] )
-        z = vect[0] * math.cos( vect[2] )
+        z = vect[0] * math.cos( vect[1] )
         return [x,y,z]
 
     """
@@ -182,6 +183,12 @@ class Vector:
 
         return self
 
+    """
+    Calculate dot product.
+    """
+    def dot(self, other):
+        return self[0] * other[0] + self[1] * other[1] + self[2] * other[2]
+
     """
     Calculate cross product. Creates a new vector without modifying current.
     """    
@@ -222,19 +229,306 @@ class Vector:
         else:
             return np.all(np.isclose(self._pos, other))
 
-        
+
+"""
+Slotted 3d vector with plain float fields.
+
+Drop in replacement for Vector on the hot path of the simulation: no list
+storage, no NumPy round trips, fused in-place operations and a rotation
+matrix that is only rebuilt when angle or axis change.
+"""
+class Vec3:
+
+    __slots__ = ('x', 'y', 'z')
+
+    # (angle, axis x, axis y, axis z) and the 3x3 rotation matrix of the
+    # last rotate call, most calls rotate by the same angle and axis.
+    _rotation = (None, None)
+
+    """
+    constructor creates a deep copy of the other parameter
+    """
+    def __init__(self, other = None):
+        if other is None:
+            self.x = 0.0
+            self.y = 0.0
+            self.z = 0.0
+        else:
+            self.x = float(other[0])
+            self.y = float(other[1])
+            self.z = float(other[2])
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self.x
+        if key == 1:
+            return self.y
+        if key == 2:
+            return self.z
+        return [self.x, self.y, self.z][key]
+
+    def __setitem__(self, key, value):
+        if key == 0:
+            self.x = value
+        elif key == 1:
+            self.y = value
+        elif key == 2:
+            self.z = value
+        else:
+            raise IndexError("Vec3 index out of range")
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+        yield self.z
+
+    def __str__(self):
+        return "({},{},{})".format(self.x, self.y, self.z)
+
+    """
+    Zero out all elements.
+    """
+    def zero(self):
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+
+    """
+    Calculates the Euclidean norm
+    """
+    @property
+    def magnitude(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    """
+    Calculate Theta in ISO system
+    (Inclination)
+    """
+    @property
+    def theta(self):
+        return math.acos( self.z / self.magnitude )
+
+    """
+    Calculate Phi in ISO system
+    (Azimuth)
+    """
+    @property
+    def phi(self):
+        return math.atan2( self.y, self.x )
+
+    """
+    Converts the Cartesian coordinates to spherical system
+    """
+    @staticmethod
+    def toSpherical( vect ):
+        r = math.sqrt(vect[0] * vect[0] + vect[1] * vect[1] + vect[2] * vect[2])
+        theta = math.acos( vect[2] / r)
+        phi = math.atan2( vect[1], vect[0] )
+        return [r,theta, phi]
+
+    """
+    Converts the coordinates from spherical to Cartesian
+    """
+    @staticmethod
+    def toCartesian( vect ):
+        x = vect[0] * math.sin( vect[1] ) * math.cos( vect[2] )
+        y = vect[0] * math.sin( vect[1] ) * math.sin( vect[2] )
+        z = vect[0] * math.cos( vect[1] )
+        return [x,y,z]
+
+    """
+    Copy of the parametes
+    """
+    def assign( self, other ):
+        if type(other) is Vec3:
+            self.x = other.x
+            self.y = other.y
+            self.z = other.z
+        else:
+            self.x = other[0]
+            self.y = other[1]
+            self.z = other[2]
+        return self
+
+    """
+    Multiply the vector with a float
+    """
+    def mult( self, factor ):
+        self.x *= factor
+        self.y *= factor
+        self.z *= factor
+        return self
+
+    """
+    Add another vector to self
+    """
+    def add( self, other ):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    """
+    Add other * factor to self, without a temporary vector.
+    """
+    def add_scaled( self, other, factor ):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        self.x += other.x * factor
+        self.y += other.y * factor
+        self.z += other.z * factor
+        return self
+
+    """
+    BLAS style self = factor * other + self.
+    """
+    def axpy( self, factor, other ):
+        return self.add_scaled(other, factor)
+
+    """
+    Subtract another vector from self
+    """
+    def sub( self, other):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+
+    """
+    Create a deepcopy of the vector
+    """
+    def deepcopy(self):
+        return _vec3(self.x, self.y, self.z)
+
+    """
+    Normalize the vector to length (magnitude) 1
+    """
+    def normalize(self):
+        return self.mult( 1.0 / self.magnitude )
+
+    """
+    Rotate the vector around axis for angle radians
+    Like Vector.rotate the axis is normalized in place.
+    """
+    def rotate(self, angle, axis):
+        axis.normalize()
+
+        key, Q = Vec3._rotation
+        if key != (angle, axis[0], axis[1], axis[2]):
+            key = (angle, axis[0], axis[1], axis[2])
+
+            s = math.sin(angle/2.0)
+            q0 = math.cos(angle/2.0)
+            q1 = s * axis[0]
+            q2 = s * axis[1]
+            q3 = s * axis[2]
+
+            q02 = q0*q0
+            q12 = q1*q1
+            q22 = q2*q2
+            q32 = q3*q3
+
+            Q = (
+                q02 + q12 - q22 - q32, 2.0 * ( q1*q2 - q0*q3 ), 2.0 * ( q1*q3 + q0*q2 ),
+                2.0 * ( q1*q2 + q0*q3 ), q02 - q12 + q22 - q32, 2.0 * ( q2*q3 - q0*q1 ),
+                2.0 * ( q1*q3 - q0*q2 ), 2.0 * ( q2*q3 + q0*q1 ), q02 - q12 - q22 + q32,
+            )
+            Vec3._rotation = (key, Q)
+
+        x = self.x
+        y = self.y
+        z = self.z
+        self.x = Q[0] * x + Q[1] * y + Q[2] * z
+        self.y = Q[3] * x + Q[4] * y + Q[5] * z
+        self.z = Q[6] * x + Q[7] * y + Q[8] * z
+        return self
+
+    """
+    Calculate dot product.
+    """
+    def dot(self, other):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        return self.x * other.x + self.y * other.y + self.z * other.z
+
+    """
+    Calculate cross product. Creates a new vector without modifying current.
+    """
+    def cross(self, other):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        return _vec3(
+            self.y * other.z - self.z * other.y,
+            self.z * other.x - self.x * other.z,
+            self.x * other.y - self.y * other.x
+        )
+
+    def __mul__(self, factor):
+        return _vec3(self.x * factor, self.y * factor, self.z * factor)
+
+    def __rmul__(self, factor):
+        return _vec3(self.x * factor, self.y * factor, self.z * factor)
+
+    def __add__(self, other):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        return _vec3(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __radd__(self, other):
+        return _vec3(other[0] + self.x, other[1] + self.y, other[2] + self.z)
+
+    def __sub__(self, other):
+        if type(other) is not Vec3:
+            other = Vec3(other)
+        return _vec3(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __rsub__(self, other):
+        return _vec3(other[0] - self.x, other[1] - self.y, other[2] - self.z)
+
+    def __iadd__(self, other):
+        return self.add(other)
+
+    def __isub__(self, other):
+        return self.sub(other)
+
+    def __imul__(self, factor):
+        return self.mult(factor)
+
+    def __eq__(self, other):
+        return (math.isclose(self.x, other[0], rel_tol=1e-05, abs_tol=1e-08) and
+                math.isclose(self.y, other[1], rel_tol=1e-05, abs_tol=1e-08) and
+                math.isclose(self.z, other[2], rel_tol=1e-05, abs_tol=1e-08))
+
+
+# Builds a Vec3 from floats, skips the conversions in the constructor.
+def _vec3(x, y, z):
+    v = Vec3.__new__(Vec3)
+    v.x = x
+    v.y = y
+    v.z = z
+    return v
+
 
 class VectorUnitTest(unittest.TestCase):
 
+    Vector = Vector
+
     def test_equals(self):
-        a = Vector([1.1, 1.2, 1.3])
-        b = Vector([11.0, 12.0, 13.0])
+        a = self.Vector([1.1, 1.2, 1.3])
+        b = self.Vector([11.0, 12.0, 13.0])
         b.mult(0.1)
         self.assertTrue( a == b )
 
     def test_assign(self):
-        a = Vector([1.0, 2.0, 3.0])        
-        b = Vector()
+        a = self.Vector([1.0, 2.0, 3.0])        
+        b = self.Vector()
         b.assign(a)
         self.assertTrue( a == b )
         c = b
@@ -245,53 +539,53 @@ class VectorUnitTest(unittest.TestCase):
         self.assertTrue( a == d )
 
     def test_add(self):
-        a = Vector([1.1, 1.2, 1.3])
-        b = Vector([2.0, 3.0, 4.0])
-        c = Vector([3.1, 4.2, 5.3])
+        a = self.Vector([1.1, 1.2, 1.3])
+        b = self.Vector([2.0, 3.0, 4.0])
+        c = self.Vector([3.1, 4.2, 5.3])
         d = a + b
         self.assertTrue( d == c )
-        self.assertTrue( a == Vector([1.1, 1.2, 1.3]) )
-        self.assertTrue( b == Vector([2.0, 3.0, 4.0]) )
+        self.assertTrue( a == self.Vector([1.1, 1.2, 1.3]) )
+        self.assertTrue( b == self.Vector([2.0, 3.0, 4.0]) )
 
     def test_sub(self):
-        a = Vector([1.1, 1.2, 1.3])
-        b = Vector([2.0, 3.0, 4.0])
-        c = Vector([-0.9, -1.8, -2.7])
+        a = self.Vector([1.1, 1.2, 1.3])
+        b = self.Vector([2.0, 3.0, 4.0])
+        c = self.Vector([-0.9, -1.8, -2.7])
         d = a - b
         self.assertTrue( d == c )
-        self.assertTrue( a == Vector([1.1, 1.2, 1.3]) )
-        self.assertTrue( b == Vector([2.0, 3.0, 4.0]) )
+        self.assertTrue( a == self.Vector([1.1, 1.2, 1.3]) )
+        self.assertTrue( b == self.Vector([2.0, 3.0, 4.0]) )
 
 
     def test_mult(self):
-        a = Vector([1.1, 1.2, 1.3])        
-        b = Vector([2.2, 2.4, 2.6])
+        a = self.Vector([1.1, 1.2, 1.3])        
+        b = self.Vector([2.2, 2.4, 2.6])
         c = a * 2.0
         self.assertTrue( b == c )
-        self.assertTrue( a == Vector([1.1, 1.2, 1.3]) )
+        self.assertTrue( a == self.Vector([1.1, 1.2, 1.3]) )
         c = 2.0 * a
         self.assertTrue( b == c )
 
     def test_magnitude(self):
-        a = Vector([1.0, 2.0, 3.0])        
+        a = self.Vector([1.0, 2.0, 3.0])        
         self.assertTrue( a.magnitude == math.sqrt(14.0) )
         a = a * 2.0
         self.assertTrue( a.magnitude == math.sqrt(56.0) )
 
     def test_rotate1(self):
 
-        axis = Vector([0.0,0.0,1.0])
-        a = Vector([1.0,0.0,0.0])
-        b = Vector([0.0,1.0,0.0])
+        axis = self.Vector([0.0,0.0,1.0])
+        a = self.Vector([1.0,0.0,0.0])
+        b = self.Vector([0.0,1.0,0.0])
 
         a.rotate( 90 * math.pi / 180.0, axis)
         self.assertTrue(a==b)
 
     def test_rotate2(self):
 
-        axis = Vector([0.0,0.0,1.0])
-        a = Vector([1.0,0.0,0.0])
-        b = Vector([0.0,-1.0,0.0])
+        axis = self.Vector([0.0,0.0,1.0])
+        a = self.Vector([1.0,0.0,0.0])
+        b = self.Vector([0.0,-1.0,0.0])
 
         a.rotate( -90 * math.pi / 180.0, axis)
         self.assertTrue(a==b)
@@ -299,48 +593,92 @@ class VectorUnitTest(unittest.TestCase):
 
     def test_rotate3(self):
 
-        axis = Vector([0.0,1.0,0.0])
-        a = Vector([1.0,0.0,0.0])
-        b = Vector([0.0,0.0,-1.0])
+        axis = self.Vector([0.0,1.0,0.0])
+        a = self.Vector([1.0,0.0,0.0])
+        b = self.Vector([0.0,0.0,-1.0])
 
         a.rotate( 90 * math.pi / 180.0, axis)
         self.assertTrue(a==b)
 
     def test_rotate4(self):
 
-        axis = Vector([1.0,0.0,0.0])
-        a = Vector([0.0,1.0,0.0])
-        b = Vector([0.0,0.0,1.0])
+        axis = self.Vector([1.0,0.0,0.0])
+        a = self.Vector([0.0,1.0,0.0])
+        b = self.Vector([0.0,0.0,1.0])
 
         a.rotate( 90 * math.pi / 180.0, axis)
         self.assertTrue(a==b)
 
     def test_rotate5(self):
 
-        axis = Vector([1.0,1.0,1.0])
-        a = Vector([1.0,0.0,0.0])
-        b = Vector([0.33333333333333337,0.9106836025229592,-0.24401693585629242])        
+        axis = self.Vector([1.0,1.0,1.0])
+        a = self.Vector([1.0,0.0,0.0])
+        b = self.Vector([0.33333333333333337,0.9106836025229592,-0.24401693585629242])        
         a.rotate( 90 * math.pi / 180.0, axis)        
         self.assertTrue(a==b)
 
     def test_perpendicular1(self):
         
-        a = Vector([1.0,0.0,0.0])
-        b = Vector([0.0,1.0,0.0])
-        c = Vector([0.0,0.0,1.0])
+        a = self.Vector([1.0,0.0,0.0])
+        b = self.Vector([0.0,1.0,0.0])
+        c = self.Vector([0.0,0.0,1.0])
         d = a.cross(b)
         self.assertTrue(c == d)
 
 
     def test_perpendicular2(self):
         
-        a = Vector([0.0,0.0,1.0])
-        b = Vector([0.0,1.0,0.0])
-        c = Vector([-1.0,0.0,0.0])
+        a = self.Vector([0.0,0.0,1.0])
+        b = self.Vector([0.0,1.0,0.0])
+        c = self.Vector([-1.0,0.0,0.0])
         d = a.cross(b)
         self.assertTrue(c == d)
 
 
 
+class Vec3UnitTest(VectorUnitTest):
+
+    # Run every Vector test against Vec3 as well.
+    Vector = Vec3
+
+    def test_slots(self):
+        a = Vec3([1.0, 2.0, 3.0])
+        with self.assertRaises(AttributeError):
+            a.w = 1.0
+
+    def test_add_scaled(self):
+        a = Vec3([1.0, 2.0, 3.0])
+        b = Vec3([1.0, 1.0, 2.0])
+        c = a.add_scaled(b, 2.0)
+        self.assertTrue( c is a )
+        self.assertTrue( a == Vec3([3.0, 4.0, 7.0]) )
+        a.axpy(-1.0, b)
+        self.assertTrue( a == Vec3([2.0, 3.0, 5.0]) )
+
+    def test_rotate_cached(self):
+        axis = Vec3([0.0,0.0,1.0])
+        a = Vec3([1.0,0.0,0.0])
+        a.rotate( 90 * math.pi / 180.0, axis)
+        a.rotate( 90 * math.pi / 180.0, axis)
+        self.assertTrue( a == Vec3([-1.0,0.0,0.0]) )
+        a.rotate( -90 * math.pi / 180.0, Vec3([0.0,0.0,2.0]))
+        self.assertTrue( a == Vec3([0.0,1.0,0.0]) )
+
+    def test_mixed(self):
+        a = Vector([1.0, 2.0, 3.0])
+        b = Vec3([1.0, 2.0, 3.0])
+        self.assertTrue( a == b )
+        self.assertTrue( b == a )
+        self.assertTrue( np.allclose(np.array(b), [1.0, 2.0, 3.0]) )
+
+    def test_spherical(self):
+        for p in [[1.0, 2.0, 3.0], [-4.0, 0.5, -2.0], [0.0, 0.0, 7.0]]:
+            spherical = Vector.toSpherical(Vector(p))
+            self.assertTrue( np.allclose(Vec3.toSpherical(Vec3(p)), spherical) )
+            # Both round trip, to the same point.
+            self.assertTrue( np.allclose(Vector.toCartesian(spherical), p) )
+            self.assertTrue( np.allclose(Vec3.toCartesian(spherical), p) )
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file